@@ -104,6 +104,14 @@ class SearchBaseAction(Action):
         10,
         description="The maximum number of search hits to display.",
     )
+    max_related_hops: int = Field(
+        0,
+        description="The number of relationships to follow from the found code to related code, also in other files. Related code isn't added by default.",
+    )
+    max_related_tokens: int = Field(
+        1000,
+        description="The maximum number of tokens of related code to add to the found code.",
+    )
     completion_model: CompletionModel = Field(
         ...,
         description="The completion model used to identify relevant code sections in search results.",
@@ -169,6 +177,9 @@ class SearchBaseAction(Action):
         else:
             view_context = search_result_context
 
+        if not view_context.is_empty():
+            self._add_related_spans(view_context)
+
         span_count = search_result_context.span_count()
         search_result_str = f"Found {span_count} code sections."
 
@@ -236,6 +247,26 @@ class SearchBaseAction(Action):
 
         return search_result_context, alternative_suggestion
 
+    def _add_related_spans(self, view_context: FileContext):
+        """Add code that the found code uses or is used by, to not need another search to find it."""
+        if not self._code_index or not self.max_related_hops:
+            return
+
+        related_files = self._code_index.find_related_spans(
+            view_context.to_files_with_spans(),
+            max_hops=self.max_related_hops,
+            max_tokens=self.max_related_tokens,
+        )
+        for related_file in related_files:
+            view_context.add_spans_to_context(
+                related_file.file_path, set(related_file.span_ids), add_extra=False
+            )
+
+        if related_files:
+            logger.info(
+                f"{self.name}: Added {sum(len(file.span_ids) for file in related_files)} related code sections in {len(related_files)} files."
+            )
+
     def _select_span_instructions(self, search_result: SearchCodeResponse) -> str:
         if not self.add_to_context:
             return f"Here's the search result with the first line of codes in each code block. Use ViewCode to view specific code sections. "
@@ -0,0 +1,115 @@
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from moatless_qa.codeblocks.codeblocks import CodeBlock
+
+
+class CodeGraph:
+    """
+    Directed graph of the relationships between the code blocks in a module. Nodes are block path strings
+    interned to integer ids, and edges are kept as two id arrays that are indexed as CSR adjacency arrays
+    in both directions on the first lookup.
+    """
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._names: list[str] = []
+        self._blocks: list[Optional["CodeBlock"]] = []
+        self._sources: list[int] = []
+        self._targets: list[int] = []
+        self._adjacency: Optional[tuple[np.ndarray, ...]] = None
+
+    def _node_id(self, name: str) -> int:
+        node_id = self._ids.get(name)
+        if node_id is None:
+            node_id = len(self._names)
+            self._ids[name] = node_id
+            self._names.append(name)
+            self._blocks.append(None)
+        return node_id
+
+    def add_node(self, name: str, block: Optional["CodeBlock"] = None):
+        node_id = self._node_id(name)
+        if block is not None:
+            self._blocks[node_id] = block
+
+    def add_edge(self, source: str, target: str):
+        self._sources.append(self._node_id(source))
+        self._targets.append(self._node_id(target))
+        self._adjacency = None
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    @property
+    def names(self) -> list[str]:
+        return self._names
+
+    @property
+    def blocks(self) -> list[Optional["CodeBlock"]]:
+        return self._blocks
+
+    def edge_ids(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the source and target node ids of all edges."""
+        return (
+            np.asarray(self._sources, dtype=np.int32),
+            np.asarray(self._targets, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_edge_ids(
+        cls,
+        names: list[str],
+        blocks: list[Optional["CodeBlock"]],
+        sources: np.ndarray,
+        targets: np.ndarray,
+    ) -> "CodeGraph":
+        graph = cls()
+        graph._names = list(names)
+        graph._ids = {name: i for i, name in enumerate(graph._names)}
+        graph._blocks = list(blocks)
+        graph._sources = np.asarray(sources, dtype=np.int32).tolist()
+        graph._targets = np.asarray(targets, dtype=np.int32).tolist()
+        return graph
+
+    def _csr(self, keys: np.ndarray, values: np.ndarray):
+        order = np.argsort(keys, kind="stable")
+        offsets = np.zeros(len(self._names) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(keys, minlength=len(self._names)))
+        return offsets, values[order]
+
+    def _get_adjacency(self) -> tuple[np.ndarray, ...]:
+        if self._adjacency is None:
+            sources, targets = self.edge_ids()
+            out_offsets, out_ids = self._csr(sources, targets)
+            in_offsets, in_ids = self._csr(targets, sources)
+            self._adjacency = (out_offsets, out_ids, in_offsets, in_ids)
+        return self._adjacency
+
+    def _neighbour_blocks(
+        self, name: str, offsets: np.ndarray, ids: np.ndarray
+    ) -> Iterator["CodeBlock"]:
+        node_id = self._ids.get(name)
+        if node_id is None:
+            return
+
+        for neighbour_id in set(ids[offsets[node_id] : offsets[node_id + 1]].tolist()):
+            block = self._blocks[neighbour_id]
+            if block is not None:
+                yield block
+
+    def successor_blocks(self, name: str) -> Iterator["CodeBlock"]:
+        """Yields the blocks that the node has relationships to."""
+        out_offsets, out_ids, _, _ = self._get_adjacency()
+        return self._neighbour_blocks(name, out_offsets, out_ids)
+
+    def predecessor_blocks(self, name: str) -> Iterator["CodeBlock"]:
+        """Yields the blocks with relationships to the node."""
+        _, _, in_offsets, in_ids = self._get_adjacency()
+        return self._neighbour_blocks(name, in_offsets, in_ids)
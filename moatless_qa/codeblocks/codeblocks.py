@@ -201,7 +201,7 @@ class RelationshipType(str, Enum):
     TYPE = "type"
 
 
-@dataclass
+@dataclass(slots=True)
 class Relationship:
     scope: ReferenceScope
     external_path: list[str] = field(default_factory=list)
@@ -237,7 +237,7 @@ class Relationship:
         return f"({start_node})-[:{self.type.name} {{scope: {self.scope.value}}}]->({end_node})"
 
 
-@dataclass
+@dataclass(slots=True)
 class Parameter:
     identifier: str
     type: Optional[str] = None
@@ -249,7 +249,7 @@ class SpanType(str, Enum):
     IMPLEMENTATION = "impl"
 
 
-@dataclass
+@dataclass(slots=True)
 class BlockSpan:
     span_id: str
     span_type: SpanType
@@ -282,10 +282,43 @@ class ValidationError:
     error: str
 
 
-@dataclass(eq=False, repr=False, slots=True)
+class SourceBuffer:
+    """The bytes of a parsed file, shared by all code blocks in the module."""
+
+    __slots__ = ("_view", "encoding")
+
+    def __init__(self, content: bytes, encoding: str = "utf8"):
+        self._view = memoryview(content)
+        self.encoding = encoding
+
+    def decode(self, start: int, end: int) -> str:
+        return str(self._view[start:end], self.encoding)
+
+    def tobytes(self) -> bytes:
+        return self._view.tobytes()
+
+    def __reduce__(self):
+        # Memoryviews can't be pickled, pickle memoizes the buffer so it's written once per module
+        return SourceBuffer, (self.tobytes(), self.encoding)
+
+
+@dataclass(frozen=True, slots=True)
+class SourceRange:
+    """Text in a SourceBuffer that is decoded each time it's read instead of being kept as a string."""
+
+    source: SourceBuffer
+    start: int
+    end: int
+
+    def text(self) -> str:
+        return self.source.decode(self.start, self.end)
+
+
+@dataclass(init=False, eq=False, repr=False, slots=True)
 class CodeBlock:
     type: CodeBlockType
-    content: str
+    # The code is kept as a string or as a SourceRange in the parsed file until it's read with content
+    _content: str | SourceRange = ""
     identifier: Optional[str] = None
     parameters: List["Parameter"] = field(default_factory=list)
     relationships: List["Relationship"] = field(default_factory=list)
@@ -295,7 +328,7 @@ class CodeBlock:
     start_line: int = 0
     end_line: int = 0
     properties: Dict = field(default_factory=dict)
-    pre_code: str = ""
+    _pre_code: str | SourceRange = ""
     pre_lines: int = 0
     indentation: str = ""
     tokens: int = 0
@@ -307,6 +340,71 @@ class CodeBlock:
 
     _content_lines: Optional[List[str]] = field(default=None, init=False)
 
+    def __init__(
+        self,
+        type: CodeBlockType,
+        content: str | SourceRange,
+        identifier: Optional[str] = None,
+        parameters: Optional[List["Parameter"]] = None,
+        relationships: Optional[List["Relationship"]] = None,
+        span_ids: Optional[Set[str]] = None,
+        belongs_to_span: Optional["BlockSpan"] = None,
+        has_error: bool = False,
+        start_line: int = 0,
+        end_line: int = 0,
+        properties: Optional[Dict] = None,
+        pre_code: str | SourceRange = "",
+        pre_lines: int = 0,
+        indentation: str = "",
+        tokens: int = 0,
+        children: Optional[List["CodeBlock"]] = None,
+        validation_errors: Optional[List[str]] = None,
+        parent: Optional["CodeBlock"] = None,
+        previous: Optional["CodeBlock"] = None,
+        next: Optional["CodeBlock"] = None,
+    ):
+        self.type = type
+        self._content = content
+        self.identifier = identifier
+        self.parameters = [] if parameters is None else parameters
+        self.relationships = [] if relationships is None else relationships
+        self.span_ids = set() if span_ids is None else span_ids
+        self.belongs_to_span = belongs_to_span
+        self.has_error = has_error
+        self.start_line = start_line
+        self.end_line = end_line
+        self.properties = {} if properties is None else properties
+        self._pre_code = pre_code
+        self.pre_lines = pre_lines
+        self.indentation = indentation
+        self.tokens = tokens
+        self.children = [] if children is None else children
+        self.validation_errors = [] if validation_errors is None else validation_errors
+        self.parent = parent
+        self.previous = previous
+        self.next = next
+        self.__post_init__()
+
+    @property
+    def content(self) -> str:
+        if type(self._content) is SourceRange:
+            self._content = self._content.text()
+        return self._content
+
+    @content.setter
+    def content(self, value: str | SourceRange):
+        self._content = value
+
+    @property
+    def pre_code(self) -> str:
+        if type(self._pre_code) is SourceRange:
+            self._pre_code = self._pre_code.text()
+        return self._pre_code
+
+    @pre_code.setter
+    def pre_code(self, value: str | SourceRange):
+        self._pre_code = value
+
     def __post_init__(self):
         self._content_lines = None
 
@@ -314,12 +412,14 @@ class CodeBlock:
             for child in self.children:
                 child.parent = self
 
-        if self.pre_code and not self.indentation and not self.pre_lines:
-            pre_code_lines = self.pre_code.split("\n")
+        if self._pre_code and not self.indentation and not self.pre_lines:
+            # Decoded without keeping the string to leave the pre_code as a range in the source
+            pre_code = self._pre_code
+            if type(pre_code) is SourceRange:
+                pre_code = pre_code.text()
+            pre_code_lines = pre_code.split("\n")
             self.pre_lines = len(pre_code_lines) - 1
-            self.indentation = (
-                pre_code_lines[-1] if self.pre_lines > 0 else self.pre_code
-            )
+            self.indentation = pre_code_lines[-1] if self.pre_lines > 0 else pre_code
 
     @property
     def content_lines(self):
@@ -1333,3 +1433,4 @@ class CodeBlock:
             return False
 
         return any(child.has_content(query, span_id) for child in self.children)
+
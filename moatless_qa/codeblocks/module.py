@@ -2,9 +2,8 @@ import logging
 from dataclasses import field, dataclass
 from typing import Optional, Dict
 
-from networkx import DiGraph
-
 from moatless_qa.codeblocks import CodeBlock, CodeBlockType
+from moatless_qa.codeblocks.code_graph import CodeGraph
 from moatless_qa.codeblocks.codeblocks import BlockSpan, SpanType
 
 logger = logging.getLogger(__name__)
@@ -19,8 +18,8 @@ class Module(CodeBlock):
     code_block: CodeBlock = field(
         default_factory=lambda: CodeBlock(content="", type=CodeBlockType.MODULE)
     )
-    _graph: DiGraph = field(
-        default_factory=DiGraph, init=False
+    _graph: CodeGraph = field(
+        default_factory=CodeGraph, init=False
     )  # TODO: Move to central CodeGraph
 
     def __post_init__(self):
@@ -116,20 +115,12 @@ class Module(CodeBlock):
         blocks = self.find_blocks_by_span_id(span_id)
         for block in blocks:
             # Find successors (outgoing relationships)
-            successors = list(self._graph.successors(block.path_string()))
-            for succ in successors:
-                node_data = self._graph.nodes[succ]
-                if "block" in node_data:
-                    span = node_data["block"].belongs_to_span
-                    related_span_ids.add(span.span_id)
+            for related_block in self._graph.successor_blocks(block.path_string()):
+                related_span_ids.add(related_block.belongs_to_span.span_id)
 
             # Find predecessors (incoming relationships)
-            predecessors = list(self._graph.predecessors(block.path_string()))
-            for pred in predecessors:
-                node_data = self._graph.nodes[pred]
-                if "block" in node_data:
-                    span = node_data["block"].belongs_to_span
-                    related_span_ids.add(span.span_id)
+            for related_block in self._graph.predecessor_blocks(block.path_string()):
+                related_span_ids.add(related_block.belongs_to_span.span_id)
 
             # Always add parent class initation span
             if block.parent and block.parent.type == CodeBlockType.CLASS:
@@ -0,0 +1,271 @@
+"""On-disk cache of parsed modules, shared between processes and keyed by the hash of the file content."""
+
+import hashlib
+import logging
+import os
+import pickle
+import zlib
+from dataclasses import fields
+from typing import Any, Optional
+
+from moatless_qa.codeblocks import get_parser_by_path
+from moatless_qa.codeblocks.codeblocks import (
+    BlockSpan,
+    CodeBlock,
+    CodeBlockType,
+    SourceBuffer,
+    SourceRange,
+)
+from moatless_qa.codeblocks.code_graph import CodeGraph
+from moatless_qa.codeblocks.module import Module
+
+logger = logging.getLogger(__name__)
+
+# Bump when the parser output or the snapshot format changes to not load stale snapshots
+SNAPSHOT_VERSION = 3
+
+SUPPORTED_EXTENSIONS = {".py", ".java"}
+
+_BLOCK_FIELDS = [f.name for f in fields(CodeBlock)]
+_SPAN_FIELDS = [f.name for f in fields(BlockSpan)]
+_BLOCK_REF_FIELDS = {"parent", "previous", "next"}
+_TEXT_FIELDS = {"_content", "_pre_code"}
+
+_module_cache: Optional["ModuleCache"] = None
+
+
+def _iter_blocks(module: Module):
+    """Yields the blocks of the module in pre-order, without recursion."""
+    stack = [module]
+    while stack:
+        block = stack.pop()
+        yield block
+        stack.extend(reversed(block.children))
+
+
+def encode_module(module: Module) -> dict[str, Any]:
+    """
+    Flatten a module to a snapshot where references between blocks and spans are list indexes, so that
+    it can be pickled without recursing through the linked blocks.
+    """
+    blocks = list(_iter_blocks(module))
+    block_index = {id(block): i for i, block in enumerate(blocks)}
+
+    spans = list(module.spans_by_id.values())
+    span_index = {id(span): i for i, span in enumerate(spans)}
+    for block in blocks:
+        span = block.belongs_to_span
+        if span is not None and id(span) not in span_index:
+            span_index[id(span)] = len(spans)
+            spans.append(span)
+
+    source: SourceBuffer | None = None
+
+    def encode_text(block: CodeBlock, name: str):
+        nonlocal source
+        value = getattr(block, name)
+        if type(value) is SourceRange:
+            if source is None:
+                source = value.source
+            if value.source is source:
+                return value.start, value.end
+            return value.text()
+        return value
+
+    def encode_ref(value):
+        return None if value is None else block_index.get(id(value))
+
+    encoded_blocks = []
+    for block in blocks:
+        values = []
+        for name in _BLOCK_FIELDS:
+            if name in _TEXT_FIELDS:
+                values.append(encode_text(block, name))
+            elif name in _BLOCK_REF_FIELDS:
+                values.append(encode_ref(getattr(block, name)))
+            elif name == "children":
+                values.append([block_index[id(child)] for child in block.children])
+            elif name == "belongs_to_span":
+                span = block.belongs_to_span
+                values.append(None if span is None else span_index[id(span)])
+            else:
+                values.append(getattr(block, name))
+        encoded_blocks.append(values)
+
+    encoded_spans = [
+        [
+            encode_ref(span.initiating_block)
+            if name == "initiating_block"
+            else getattr(span, name)
+            for name in _SPAN_FIELDS
+        ]
+        for span in spans
+    ]
+
+    graph = None
+    if module._graph is not None:
+        sources, targets = module._graph.edge_ids()
+        graph = {
+            "names": module._graph.names,
+            "blocks": [encode_ref(block) for block in module._graph.blocks],
+            "sources": sources,
+            "targets": targets,
+        }
+
+    return {
+        "block_fields": _BLOCK_FIELDS,
+        "span_fields": _SPAN_FIELDS,
+        "source": source.tobytes() if source else None,
+        "encoding": source.encoding if source else None,
+        "blocks": encoded_blocks,
+        "spans": encoded_spans,
+        "spans_by_id": len(module.spans_by_id),
+        "file_path": module.file_path,
+        "language": module.language,
+        "graph": graph,
+    }
+
+
+def decode_module(snapshot: dict[str, Any]) -> Module:
+    if (
+        snapshot["block_fields"] != _BLOCK_FIELDS
+        or snapshot["span_fields"] != _SPAN_FIELDS
+    ):
+        raise ValueError("Snapshot was created with other code block fields.")
+
+    source = None
+    if snapshot["source"] is not None:
+        source = SourceBuffer(snapshot["source"], snapshot["encoding"])
+
+    module = Module(type=CodeBlockType.MODULE, content="")
+    blocks: list[CodeBlock] = [module]
+    for _ in snapshot["blocks"][1:]:
+        blocks.append(object.__new__(CodeBlock))
+
+    spans = [object.__new__(BlockSpan) for _ in snapshot["spans"]]
+
+    def decode_ref(value):
+        return None if value is None else blocks[value]
+
+    for block, values in zip(blocks, snapshot["blocks"], strict=True):
+        for name, value in zip(_BLOCK_FIELDS, values, strict=True):
+            if name in _TEXT_FIELDS and isinstance(value, tuple):
+                value = SourceRange(source, value[0], value[1])
+            elif name in _BLOCK_REF_FIELDS:
+                value = decode_ref(value)
+            elif name == "children":
+                value = [blocks[i] for i in value]
+            elif name == "belongs_to_span":
+                value = None if value is None else spans[value]
+            setattr(block, name, value)
+
+    for span, values in zip(spans, snapshot["spans"], strict=True):
+        for name, value in zip(_SPAN_FIELDS, values, strict=True):
+            if name == "initiating_block":
+                value = decode_ref(value)
+            setattr(span, name, value)
+
+    module.spans_by_id = {
+        span.span_id: span for span in spans[: snapshot["spans_by_id"]]
+    }
+    module.file_path = snapshot["file_path"]
+    module.language = snapshot["language"]
+
+    graph = snapshot["graph"]
+    if graph is None:
+        module._graph = None
+    else:
+        module._graph = CodeGraph.from_edge_ids(
+            names=graph["names"],
+            blocks=[decode_ref(block_ref) for block_ref in graph["blocks"]],
+            sources=graph["sources"],
+            targets=graph["targets"],
+        )
+
+    return module
+
+
+class ModuleCache:
+    """
+    Parsed modules stored as compressed snapshots in a directory, one file per content hash. Files are written
+    atomically so that several processes can share the directory.
+    """
+
+    def __init__(self, cache_dir: str):
+        self._cache_dir = cache_dir
+
+    def key(self, content: str, file_path: str) -> str:
+        ext = os.path.splitext(file_path)[1]
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(f"{SNAPSHOT_VERSION}:{ext}:".encode())
+        hasher.update(content.encode("utf-8", errors="surrogatepass"))
+        return hasher.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key[:2], f"{key}.module")
+
+    def get(self, key: str) -> Module | None:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.loads(zlib.decompress(f.read()))
+            return decode_module(snapshot)
+        except Exception as e:
+            logger.warning(f"Failed to load module snapshot {path}: {e}")
+            return None
+
+    def put(self, key: str, module: Module):
+        path = self._path(key)
+        try:
+            data = zlib.compress(
+                pickle.dumps(encode_module(module), protocol=pickle.HIGHEST_PROTOCOL),
+                level=1,
+            )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to save module snapshot {path}: {e}")
+
+
+def get_module_cache() -> ModuleCache | None:
+    """Returns the module cache in MODULE_CACHE_DIR, or None if it isn't set."""
+    global _module_cache
+
+    cache_dir = os.getenv("MODULE_CACHE_DIR")
+    if not cache_dir:
+        return None
+
+    if _module_cache is None or _module_cache._cache_dir != cache_dir:
+        _module_cache = ModuleCache(cache_dir)
+    return _module_cache
+
+
+def parse_module(file_path: str, content: str) -> Module | None:
+    """
+    Parse the content of a file with the parser for its file type. Snapshots in the module cache are
+    loaded instead of parsing when MODULE_CACHE_DIR is set.
+    """
+    if os.path.splitext(file_path)[1] not in SUPPORTED_EXTENSIONS:
+        return None
+
+    cache = get_module_cache()
+    key = cache.key(content, file_path) if cache else None
+    if key:
+        module = cache.get(key)
+        if module:
+            return module
+
+    parser = get_parser_by_path(file_path)
+    if not parser:
+        return None
+
+    module = parser.parse(content)
+    if key:
+        cache.put(key, module)
+    return module
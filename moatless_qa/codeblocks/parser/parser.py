@@ -1,3 +1,4 @@
+import heapq
 import logging
 import re
 from collections.abc import Callable
@@ -5,7 +6,6 @@ from dataclasses import dataclass, field
 from importlib import resources
 from typing import Optional
 
-import networkx as nx
 from tree_sitter import Language, Node, Parser
 
 from moatless_qa.codeblocks.codeblocks import (
@@ -17,10 +17,14 @@ from moatless_qa.codeblocks.codeblocks import (
     ReferenceScope,
     Relationship,
     RelationshipType,
+    SourceBuffer,
+    SourceRange,
     SpanType,
 )
+from moatless_qa.codeblocks.code_graph import CodeGraph
 from moatless_qa.codeblocks.module import Module
 from moatless_qa.codeblocks.parser.comment import get_comment_symbol
+from moatless_qa.utils.tokenizer import count_tokens
 
 commented_out_keywords = ["rest of the code", "existing code", "other code"]
 child_block_types = ["ERROR", "block"]
@@ -41,6 +45,59 @@ class NodeMatch:
     query: str = None
 
 
+class QueryDispatch:
+    """
+    Queries bucketed by the node type of their root pattern. Queries without a node type, or with the
+    wildcard "_", are kept separately and merged into each bucket in the original order, since the first
+    matching query wins.
+    """
+
+    def __init__(self, queries: list[tuple[str, Optional[str], object]]):
+        self._queries = queries
+        self._size = len(queries)
+        self._by_node_type: dict[str, list] = {}
+        self._wildcards = []
+        for i, (label, node_type, query) in enumerate(queries):
+            if node_type and node_type != "_":
+                self._by_node_type.setdefault(node_type, []).append((i, label, query))
+            else:
+                self._wildcards.append((i, label, query))
+
+        self._merged: dict[str, list[tuple[str, object]]] = {}
+
+    def is_built_from(self, queries: list) -> bool:
+        return queries is self._queries and len(queries) == self._size
+
+    def for_node_type(self, node_type: str) -> list[tuple[str, object]]:
+        merged = self._merged.get(node_type)
+        if merged is None:
+            merged = [
+                (label, query)
+                for _, label, query in heapq.merge(
+                    self._by_node_type.get(node_type, []),
+                    self._wildcards,
+                    key=lambda item: item[0],
+                )
+            ]
+            self._merged[node_type] = merged
+        return merged
+
+
+@dataclass
+class _ParseFrame:
+    """State of a code block being parsed in CodeParser.parse_code."""
+
+    node: Node
+    level: int
+    node_match: NodeMatch
+    code_block: CodeBlock
+    current_span: BlockSpan | None
+    end_byte: int
+    end_line: int
+    next_node: Node | None
+    done: bool = False
+
+
 def _find_type(node: Node, type: str):
     for i, child in enumerate(node.children):
         if child.type == type:
@@ -67,7 +124,33 @@ def find_nested_type(node: Node, type: str, levels: int = -1):
     return None
 
 
+def _ordered_captures(captures) -> list[tuple[Node, str]]:
+    """
+    Returns the captures as (node, tag) pairs in document order. Since py-tree-sitter 0.23 captures are returned
+    as a dict from tag to nodes instead of a list of pairs. Outer nodes come before the nodes they contain, and
+    the root tag comes first on a node so that the root is found before the other tags on it are read.
+    """
+    if not isinstance(captures, dict):
+        return list(captures)
+
+    ordered = [
+        (found_node, tag) for tag, found_nodes in captures.items() for found_node in found_nodes
+    ]
+    ordered.sort(
+        key=lambda capture: (
+            capture[0].start_byte,
+            -capture[0].end_byte,
+            capture[1] != "root",
+        )
+    )
+    return ordered
+
+
 class CodeParser:
+    # Tree-sitter node types used as references in bodies that aren't parsed into child blocks
+    reference_node_types: frozenset[str] = frozenset()
+    reference_skip_node_types: frozenset[str] = frozenset()
+
     def __init__(
         self,
         language: Language,
@@ -78,6 +161,7 @@ class CodeParser:
             int
         ] = None,  # If this is set code will just be parsed if they have more line than this
         enable_code_graph: bool = True,
+        enable_references: Optional[bool] = None,
         index_callback: Callable[[CodeBlock], None] | None = None,
         tokenizer: Callable[[str], list] | None = None,
         apply_gpt_tweaks: bool = False,
@@ -96,20 +180,27 @@ class CodeParser:
         self.encoding = encoding
         self.gpt_queries = []
         self.queries = []
+        self._query_dispatch: QueryDispatch | None = None
+        self._gpt_query_dispatch: QueryDispatch | None = None
 
         # TODO: How to handle these in a thread safe way?
         self.spans_by_id = {}
         self.comments_with_no_span = []
         self._span_counter = {}
         self._previous_block = None
+        self._source: SourceBuffer | None = None
 
         # TODO: Move this to CodeGraph
         self._enable_code_graph = enable_code_graph
         self._graph = None
 
-        from llama_index.core import get_tokenizer
+        # Relationships can be extracted without building the graph, defaults to when the graph is enabled
+        self._enable_references = (
+            enable_code_graph if enable_references is None else enable_references
+        )
 
-        self.tokenizer = tokenizer or get_tokenizer()
+        # Tokens are counted with the shared cached token counter unless a tokenizer is provided
+        self.tokenizer = tokenizer
         self._max_tokens_in_span = max_tokens_in_span
         self._min_tokens_for_docs_span = min_tokens_for_docs_span
         self._min_lines_to_parse_block = min_lines_to_parse_block
@@ -159,6 +250,59 @@ class CodeParser:
         parent_block: CodeBlock | None = None,
         current_span: BlockSpan | None = None,
     ) -> tuple[CodeBlock, Node, BlockSpan]:
+        """
+        Parse the node and the nodes following it to a code block with children. Nested blocks are parsed
+        with an explicit stack of frames instead of recursion, so deeply nested code can't hit the recursion limit.
+        """
+        stack = [
+            self._start_block(
+                content_bytes,
+                node,
+                start_byte,
+                level,
+                file_path,
+                parent_block,
+                current_span,
+            )
+        ]
+        result = None
+
+        while stack:
+            frame = stack[-1]
+            if result is not None:
+                self._add_child(frame, *result)
+                result = None
+
+            child_node = self._next_child_node(frame)
+            if child_node:
+                stack.append(
+                    self._start_block(
+                        content_bytes,
+                        child_node,
+                        start_byte=frame.end_byte,
+                        level=frame.level + 1,
+                        file_path=None,
+                        parent_block=frame.code_block,
+                        current_span=frame.current_span,
+                    )
+                )
+            else:
+                stack.pop()
+                result = self._end_block(content_bytes, frame)
+
+        return result
+
+    def _start_block(
+        self,
+        content_bytes: bytes,
+        node: Node,
+        start_byte: int,
+        level: int,
+        file_path: Optional[str],
+        parent_block: CodeBlock | None,
+        current_span: BlockSpan | None,
+    ) -> "_ParseFrame":
+        """Create the code block for the node, before its children are parsed."""
         node_match = self.find_in_tree(node)
 
         if not parent_block and node.children:
@@ -179,7 +323,10 @@ class CodeParser:
             and (node.end_point[0] - node.start_point[0])
             < self._min_lines_to_parse_block
         ):
+            skipped_body = node_match.first_child
             node_match.first_child = None
+        else:
+            skipped_body = None
 
         if node_match.first_child:
             end_byte = self.get_previous(node_match.first_child, node)
@@ -195,13 +342,19 @@ class CodeParser:
         else:
             identifier = None
 
-        if self._enable_code_graph:
+        if self._enable_references:
             relationships = self.create_references(
                 code, content_bytes, identifier, node_match
             )
             parameters = self.create_parameters(
                 content_bytes, node_match, relationships
             )
+            if skipped_body:
+                relationships.extend(
+                    self.create_body_references(
+                        content_bytes, identifier, node_match, skipped_body, node
+                    )
+                )
         else:
             relationships = []
             parameters = []
@@ -217,8 +370,8 @@ class CodeParser:
                 span_ids=set(),
                 start_line=node.start_point[0] + 1,
                 end_line=end_line + 1,
-                pre_code=pre_code,
-                content=code,
+                pre_code=self._source_text(pre_code, start_byte, node.start_byte),
+                content=self._source_text(code, node.start_byte, end_byte),
                 tokens=self._count_tokens(code),
                 children=[],
                 properties={
@@ -314,9 +467,11 @@ class CodeParser:
 
         next_node = node_match.first_child
 
-        self.debug_log(
-            f"""Created code block
-    content: {code_block.content[:50]} 
+        # Checked before formatting the message to not decode the content of every block
+        if self.debug:
+            self.debug_log(
+                f"""Created code block
+    content: {code_block.content[:50]}
     block_type: {code_block.type} 
     node_type: {node.type}
     next_node: {next_node.type if next_node else "none"}
@@ -325,64 +480,95 @@ class CodeParser:
     start_byte: {start_byte}
     node.start_byte: {node.start_byte}
     node.end_byte: {node.end_byte}"""
-        )
+            )
 
-        index = 0
+        return _ParseFrame(
+            node=node,
+            level=level,
+            node_match=node_match,
+            code_block=code_block,
+            current_span=current_span,
+            end_byte=end_byte,
+            end_line=end_line,
+            next_node=next_node,
+        )
 
-        while next_node:
-            if (
-                next_node.children and next_node.type == "block"
-            ):  # TODO: This should be handled in get_block_definition
-                next_node = next_node.children[0]
-            elif next_node.children and next_node.type == "ERROR":
-                next_node = next_node.children[0]
-                code_block.type = CodeBlockType.ERROR
+    def _next_child_node(self, frame: "_ParseFrame") -> Node | None:
+        """Returns the next child node to parse in the frame, or None if all children are parsed."""
+        if frame.done or not frame.next_node:
+            return None
 
-            self.debug_log(
-                f"next  [{level}]: -> {next_node.type} - {next_node.start_byte}"
-            )
+        next_node = frame.next_node
+        if (
+            next_node.children and next_node.type == "block"
+        ):  # TODO: This should be handled in get_block_definition
+            next_node = next_node.children[0]
+        elif next_node.children and next_node.type == "ERROR":
+            next_node = next_node.children[0]
+            frame.code_block.type = CodeBlockType.ERROR
 
-            child_block, child_last_node, child_span = self.parse_code(
-                content_bytes,
-                next_node,
-                start_byte=end_byte,
-                level=level + 1,
-                parent_block=code_block,
-                current_span=current_span,
-            )
+        self.debug_log(
+            f"next  [{frame.level}]: -> {next_node.type} - {next_node.start_byte}"
+        )
 
-            if not current_span or child_span.span_id != current_span.span_id:
-                current_span = child_span
+        frame.next_node = next_node
+        return next_node
 
-            code_block.append_child(child_block)
+    def _add_child(
+        self,
+        frame: "_ParseFrame",
+        child_block: CodeBlock,
+        child_last_node: Node | None,
+        child_span: BlockSpan,
+    ):
+        """Add a parsed child block to the frame and move on to the node after it."""
+        current_span = frame.current_span
+        if not current_span or child_span.span_id != current_span.span_id:
+            frame.current_span = child_span
 
-            index += 1
+        frame.code_block.append_child(child_block)
 
-            if child_last_node:
-                self.debug_log(f"next  [{level}]: child_last_node -> {child_last_node}")
-                next_node = child_last_node
+        next_node = frame.next_node
+        if child_last_node:
+            self.debug_log(
+                f"next  [{frame.level}]: child_last_node -> {child_last_node}"
+            )
+            next_node = child_last_node
 
-            end_byte = next_node.end_byte
+        frame.end_byte = next_node.end_byte
 
-            self.debug_log(
-                f"""next  [{level}]
-    last_child -> {node_match.last_child}
+        self.debug_log(
+            f"""next  [{frame.level}]
+    last_child -> {frame.node_match.last_child}
     next_node -> {next_node}
     next_node.next_sibling -> {next_node.next_sibling}
-    end_byte -> {end_byte}
+    end_byte -> {frame.end_byte}
 """
+        )
+        if next_node == frame.node_match.last_child:
+            frame.done = True
+        elif next_node.next_sibling:
+            next_node = next_node.next_sibling
+        else:
+            next_parent_node = self.get_parent_next(
+                next_node, frame.node_match.check_child or frame.node
             )
-            if next_node == node_match.last_child:
-                break
-            elif next_node.next_sibling:
-                next_node = next_node.next_sibling
-            else:
-                next_parent_node = self.get_parent_next(
-                    next_node, node_match.check_child or node
-                )
-                next_node = None if next_parent_node == next_node else next_parent_node
+            next_node = None if next_parent_node == next_node else next_parent_node
+
+        frame.next_node = next_node
+
+    def _end_block(
+        self, content_bytes: bytes, frame: "_ParseFrame"
+    ) -> tuple[CodeBlock, Node, BlockSpan]:
+        """Finish the code block in the frame after all its children are parsed."""
+        node = frame.node
+        code_block = frame.code_block
+        current_span = frame.current_span
+        end_byte = frame.end_byte
+        next_node = frame.next_node
 
-        self.debug_log(f"end   [{level}]: {code_block.content}")
+        if self.debug:
+            self.debug_log(f"end   [{frame.level}]: {code_block.content}")
 
         for comment_block in self.comments_with_no_span:
             comment_block.belongs_to_span = current_span
@@ -397,13 +583,17 @@ class CodeParser:
         self.add_to_index(code_block)
 
         # TODO: Find a way to remove the Space end block
-        if level == 0 and not node.parent and node.end_byte > end_byte:
+        if frame.level == 0 and not node.parent and node.end_byte > end_byte:
             space_block = CodeBlock(
                 type=CodeBlockType.SPACE,
                 identifier=None,
-                pre_code=content_bytes[end_byte : node.end_byte].decode(self.encoding),
+                pre_code=self._source_text(
+                    content_bytes[end_byte : node.end_byte].decode(self.encoding),
+                    end_byte,
+                    node.end_byte,
+                ),
                 parent=code_block,
-                start_line=end_line + 1,
+                start_line=frame.end_line + 1,
                 end_line=node.end_point[0] + 1,
                 content="",
             )
@@ -443,10 +633,26 @@ class CodeParser:
             )
             return NodeMatch(block_type=CodeBlockType.CODE)
 
+    @property
+    def query_dispatch(self) -> QueryDispatch:
+        # Subclasses set the queries after __init__, so the dispatch is built on first use
+        if self._query_dispatch is None or not self._query_dispatch.is_built_from(
+            self.queries
+        ):
+            self._query_dispatch = QueryDispatch(self.queries)
+        return self._query_dispatch
+
+    @property
+    def gpt_query_dispatch(self) -> QueryDispatch:
+        if (
+            self._gpt_query_dispatch is None
+            or not self._gpt_query_dispatch.is_built_from(self.gpt_queries)
+        ):
+            self._gpt_query_dispatch = QueryDispatch(self.gpt_queries)
+        return self._gpt_query_dispatch
+
     def find_match_with_gpt_tweaks(self, node: Node) -> NodeMatch | None:
-        for label, node_type, query in self.gpt_queries:
-            if node_type and node.type != node_type and node_type != "_":
-                continue
+        for label, query in self.gpt_query_dispatch.for_node_type(node.type):
             match = self._find_match(node, query, label, capture_from_parent=True)
             if match:
                 self.debug_log(
@@ -461,12 +667,8 @@ class CodeParser:
     def find_match(self, node: Node) -> NodeMatch | None:
         self.debug_log(f"find_match() node type {node.type}")
 
-        queries = 0
-        for label, node_type, query in self.queries:
-            if node_type and node.type != node_type and node_type != "_":
-                continue
+        for label, query in self.query_dispatch.for_node_type(node.type):
             match = self._find_match(node, query, label)
-            queries += 1
             if match:
                 self.debug_log(
                     f"find_match() Found match on node {node.type} with query {label}"
@@ -481,9 +683,9 @@ class CodeParser:
         self, node: Node, query, label: str, capture_from_parent: bool = False
     ) -> NodeMatch | None:
         if capture_from_parent:
-            captures = query.captures(node.parent)
+            captures = _ordered_captures(query.captures(node.parent))
         else:
-            captures = query.captures(node)
+            captures = _ordered_captures(query.captures(node))
 
         node_match = NodeMatch()
 
@@ -491,14 +693,7 @@ class CodeParser:
             return None
 
         root_node = None
-        logger.info(captures)
-        for capture in captures:
-            # 安全地解包捕获结果，确保即使格式变化也能正常工作
-            if len(capture) >= 2:
-                found_node, tag = capture[0], capture[1]
-            else:
-                continue  # 跳过不符合预期格式的捕获结果
-                
+        for found_node, tag in captures:
             self.debug_log(f"[{label}] Found tag {tag} on node {found_node}")
 
             if tag == "root" and not root_node and node == found_node:
@@ -651,6 +846,56 @@ class CodeParser:
                 )
         return references
 
+    def create_body_references(
+        self,
+        content_bytes: bytes,
+        identifier: Optional[str],
+        node_match: NodeMatch,
+        first_child: Node,
+        node: Node,
+    ) -> list[Relationship]:
+        """
+        Create references for the names used in a body that isn't parsed into child blocks because it's shorter
+        than min_lines_to_parse_block. Only the outermost name nodes (as identifiers and dotted attributes)
+        are used, so `user.greet()` is referenced as one path.
+        """
+        if not self.reference_node_types:
+            return []
+
+        references = []
+        seen = set()
+        stack = list(reversed(node.children))
+        while stack:
+            current = stack.pop()
+            if (
+                current.end_byte <= first_child.start_byte
+                or current.type in self.reference_skip_node_types
+            ):
+                continue
+
+            if current.start_byte < first_child.start_byte:
+                stack.extend(reversed(current.children))
+                continue
+
+            if current.type in self.reference_node_types:
+                if current != node_match.identifier_node:
+                    reference_id = self.get_content(current, content_bytes)
+                    if reference_id not in seen:
+                        seen.add(reference_id)
+                        references.append(
+                            Relationship(
+                                scope=ReferenceScope.LOCAL,
+                                type=RelationshipType.USES,
+                                identifier=identifier,
+                                path=reference_id.split("."),
+                            )
+                        )
+                continue
+
+            stack.extend(reversed(current.children))
+
+        return references
+
     def create_parameters(self, content_bytes, node_match, references):
         parameters = []
         for parameter in node_match.parameters:
@@ -683,33 +928,30 @@ class CodeParser:
         pass
 
     def get_previous(self, node: Node, origin_node: Node):
-        if node == origin_node:
-            return node.start_byte
-        if node.prev_sibling:
-            return node.prev_sibling.end_byte
-        elif node.parent:
-            return self.get_previous(node.parent, origin_node)
-        else:
-            return node.start_byte
+        while node != origin_node:
+            if node.prev_sibling:
+                return node.prev_sibling.end_byte
+            elif node.parent:
+                node = node.parent
+            else:
+                break
+        return node.start_byte
 
     def get_parent_next(self, node: Node, orig_node: Node):
         self.debug_log(f"get_parent_next: {node.type} - {orig_node.type}")
-        if node != orig_node:
+        while node != orig_node:
             if node.next_sibling:
                 self.debug_log(
                     f"get_parent_next: node.next_sibling -> {node.next_sibling}"
                 )
                 return node.next_sibling
-            else:
-                return self.get_parent_next(node.parent, orig_node)
+            node = node.parent
+            self.debug_log(f"get_parent_next: {node.type} - {orig_node.type}")
         return None
 
     def has_error(self, node: Node):
-        if node.type == "ERROR":
-            return True
-        if node.children:
-            return any(self.has_error(child) for child in node.children)
-        return False
+        # Tree-sitter tracks errors in the subtree on each node, so the tree doesn't have to be walked
+        return node.type == "ERROR" or node.has_error
 
     def parse(self, content, file_path: Optional[str] = None) -> Module:
         if isinstance(content, str):
@@ -725,18 +967,33 @@ class CodeParser:
 
         # TODO: Should me moved to a central CodeGraph
         if self._enable_code_graph:
-            self._graph = nx.DiGraph()
+            self._graph = CodeGraph()
 
         tree = self.tree_parser.parse(content_in_bytes)
         root_node = tree.walk().node
 
-        module, _, _ = self.parse_code(content_in_bytes, root_node, file_path=file_path)
+        self._source = SourceBuffer(content_in_bytes, self.encoding)
+        try:
+            module, _, _ = self.parse_code(
+                content_in_bytes, root_node, file_path=file_path
+            )
+        finally:
+            self._source = None
+
         module.spans_by_id = self.spans_by_id
         module.file_path = file_path
         module.language = self.language
         module._graph = self._graph
         return module
 
+    def _source_text(
+        self, text: str, start_byte: int, end_byte: int
+    ) -> str | SourceRange:
+        # Blocks reference the bytes of the parsed file instead of keeping their own copy of the code
+        if self._source is None or not text:
+            return text
+        return SourceRange(self._source, start_byte, end_byte)
+
     def get_content(self, node: Node, content_bytes: bytes) -> str:
         return content_bytes[node.start_byte : node.end_byte].decode(self.encoding)
 
@@ -916,9 +1173,9 @@ class CodeParser:
         return span_id
 
     def _count_tokens(self, content: str):
-        if not self.tokenizer:
-            return 0
-        return len(self.tokenizer(content))
+        if self.tokenizer:
+            return len(self.tokenizer(content))
+        return count_tokens(content)
 
     def debug_log(self, message: str):
         if self.debug:
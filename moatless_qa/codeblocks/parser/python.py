@@ -24,6 +24,9 @@ logger = logging.getLogger(__name__)
 
 
 class PythonParser(CodeParser):
+    reference_node_types = frozenset(["identifier", "attribute"])
+    reference_skip_node_types = frozenset(["string", "comment"])
+
     def __init__(self, **kwargs):
         language = Language(tspython.language())
 
@@ -49,11 +52,11 @@ class PythonParser(CodeParser):
         # Handle line breaks after assignment without \
         if (
             codeblock.type == CodeBlockType.ASSIGNMENT
-            and codeblock.content_lines[0].strip().endswith("=")
             and node_match.check_child
             and node_match.first_child
             and node_match.check_child.start_point[0]
             < node_match.first_child.start_point[0]
+            and codeblock.content_lines[0].strip().endswith("=")
         ):
             logger.debug(
                 f"Parsed block with type ASSIGNMENT with line break but no ending \\: {codeblock.content_lines[0]}"
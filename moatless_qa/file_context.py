@@ -1,13 +1,15 @@
 import difflib
+import hashlib
 import io
 import json
 import logging
 import os
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Set, Tuple
 
 from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
-from moatless_qa.codeblocks import CodeBlockType, get_parser_by_path
+from moatless_qa.codeblocks import CodeBlockType
 from moatless_qa.codeblocks.codeblocks import (
     BlockSpan,
     CodeBlock,
@@ -16,13 +18,29 @@ from moatless_qa.codeblocks.codeblocks import (
     SpanType,
 )
 from moatless_qa.codeblocks.module import Module
+from moatless_qa.codeblocks.module_cache import parse_module
 from moatless_qa.repository import FileRepository
 from moatless_qa.repository.repository import Repository
 from moatless_qa.schema import FileWithSpans
-from moatless_qa.utils.tokenizer import count_tokens
+from moatless_qa.utils.tokenizer import count_tokens, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# Number of rendered prompts to keep per file, one for each combination of spans, patch and render options
+PROMPT_CACHE_SIZE = 16
+
+
+def _prompt_tokens(
+    max_tokens: Optional[int], content: str, estimate: bool = False
+) -> int:
+    # The running token count in a prompt is only used to stop at max_tokens. Counts are cached by content,
+    # the byte length estimate can be used instead when the budget doesn't have to be exact.
+    if not max_tokens:
+        return 0
+    if estimate:
+        return estimate_tokens(content)
+    return count_tokens(content)
+
 
 class ContextSpan(BaseModel):
     span_id: str
@@ -41,6 +59,18 @@ class CurrentPromptSpan:
     tokens: int = 0
 
 
+@dataclass
+class RenderedPrompt:
+    content: str
+    _tokens: Optional[int] = None
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens is None:
+            self._tokens = count_tokens(self.content)
+        return self._tokens
+
+
 class ContextFile(BaseModel):
     """
     Represents the context of a file, managing patches that reflect changes over time.
@@ -75,6 +105,9 @@ class ContextFile(BaseModel):
     _cached_base_content: Optional[str] = PrivateAttr(None)
     _cached_content: Optional[str] = PrivateAttr(None)
     _cached_module: Optional[Module] = PrivateAttr(None)
+    _prompt_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    # Base content and its digest, so that the base content is only hashed again when it's replaced
+    _base_content_digest: Optional[Tuple[str, bytes]] = PrivateAttr(None)
 
     _repo: Repository = PrivateAttr()
 
@@ -147,6 +180,22 @@ class ContextFile(BaseModel):
 
         return self._cached_base_content
 
+    def _get_base_content_digest(self) -> Optional[bytes]:
+        base_content = self.get_base_content()
+        if base_content is None:
+            return None
+
+        if (
+            self._base_content_digest is None
+            or self._base_content_digest[0] is not base_content
+        ):
+            digest = hashlib.blake2b(
+                base_content.encode("utf-8", errors="surrogatepass"), digest_size=16
+            ).digest()
+            self._base_content_digest = (base_content, digest)
+
+        return self._base_content_digest[1]
+
     @property
     def module(self) -> Module | None:
         if not self._repo:
@@ -155,9 +204,7 @@ class ContextFile(BaseModel):
         if self._cached_module is not None:
             return self._cached_module
 
-        parser = get_parser_by_path(self.file_path)
-        if parser:
-            self._cached_module = parser.parse(self.content)
+        self._cached_module = parse_module(self.file_path, self.content)
 
         return self._cached_module
 
@@ -210,7 +257,100 @@ class ContextFile(BaseModel):
         show_all_spans: bool = False,
         only_signatures: bool = False,
         max_tokens: Optional[int] = None,
+        estimate_tokens: bool = False,
     ):
+        return self.get_rendered_prompt(
+            show_span_ids,
+            show_line_numbers,
+            exclude_comments,
+            show_outcommented_code,
+            outcomment_code_comment,
+            show_all_spans=show_all_spans,
+            only_signatures=only_signatures,
+            max_tokens=max_tokens,
+            estimate_tokens=estimate_tokens,
+        ).content
+
+    def get_rendered_prompt(
+        self,
+        show_span_ids=False,
+        show_line_numbers=False,
+        exclude_comments=False,
+        show_outcommented_code=False,
+        outcomment_code_comment: str = "...",
+        show_all_spans: bool = False,
+        only_signatures: bool = False,
+        max_tokens: Optional[int] = None,
+        estimate_tokens: bool = False,
+    ) -> RenderedPrompt:
+        """
+        Returns the prompt with its token count. Prompts are cached by the spans, the base content, the patch and
+        the render options, so changes to any of them render a new prompt. The max_tokens budget is checked with exact
+        token counts, set estimate_tokens to use the faster byte length estimate instead.
+        """
+        key = (
+            tuple(
+                (span.span_id, span.start_line, span.end_line, span.tokens)
+                for span in self.spans
+            ),
+            self.show_all_spans,
+            self._get_base_content_digest(),
+            self.patch,
+            show_span_ids,
+            show_line_numbers,
+            exclude_comments,
+            show_outcommented_code,
+            outcomment_code_comment,
+            show_all_spans,
+            only_signatures,
+            max_tokens,
+            estimate_tokens,
+        )
+
+        rendered = self._prompt_cache.get(key)
+        if rendered is not None:
+            self._prompt_cache.move_to_end(key)
+            return rendered
+
+        rendered = RenderedPrompt(
+            self._render_prompt(
+                show_span_ids,
+                show_line_numbers,
+                exclude_comments,
+                show_outcommented_code,
+                outcomment_code_comment,
+                show_all_spans=show_all_spans,
+                only_signatures=only_signatures,
+                max_tokens=max_tokens,
+                estimate_tokens=estimate_tokens,
+            )
+        )
+
+        # Check if result exceeds max_tokens
+        if max_tokens and rendered.tokens > max_tokens:
+            logger.warning(
+                f"Content for {self.file_path} exceeded max_tokens ({max_tokens})"
+            )
+            rendered = RenderedPrompt("", 0)
+
+        self._prompt_cache[key] = rendered
+        while len(self._prompt_cache) > PROMPT_CACHE_SIZE:
+            self._prompt_cache.popitem(last=False)
+
+        return rendered
+
+    def _render_prompt(
+        self,
+        show_span_ids=False,
+        show_line_numbers=False,
+        exclude_comments=False,
+        show_outcommented_code=False,
+        outcomment_code_comment: str = "...",
+        show_all_spans: bool = False,
+        only_signatures: bool = False,
+        max_tokens: Optional[int] = None,
+        estimate_tokens: bool = False,
+    ) -> str:
         if self.module:
             if (
                 not self.show_all_spans
@@ -232,20 +372,12 @@ class ContextFile(BaseModel):
                 show_all_spans=show_all_spans or self.show_all_spans,
                 only_signatures=only_signatures,
                 max_tokens=max_tokens,
+                estimate_tokens=estimate_tokens,
             )
         else:
             code = self._to_prompt_with_line_spans(show_span_id=show_span_ids)
 
-        result = f"{self.file_path}\n```\n{code}\n```\n"
-
-        # Check if result exceeds max_tokens
-        if max_tokens and count_tokens(result) > max_tokens:
-            logger.warning(
-                f"Content for {self.file_path} exceeded max_tokens ({max_tokens})"
-            )
-            return ""
-
-        return result
+        return f"{self.file_path}\n```\n{code}\n```\n"
 
     def _find_span(self, codeblock: CodeBlock) -> Optional[ContextSpan]:
         if not codeblock.belongs_to_span:
@@ -303,6 +435,7 @@ class ContextFile(BaseModel):
         show_all_spans: bool = False,
         only_signatures: bool = False,
         max_tokens: Optional[int] = None,
+        estimate_tokens: bool = False,
         current_tokens: int = 0,
     ):
         if current_span is None:
@@ -376,7 +509,9 @@ class ContextFile(BaseModel):
                         show_line_numbers=show_line_numbers,
                     )
                     contents += block_content
-                    current_tokens += count_tokens(block_content)
+                    current_tokens += _prompt_tokens(
+                        max_tokens, block_content, estimate_tokens
+                    )
                     outcommented_block = None
 
                 block_content = child._to_prompt_string(
@@ -385,7 +520,9 @@ class ContextFile(BaseModel):
                     span_marker=SpanMarker.TAG,
                 )
                 contents += block_content
-                current_tokens += count_tokens(block_content)
+                current_tokens += _prompt_tokens(
+                    max_tokens, block_content, estimate_tokens
+                )
 
                 child_content = self._to_prompt(
                     code_block=child,
@@ -398,10 +535,13 @@ class ContextFile(BaseModel):
                     show_all_spans=show_all_spans,
                     only_signatures=only_signatures,
                     max_tokens=max_tokens,
+                    estimate_tokens=estimate_tokens,
                     current_tokens=current_tokens,
                 )
                 contents += child_content
-                current_tokens += count_tokens(child_content)
+                current_tokens += _prompt_tokens(
+                    max_tokens, child_content, estimate_tokens
+                )
 
             elif (
                 show_outcommented_code
@@ -423,10 +563,28 @@ class ContextFile(BaseModel):
                 show_line_numbers=show_line_numbers,
             )
             contents += block_content
-            current_tokens += count_tokens(block_content)
+            current_tokens += _prompt_tokens(
+                max_tokens, block_content, estimate_tokens
+            )
 
         return contents
 
+    def fork(self) -> "ContextFile":
+        """
+        Returns a copy with its own spans that shares the cached content and module with this file, as they only
+        change with the patch. The copy gets its own prompt cache, seeded with the prompts rendered for this file.
+        The was_edited and was_viewed flags are reset in the copy.
+        """
+        forked = self.model_copy(
+            update={
+                "spans": [span.model_copy() for span in self.spans],
+                "was_edited": False,
+                "was_viewed": False,
+            }
+        )
+        forked._prompt_cache = OrderedDict(self._prompt_cache)
+        return forked
+
     def set_patch(self, patch: str):
         self.patch = patch
         self._cached_content = None
@@ -649,6 +807,8 @@ class FileContext(BaseModel):
     # _runtime: RuntimeEnvironment = PrivateAttr(None)
 
     _files: Dict[str, ContextFile] = PrivateAttr(default_factory=dict)
+    # Files shared with clones of the context, they're copied before they are changed
+    _shared_files: Set[str] = PrivateAttr(default_factory=set)
     # _test_files: Dict[str, TestFile] = PrivateAttr(
     #     default_factory=dict
     # )  # Changed to Dict
@@ -728,6 +888,7 @@ class FileContext(BaseModel):
         # Load regular files
         for file_data in files:
             file_path = file_data["file_path"]
+            self._shared_files.discard(file_path)
             show_all_spans = file_data.get("show_all_spans", False)
             spans = [ContextSpan(**span) for span in file_data.get("spans", [])]
 
@@ -760,6 +921,7 @@ class FileContext(BaseModel):
 
     def restore_from_snapshot(self, snapshot: dict):
         self._files.clear()
+        self._shared_files.clear()
         self._test_files.clear()
         self.load_files_from_dict(snapshot.get("files", []))
 
@@ -775,6 +937,15 @@ class FileContext(BaseModel):
                 file_with_spans.file_path, set(file_with_spans.span_ids)
             )
 
+    def _get_own_file(self, file_path: str) -> Optional[ContextFile]:
+        """Returns the file to be changed, copying it first if it's shared with a clone of the context."""
+        context_file = self._files.get(file_path)
+        if context_file is not None and file_path in self._shared_files:
+            context_file = context_file.fork()
+            self._files[file_path] = context_file
+            self._shared_files.discard(file_path)
+        return context_file
+
     def add_file(
         self, file_path: str, show_all_spans: bool = False, add_extra: bool = True
     ) -> ContextFile:
@@ -788,20 +959,18 @@ class FileContext(BaseModel):
             if add_extra:
                 self._files[file_path]._add_import_span()
 
-        return self._files[file_path]
+        return self._get_own_file(file_path)
 
     def add_file_with_lines(
         self, file_path: str, start_line: int, end_line: Optional[int] = None
     ):
         end_line = end_line or start_line
-        if file_path not in self._files:
-            self.add_file(file_path)
-
-        self._files[file_path].add_line_span(start_line, end_line)
+        self.add_file(file_path).add_line_span(start_line, end_line)
 
     def remove_file(self, file_path: str):
         if file_path in self._files:
             del self._files[file_path]
+            self._shared_files.discard(file_path)
 
     def exists(self, file_path: str):
         return file_path in self._files
@@ -812,6 +981,7 @@ class FileContext(BaseModel):
 
     @property
     def files(self):
+        """The files in the context, these can be shared with clones and should be changed with get_context_file()."""
         return list(self._files.values())
 
     @property
@@ -922,8 +1092,9 @@ class FileContext(BaseModel):
                     initial_patch=file_context.generate_full_patch(),
                 )
 
-            self._files[file_path].spans.extend(context_file.spans)
-            self._files[file_path].show_all_spans = context_file.show_all_spans
+            own_file = self._get_own_file(file_path)
+            own_file.spans.extend(context_file.spans)
+            own_file.show_all_spans = context_file.show_all_spans
 
     def has_file(self, file_path: str):
         return file_path in self._files and (
@@ -946,7 +1117,7 @@ class FileContext(BaseModel):
         if self._repo and hasattr(self._repo, "get_relative_path"):
             file_path = self._repo.get_relative_path(file_path)
 
-        context_file = self._files.get(file_path)
+        context_file = self._get_own_file(file_path)
 
         if not context_file:
             if not self._repo.file_exists(file_path):
@@ -963,9 +1134,9 @@ class FileContext(BaseModel):
         return context_file
 
     def get_context_files(self) -> List[ContextFile]:
-        file_paths = list(self._files.keys())
-        for file_path in file_paths:
-            yield self.get_context_file(file_path)
+        # Files are only read here and not copied if they're shared with a clone
+        for context_file in list(self._files.values()):
+            yield context_file
 
     def context_size(self):
         if self._repo:
@@ -991,6 +1162,7 @@ class FileContext(BaseModel):
     def reset(self):
         self._files = {}
         self._test_files = {}
+        self._shared_files = set()
 
     def is_empty(self):
         return not self._files
@@ -1008,13 +1180,14 @@ class FileContext(BaseModel):
         files: set | None = None,
         only_signatures: bool = False,
         max_tokens: Optional[int] = None,
+        estimate_tokens: bool = False,
     ):
         file_contexts = []
         current_tokens = 0
 
         for context_file in self.get_context_files():
             if not files or context_file.file_path in files:
-                content = context_file.to_prompt(
+                rendered = context_file.get_rendered_prompt(
                     show_span_ids,
                     show_line_numbers,
                     exclude_comments,
@@ -1022,10 +1195,12 @@ class FileContext(BaseModel):
                     outcomment_code_comment,
                     only_signatures=only_signatures,
                     max_tokens=max_tokens,
+                    estimate_tokens=estimate_tokens,
                 )
+                content = rendered.content
 
                 if max_tokens:
-                    content_tokens = count_tokens(content)
+                    content_tokens = rendered.tokens
                     if current_tokens + content_tokens > max_tokens:
                         logger.warning(
                             f"Skipping {context_file.file_path} as it would exceed max_tokens"
@@ -1119,15 +1294,23 @@ class FileContext(BaseModel):
             )
 
         return new_span_ids
+
     def clone(self):
-        dump = self.model_dump(
-            exclude={"files": {"__all__": {"was_edited", "was_viewed"}}}
-        )
+        """
+        Copy-on-write clone. Files are shared between the contexts, including their cached content and module,
+        and copied by the context that changes them first. Files with was_edited or was_viewed set are copied
+        right away as the flags are reset in the clone.
+        """
         cloned_context = FileContext(repo=self._repo)
-        cloned_context.load_files_from_dict(
-            files=dump.get("files", [])
-        )
+        for file_path, context_file in self._files.items():
+            if context_file.was_edited or context_file.was_viewed:
+                cloned_context._files[file_path] = context_file.fork()
+            else:
+                cloned_context._files[file_path] = context_file
+                cloned_context._shared_files.add(file_path)
+                self._shared_files.add(file_path)
         return cloned_context
+
     def span_count(self) -> int:
         """
         Returns the total number of span IDs across all files in the context.
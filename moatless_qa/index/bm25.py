@@ -0,0 +1,303 @@
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from collections.abc import Callable, Iterable
+from typing import Optional
+
+import numpy as np
+from llama_index.core.schema import BaseNode, MetadataMode
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_FILE = "bm25.json"
+BM25_ARRAYS_FILE = "bm25.npz"
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_SUBWORD_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split text into lowercased identifiers. Identifiers in snake_case or camelCase are also
+    split into their parts, so that both `autodoc_typehints` and `typehints` match.
+    """
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        tokens.append(word.lower())
+        parts = [
+            subword.lower()
+            for part in word.split("_")
+            if part
+            for subword in _SUBWORD_RE.findall(part)
+        ]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[str]], k: int = 60
+) -> list[tuple[str, float]]:
+    """Fuse ranked lists of ids by summing 1 / (k + rank) for each list an id is found in."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _index_nodes(
+    nodes: Iterable[BaseNode],
+    term_ids: dict[str, int],
+    file_ids: dict[str, int],
+    start_doc_id: int = 0,
+) -> tuple[list[str], list[int], list[int], tuple[list[int], list[int], list[int]]]:
+    """
+    Tokenize the nodes, adding new terms and files to the id mappings. Returns the node ids, lengths and
+    file ids of the documents, and the term, document and frequency of each posting.
+    """
+    node_ids = []
+    doc_lengths = []
+    doc_file_ids = []
+    posting_terms = []
+    posting_docs = []
+    posting_freqs = []
+
+    for doc_id, node in enumerate(nodes, start=start_doc_id):
+        node_ids.append(node.node_id)
+        file_path = node.metadata.get("file_path") or ""
+        doc_file_ids.append(file_ids.setdefault(file_path, len(file_ids)))
+
+        # Index the same text as is embedded, including the file path
+        counts = Counter(tokenize(node.get_content(metadata_mode=MetadataMode.EMBED)))
+        doc_lengths.append(sum(counts.values()))
+        for term, freq in counts.items():
+            posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+            posting_docs.append(doc_id)
+            posting_freqs.append(freq)
+
+    return (
+        node_ids,
+        doc_lengths,
+        doc_file_ids,
+        (posting_terms, posting_docs, posting_freqs),
+    )
+
+
+class BM25Index:
+    """
+    Okapi BM25 index over the chunks in a CodeIndex. Term postings are stored as CSR arrays
+    and queries are scored with numpy.
+    """
+
+    def __init__(
+        self,
+        terms: list[str],
+        node_ids: list[str],
+        file_paths: list[str],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        doc_file_ids: np.ndarray,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self._term_ids = {term: i for i, term in enumerate(terms)}
+        self._terms = terms
+        self._node_ids = node_ids
+        self._file_paths = file_paths
+        self._offsets = offsets
+        self._doc_ids = doc_ids
+        self._term_freqs = term_freqs
+        self._doc_lengths = doc_lengths
+        self._doc_file_ids = doc_file_ids
+        self._avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, nodes: Iterable[BaseNode]) -> "BM25Index":
+        term_ids: dict[str, int] = {}
+        file_ids: dict[str, int] = {}
+        node_ids, doc_lengths, doc_file_ids, postings = _index_nodes(
+            nodes, term_ids, file_ids
+        )
+
+        logger.info(
+            f"Built BM25 index with {len(term_ids)} terms over {len(node_ids)} chunks."
+        )
+        return cls._from_postings(
+            term_ids,
+            file_ids,
+            node_ids,
+            np.array(doc_lengths, dtype=np.float32),
+            np.array(doc_file_ids, dtype=np.int32),
+            *(np.array(column, dtype=np.int64) for column in postings),
+        )
+
+    def update(
+        self, file_paths: Iterable[str], nodes: Iterable[BaseNode]
+    ) -> "BM25Index":
+        """
+        Returns an index where the chunks in the files are replaced by the nodes. Only the nodes are tokenized,
+        the postings of the chunks in other files are filtered and renumbered as arrays.
+        """
+        term_ids = dict(self._term_ids)
+        file_ids = {file_path: i for i, file_path in enumerate(self._file_paths)}
+
+        removed_file_ids = [
+            file_ids[file_path] for file_path in file_paths if file_path in file_ids
+        ]
+        keep = ~np.isin(self._doc_file_ids, removed_file_ids)
+        new_doc_ids = np.cumsum(keep, dtype=np.int64) - 1
+
+        posting_terms = np.repeat(
+            np.arange(len(self._terms), dtype=np.int64), np.diff(self._offsets)
+        )
+        kept = keep[self._doc_ids]
+
+        node_ids, doc_lengths, doc_file_ids, postings = _index_nodes(
+            nodes, term_ids, file_ids, start_doc_id=int(keep.sum())
+        )
+        added_terms, added_docs, added_freqs = (
+            np.array(column, dtype=np.int64) for column in postings
+        )
+
+        logger.info(
+            f"Updated BM25 index, removed {len(keep) - int(keep.sum())} and added {len(node_ids)} chunks."
+        )
+        return self._from_postings(
+            term_ids,
+            file_ids,
+            [self._node_ids[doc_id] for doc_id in np.flatnonzero(keep)] + node_ids,
+            np.concatenate(
+                [self._doc_lengths[keep], np.array(doc_lengths, dtype=np.float32)]
+            ),
+            np.concatenate(
+                [self._doc_file_ids[keep], np.array(doc_file_ids, dtype=np.int32)]
+            ),
+            np.concatenate([posting_terms[kept], added_terms]),
+            np.concatenate([new_doc_ids[self._doc_ids[kept]], added_docs]),
+            np.concatenate([self._term_freqs[kept].astype(np.int64), added_freqs]),
+            k1=self.k1,
+            b=self.b,
+        )
+
+    @classmethod
+    def _from_postings(
+        cls,
+        term_ids: dict[str, int],
+        file_ids: dict[str, int],
+        node_ids: list[str],
+        doc_lengths: np.ndarray,
+        doc_file_ids: np.ndarray,
+        posting_terms: np.ndarray,
+        posting_docs: np.ndarray,
+        posting_freqs: np.ndarray,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        order = np.argsort(posting_terms, kind="stable")
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(posting_terms, minlength=len(term_ids)))
+
+        return cls(
+            terms=list(term_ids.keys()),
+            node_ids=node_ids,
+            file_paths=list(file_ids.keys()),
+            offsets=offsets,
+            doc_ids=posting_docs.astype(np.int32)[order],
+            term_freqs=posting_freqs.astype(np.int32)[order],
+            doc_lengths=doc_lengths,
+            doc_file_ids=doc_file_ids,
+            k1=k1,
+            b=b,
+        )
+
+    def persist(self, persist_dir: str):
+        with open(os.path.join(persist_dir, BM25_INDEX_FILE), "w") as f:
+            json.dump(
+                {
+                    "terms": self._terms,
+                    "node_ids": self._node_ids,
+                    "file_paths": self._file_paths,
+                    "k1": self.k1,
+                    "b": self.b,
+                },
+                f,
+            )
+        np.savez(
+            os.path.join(persist_dir, BM25_ARRAYS_FILE),
+            offsets=self._offsets,
+            doc_ids=self._doc_ids,
+            term_freqs=self._term_freqs,
+            doc_lengths=self._doc_lengths,
+            doc_file_ids=self._doc_file_ids,
+        )
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> Optional["BM25Index"]:
+        if not os.path.exists(os.path.join(persist_dir, BM25_ARRAYS_FILE)):
+            return None
+
+        with open(os.path.join(persist_dir, BM25_INDEX_FILE)) as f:
+            data = json.load(f)
+
+        with np.load(os.path.join(persist_dir, BM25_ARRAYS_FILE)) as arrays:
+            return cls(
+                terms=data["terms"],
+                node_ids=data["node_ids"],
+                file_paths=data["file_paths"],
+                offsets=arrays["offsets"],
+                doc_ids=arrays["doc_ids"],
+                term_freqs=arrays["term_freqs"],
+                doc_lengths=arrays["doc_lengths"],
+                doc_file_ids=arrays["doc_file_ids"],
+                k1=data.get("k1", 1.2),
+                b=data.get("b", 0.75),
+            )
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        file_path_filter: Optional[Callable[[str], bool]] = None,
+    ) -> list[tuple[str, float]]:
+        """Returns the node ids and scores of the top k chunks, highest score first."""
+        num_docs = len(self._node_ids)
+        if not num_docs:
+            return []
+
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            doc_ids = self._doc_ids[start:end]
+            term_freqs = self._term_freqs[start:end]
+            idf = math.log(1 + (num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = self.k1 * (
+                1 - self.b + self.b * self._doc_lengths[doc_ids] / self._avg_doc_length
+            )
+            scores[doc_ids] += idf * term_freqs * (self.k1 + 1) / (term_freqs + norm)
+
+        if file_path_filter:
+            allowed_files = np.fromiter(
+                (bool(file_path_filter(file_path)) for file_path in self._file_paths),
+                dtype=bool,
+                count=len(self._file_paths),
+            )
+            scores[~allowed_files[self._doc_file_ids]] = 0
+
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+
+        return [(self._node_ids[doc_id], float(scores[doc_id])) for doc_id in hits]
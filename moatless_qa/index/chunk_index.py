@@ -0,0 +1,272 @@
+import bisect
+import json
+import logging
+import os
+from collections.abc import Callable, Iterable
+from typing import Optional
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+
+from moatless_qa.index.types import LineMatch
+from moatless_qa.utils.trigram import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+CHUNK_INDEX_FILE = "chunk_index.json"
+CHUNK_TRIGRAMS_FILE = "chunk_trigrams.npz"
+
+# Whitespace is ignored when matching chunk contents, the same as is_string_in()
+_WHITESPACE = str.maketrans("", "", " \t\n")
+
+
+def strip_whitespace(text: str) -> str:
+    return text.translate(_WHITESPACE)
+
+
+class ChunkTrigramIndex:
+    """
+    Trigram index over the contents of the chunks in a CodeIndex, with whitespace removed. Finds the chunks
+    that can contain a code snippet or identifier, and the lines and spans where it is found.
+    """
+
+    def __init__(
+        self,
+        node_ids: list[str],
+        file_paths: list[str],
+        start_lines: list[Optional[int]],
+        end_lines: list[Optional[int]],
+        span_ids: list[list[str]],
+        trigram_index: TrigramIndex,
+    ):
+        self._node_ids = node_ids
+        self._file_paths = file_paths
+        self._start_lines = start_lines
+        self._end_lines = end_lines
+        self._span_ids = span_ids
+        self._trigram_index = trigram_index
+
+        self._rows_by_file: dict[str, list[int]] = {}
+        for row, file_path in enumerate(file_paths):
+            self._rows_by_file.setdefault(file_path, []).append(row)
+
+        self._line_rows_by_file = self._index_line_rows()
+
+    def _index_line_rows(self) -> dict[str, tuple[list[int], list[int], list[int]]]:
+        """
+        Index the chunks with line numbers in each file by start line. Besides the rows and their start lines,
+        the largest end line of the chunks starting before each row is kept to find overlapping chunks.
+        """
+        line_rows_by_file = {}
+        for file_path, file_rows in self._rows_by_file.items():
+            rows = [
+                row
+                for row in file_rows
+                if self._start_lines[row] and self._end_lines[row]
+            ]
+            if not rows:
+                continue
+
+            rows.sort(key=lambda row: self._start_lines[row])
+            start_lines = [self._start_lines[row] for row in rows]
+            max_end_lines = []
+            max_end_line = 0
+            for row in rows:
+                max_end_line = max(max_end_line, self._end_lines[row])
+                max_end_lines.append(max_end_line)
+            line_rows_by_file[file_path] = (start_lines, max_end_lines, rows)
+
+        return line_rows_by_file
+
+    @classmethod
+    def build(cls, nodes: Iterable[BaseNode]) -> "ChunkTrigramIndex":
+        node_ids = []
+        file_paths = []
+        start_lines = []
+        end_lines = []
+        span_ids = []
+        contents = []
+        for node in nodes:
+            node_ids.append(node.node_id)
+            file_paths.append(node.metadata.get("file_path"))
+            start_lines.append(node.metadata.get("start_line"))
+            end_lines.append(node.metadata.get("end_line"))
+            span_ids.append(node.metadata.get("span_ids", []))
+            contents.append(strip_whitespace(node.get_content()).encode("utf-8"))
+
+        logger.info(f"Building trigram index over {len(contents)} chunks.")
+        return cls(
+            node_ids,
+            file_paths,
+            start_lines,
+            end_lines,
+            span_ids,
+            TrigramIndex.build(contents),
+        )
+
+    def update(
+        self, file_paths: Iterable[str], nodes: Iterable[BaseNode]
+    ) -> "ChunkTrigramIndex":
+        """
+        Returns an index where the chunks in the files are replaced by the nodes. Only the contents of the
+        nodes are read, the chunks in other files are kept as they are.
+        """
+        keep = np.ones(len(self._node_ids), dtype=bool)
+        for file_path in file_paths:
+            keep[self._rows_by_file.get(file_path, [])] = False
+
+        rows = np.flatnonzero(keep).tolist()
+        node_ids = [self._node_ids[row] for row in rows]
+        chunk_file_paths = [self._file_paths[row] for row in rows]
+        start_lines = [self._start_lines[row] for row in rows]
+        end_lines = [self._end_lines[row] for row in rows]
+        span_ids = [self._span_ids[row] for row in rows]
+
+        contents = []
+        for node in nodes:
+            node_ids.append(node.node_id)
+            chunk_file_paths.append(node.metadata.get("file_path"))
+            start_lines.append(node.metadata.get("start_line"))
+            end_lines.append(node.metadata.get("end_line"))
+            span_ids.append(node.metadata.get("span_ids", []))
+            contents.append(strip_whitespace(node.get_content()).encode("utf-8"))
+
+        logger.info(
+            f"Updating trigram index, removed {len(self._node_ids) - len(rows)} and added {len(contents)} chunks."
+        )
+        return ChunkTrigramIndex(
+            node_ids,
+            chunk_file_paths,
+            start_lines,
+            end_lines,
+            span_ids,
+            self._trigram_index.update(keep, contents),
+        )
+
+    def node_ids_by_file(self, file_paths: Iterable[str]) -> dict[str, list[str]]:
+        """Returns the ids of the chunks in each of the files that has chunks."""
+        node_ids_by_file = {}
+        for file_path in file_paths:
+            rows = self._rows_by_file.get(file_path)
+            if rows:
+                node_ids_by_file[file_path] = [self._node_ids[row] for row in rows]
+        return node_ids_by_file
+
+    def file_paths(self) -> set[str]:
+        """Returns the paths of the files that have chunks in the index."""
+        return {file_path for file_path in self._rows_by_file if file_path}
+
+    def persist(self, persist_dir: str):
+        with open(os.path.join(persist_dir, CHUNK_INDEX_FILE), "w") as f:
+            json.dump(
+                {
+                    "node_ids": self._node_ids,
+                    "file_paths": self._file_paths,
+                    "start_lines": self._start_lines,
+                    "end_lines": self._end_lines,
+                    "span_ids": self._span_ids,
+                },
+                f,
+            )
+        self._trigram_index.save(os.path.join(persist_dir, CHUNK_TRIGRAMS_FILE))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> Optional["ChunkTrigramIndex"]:
+        if not os.path.exists(os.path.join(persist_dir, CHUNK_TRIGRAMS_FILE)):
+            return None
+
+        with open(os.path.join(persist_dir, CHUNK_INDEX_FILE)) as f:
+            data = json.load(f)
+
+        return cls(
+            node_ids=data["node_ids"],
+            file_paths=data["file_paths"],
+            start_lines=data["start_lines"],
+            end_lines=data["end_lines"],
+            span_ids=data["span_ids"],
+            trigram_index=TrigramIndex.load(
+                os.path.join(persist_dir, CHUNK_TRIGRAMS_FILE)
+            ),
+        )
+
+    def _candidate_rows(self, text: str) -> Optional[set[int]]:
+        doc_ids = self._trigram_index.candidates(strip_whitespace(text).encode("utf-8"))
+        if doc_ids is None:
+            return None
+        return set(doc_ids.tolist())
+
+    def candidate_node_ids(self, text: str) -> Optional[set[str]]:
+        """
+        Returns the ids of the chunks that may contain the text when whitespace is ignored, or None if
+        the text is too short to filter on.
+        """
+        rows = self._candidate_rows(text)
+        if rows is None:
+            return None
+        return {self._node_ids[row] for row in rows}
+
+    def _spans_at_line(self, file_path: str, line_number: int) -> tuple[Optional[str], list[str]]:
+        line_rows = self._line_rows_by_file.get(file_path)
+        if not line_rows:
+            return None, []
+
+        start_lines, max_end_lines, rows = line_rows
+
+        # Check the chunks starting at or before the line, closest first, until none of the earlier ones reach it
+        i = bisect.bisect_right(start_lines, line_number) - 1
+        while i >= 0 and max_end_lines[i] >= line_number:
+            row = rows[i]
+            if self._end_lines[row] >= line_number:
+                return self._node_ids[row], self._span_ids[row]
+            i -= 1
+        return None, []
+
+    def search_lines(
+        self,
+        search_text: str,
+        get_file_content: Callable[[str], Optional[str]],
+        file_paths: Optional[Iterable[str]] = None,
+    ) -> list[LineMatch]:
+        """
+        Find the lines containing the search text in the files that have candidate chunks. Like grep, each
+        line of a multiline search text is searched for separately. Each match refers to the chunk and
+        span ids covering the line.
+        """
+        needles = [line for line in search_text.split("\n") if line]
+        if not needles:
+            return []
+
+        rows = set()
+        for needle in needles:
+            needle_rows = self._candidate_rows(needle)
+            if needle_rows is None:
+                rows = set(range(len(self._node_ids)))
+                break
+            rows.update(needle_rows)
+
+        candidate_files = {self._file_paths[row] for row in rows}
+        if file_paths is not None:
+            candidate_files &= set(file_paths)
+
+        matches = []
+        for file_path in sorted(path for path in candidate_files if path):
+            content = get_file_content(file_path)
+            if content is None:
+                continue
+
+            for i, line in enumerate(content.split("\n")):
+                if any(needle in line for needle in needles):
+                    node_id, span_ids = self._spans_at_line(file_path, i + 1)
+                    matches.append(
+                        LineMatch(
+                            file_path=file_path,
+                            line_number=i + 1,
+                            node_id=node_id,
+                            span_ids=span_ids,
+                        )
+                    )
+
+        logger.debug(
+            f"search_lines() Found {len(matches)} matches in {len(candidate_files)} candidate files."
+        )
+        return matches
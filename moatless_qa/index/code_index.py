@@ -5,28 +5,36 @@ import os
 import shutil
 import tempfile
 import networkx as nx
-from typing import Optional, TYPE_CHECKING
+from collections.abc import Callable, Iterable, Iterator
+from typing import Dict, List, Optional, TYPE_CHECKING
 
 import requests
 from rapidfuzz import fuzz
 
 from moatless_qa.codeblocks import CodeBlock, CodeBlockType
-from moatless_qa.index.settings import IndexSettings
+from moatless_qa.codeblocks.module import Module
+from moatless_qa.index.bm25 import BM25Index, reciprocal_rank_fusion
+from moatless_qa.index.chunk_index import ChunkTrigramIndex
+from moatless_qa.index.name_index import NameIndex
+from moatless_qa.index.settings import FaissIndexType, IndexSettings
 from moatless_qa.index.simple_faiss import SimpleFaissVectorStore
+from moatless_qa.index.symbol_graph import SymbolGraph, SymbolGraphBuilder
 from moatless_qa.index.types import (
     CodeSnippet,
+    FilePathFilter,
+    LineMatch,
     SearchCodeHit,
     SearchCodeResponse,
+    SearchMode,
 )
-from moatless_qa.repository import FileRepository
+from moatless_qa.repository import FileRepository, GitRepository
 from moatless_qa.repository.repository import Repository
 from moatless_qa.schema import FileWithSpans
 from moatless_qa.utils.file import is_test
-from moatless_qa.utils.tokenizer import count_tokens
+from moatless_qa.utils.tokenizer import count_tokens_batch
 
 
-from llama_index.core import SimpleDirectoryReader
-from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
+from llama_index.core.schema import BaseNode
 from llama_index.core.storage.docstore import SimpleDocumentStore
 
 logger = logging.getLogger(__name__)
@@ -40,9 +48,27 @@ def default_vector_store(settings: IndexSettings):
             "faiss needs to be installed to set up a default index for CodeIndex. Run 'pip install faiss-cpu'"
         ) from e
 
-    # faiss_index = faiss.IndexIDMap(faiss.IndexFlatL2(settings.dimensions))
-    faiss_index = faiss.IndexIDMap(faiss.IndexFlatL2(1536))
-    return SimpleFaissVectorStore(faiss_index)
+    if settings.index_type == FaissIndexType.IVF_PQ:
+        index_description = (
+            f"IDMap,IVF{settings.nlist},PQ{settings.pq_m}x{settings.pq_nbits}"
+        )
+    elif settings.index_type == FaissIndexType.HNSW:
+        index_description = f"IDMap,HNSW{settings.hnsw_m}"
+    elif settings.index_type == FaissIndexType.SQ8:
+        index_description = "IDMap,SQ8"
+    else:
+        index_description = None
+
+    if index_description:
+        faiss_index = faiss.index_factory(
+            settings.dimensions, index_description, faiss.METRIC_L2
+        )
+    else:
+        faiss_index = faiss.IndexIDMap(faiss.IndexFlatL2(settings.dimensions))
+
+    vector_store = SimpleFaissVectorStore(faiss_index, d=settings.dimensions)
+    vector_store.set_search_params(nprobe=settings.nprobe, ef_search=settings.ef_search)
+    return vector_store
 
 
 class CodeIndex:
@@ -53,8 +79,11 @@ class CodeIndex:
         vector_store: "BasePydanticVectorStore | None" = None,
         docstore: "DocumentStore | None" = None,
         embed_model: "BaseEmbedding | None" = None,
-        blocks_by_class_name: Optional[dict] = None,
-        blocks_by_function_name: Optional[dict] = None,
+        blocks_by_class_name: dict | NameIndex | None = None,
+        blocks_by_function_name: dict | NameIndex | None = None,
+        chunk_index: ChunkTrigramIndex | None = None,
+        bm25_index: BM25Index | None = None,
+        symbol_graph: SymbolGraph | None = None,
         settings: IndexSettings | None = None,
         max_results: int = 25,
         max_hits_without_exact_match: int = 100,
@@ -69,19 +98,45 @@ class CodeIndex:
 
         self._file_repo = file_repo
 
-        self._blocks_by_class_name = blocks_by_class_name or {}
-        self._blocks_by_function_name = blocks_by_function_name or {}
+        self._class_name_index = _to_name_index(blocks_by_class_name)
+        self._function_name_index = _to_name_index(blocks_by_function_name)
+        self._chunk_index = chunk_index
+        self._bm25_index = bm25_index
+        self._symbol_graph = symbol_graph
 
-        from moatless_qa.index.embed_model import get_embed_model
+        from moatless_qa.index.embed_model import (
+            get_embed_dimensions,
+            get_embed_model,
+            get_embed_model_key,
+        )
 
         self._embed_model = embed_model or get_embed_model(self._settings.embed_model)
+
+        if not vector_store:
+            dimensions = get_embed_dimensions(self._embed_model)
+            if dimensions and dimensions != self._settings.dimensions:
+                logger.info(
+                    f"Set dimensions to {dimensions} to match embedding model {self._settings.embed_model}"
+                )
+                self._settings.dimensions = dimensions
+
         self._vector_store = vector_store or default_vector_store(self._settings)
         self._docstore = docstore or SimpleDocumentStore()
 
+        from moatless_qa.index.embedding_cache import QueryEmbeddingCache
+
+        # Agents often repeat the same queries, the cache is persisted if EMBEDDING_CACHE_DIR is set
+        self._query_cache = QueryEmbeddingCache(
+            model_name=get_embed_model_key(
+                self._embed_model, self._settings.dimensions
+            ),
+            cache_dir=os.getenv("EMBEDDING_CACHE_DIR"),
+        )
+
         logger.info(
             f"Initiated CodeIndex {self._index_name} with:\n"
-            f" * {len(self._blocks_by_class_name)} classes\n"
-            f" * {len(self._blocks_by_function_name)} functions\n"
+            f" * {len(self._class_name_index)} class names\n"
+            f" * {len(self._function_name_index)} function names\n"
             f" * {len(self._docstore.docs)} vectors\n"
             f"Using file repository at {self._file_repo.repo_dir}\n"
         )
@@ -94,18 +149,14 @@ class CodeIndex:
         docstore = SimpleDocumentStore.from_persist_dir(persist_dir)
 
         settings = IndexSettings.from_persist_dir(persist_dir)
+        vector_store.set_search_params(
+            nprobe=settings.nprobe, ef_search=settings.ef_search
+        )
 
-        if os.path.exists(os.path.join(persist_dir, "blocks_by_class_name.json")):
-            with open(os.path.join(persist_dir, "blocks_by_class_name.json")) as f:
-                blocks_by_class_name = json.load(f)
-        else:
-            blocks_by_class_name = {}
-
-        if os.path.exists(os.path.join(persist_dir, "blocks_by_function_name.json")):
-            with open(os.path.join(persist_dir, "blocks_by_function_name.json")) as f:
-                blocks_by_function_name = json.load(f)
-        else:
-            blocks_by_function_name = {}
+        blocks_by_class_name = _load_name_index(persist_dir, "blocks_by_class_name")
+        blocks_by_function_name = _load_name_index(
+            persist_dir, "blocks_by_function_name"
+        )
 
         return cls(
             file_repo=file_repo,
@@ -114,6 +165,9 @@ class CodeIndex:
             settings=settings,
             blocks_by_class_name=blocks_by_class_name,
             blocks_by_function_name=blocks_by_function_name,
+            chunk_index=ChunkTrigramIndex.from_persist_dir(persist_dir),
+            bm25_index=BM25Index.from_persist_dir(persist_dir),
+            symbol_graph=SymbolGraph.from_persist_dir(persist_dir),
             **kwargs,
         )
 
@@ -252,49 +306,161 @@ class CodeIndex:
         max_exact_results: int = 5,
         max_spans_per_file: Optional[int] = None,
         exact_match_if_possible: bool = False,
+        search_mode: SearchMode | str = SearchMode.DENSE,
     ) -> SearchCodeResponse:
         if query is None:
             query = ""
 
-        message = ""
         if file_pattern:
-            if category and category != "test":
-                exclude_files = self._file_repo.matching_files("**/test*/**")
-            else:
-                exclude_files = []
-
-            try:
-                matching_files = self._file_repo.matching_files(file_pattern)
-                matching_files = [
-                    file for file in matching_files if file not in exclude_files
-                ]
-            except Exception as e:
-                return SearchCodeResponse(
-                    message=f"The file pattern {file_pattern} is invalid.",
-                    hits=[],
-                )
-
-            if not matching_files:
-                if "*" not in file_pattern and not self._file_repo.file_exists(
-                    file_pattern
-                ):
-                    return SearchCodeResponse(
-                        message=f"No file found on path {file_pattern}.",
-                        hits=[],
-                    )
-                else:
-                    return SearchCodeResponse(
-                        message=f"No files found for file pattern {file_pattern}.",
-                        hits=[],
-                    )
+            error_response = self._validate_file_pattern(file_pattern, category)
+            if error_response:
+                return error_response
 
-        search_results = self._vector_search(
+        search_results = self._iter_vector_search(
             query,
             file_pattern=file_pattern,
             exact_content_match=code_snippet,
             category=category,
+            search_mode=search_mode,
         )
 
+        return self._create_search_response(
+            search_results,
+            query=query,
+            code_snippet=code_snippet,
+            file_pattern=file_pattern,
+            max_results=max_results,
+            max_tokens=max_tokens,
+            max_hits_without_exact_match=max_hits_without_exact_match,
+            max_exact_results=max_exact_results,
+            max_spans_per_file=max_spans_per_file,
+            exact_match_if_possible=exact_match_if_possible,
+        )
+
+    def semantic_search_batch(
+        self,
+        queries: list[str],
+        file_pattern: Optional[str] = None,
+        category: str | None = None,
+        max_results: int = 100,
+        max_tokens: int = 8000,
+        max_hits_without_exact_match: int = 100,
+        max_exact_results: int = 5,
+        max_spans_per_file: Optional[int] = None,
+        exact_match_if_possible: bool = False,
+        search_mode: SearchMode | str = SearchMode.DENSE,
+        top_k: int = 500,
+    ) -> list[SearchCodeResponse]:
+        """
+        Run semantic_search() for several queries with the same filters. The queries are embedded in one
+        request and searched with one FAISS search over the stacked query embeddings.
+        """
+        if file_pattern:
+            error_response = self._validate_file_pattern(file_pattern, category)
+            if error_response:
+                return [error_response for _ in queries]
+
+        search_mode = self._resolve_search_mode(search_mode)
+
+        dense_hits_per_query = [None] * len(queries)
+        if search_mode in (SearchMode.DENSE, SearchMode.HYBRID) and queries:
+            search_queries = [
+                self._create_search_query(query, file_pattern) for query in queries
+            ]
+            query_embeddings = self._get_query_embeddings(search_queries)
+            file_path_filter = self._create_file_path_filter(file_pattern, category)
+
+            if hasattr(self._vector_store, "query_batch"):
+                results = self._vector_store.query_batch(
+                    query_embeddings, top_k, file_path_filter=file_path_filter
+                )
+            else:
+                results = [
+                    self._query_vector_store(query_embedding, top_k, file_path_filter)
+                    for query_embedding in query_embeddings
+                ]
+
+            dense_hits_per_query = [
+                list(zip(result.ids, result.similarities, strict=False))
+                for result in results
+            ]
+
+        responses = []
+        for query, dense_hits in zip(queries, dense_hits_per_query, strict=True):
+            search_results = self._iter_vector_search(
+                query,
+                file_pattern=file_pattern,
+                category=category,
+                top_k=top_k,
+                search_mode=search_mode,
+                dense_hits=dense_hits,
+            )
+            responses.append(
+                self._create_search_response(
+                    search_results,
+                    query=query,
+                    file_pattern=file_pattern,
+                    max_results=max_results,
+                    max_tokens=max_tokens,
+                    max_hits_without_exact_match=max_hits_without_exact_match,
+                    max_exact_results=max_exact_results,
+                    max_spans_per_file=max_spans_per_file,
+                    exact_match_if_possible=exact_match_if_possible,
+                )
+            )
+
+        return responses
+
+    def _validate_file_pattern(
+        self, file_pattern: str, category: str | None = None
+    ) -> SearchCodeResponse | None:
+        """Returns a response with an error message if no files match the file pattern."""
+        if category and category != "test":
+            exclude_files = self._file_repo.matching_files("**/test*/**")
+        else:
+            exclude_files = []
+
+        try:
+            matching_files = self._file_repo.matching_files(file_pattern)
+            matching_files = [
+                file for file in matching_files if file not in exclude_files
+            ]
+        except Exception as e:
+            return SearchCodeResponse(
+                message=f"The file pattern {file_pattern} is invalid.",
+                hits=[],
+            )
+
+        if not matching_files:
+            if "*" not in file_pattern and not self._file_repo.file_exists(
+                file_pattern
+            ):
+                return SearchCodeResponse(
+                    message=f"No file found on path {file_pattern}.",
+                    hits=[],
+                )
+            else:
+                return SearchCodeResponse(
+                    message=f"No files found for file pattern {file_pattern}.",
+                    hits=[],
+                )
+
+        return None
+
+    def _create_search_response(
+        self,
+        search_results: Iterable[CodeSnippet],
+        query: str,
+        code_snippet: Optional[str] = None,
+        file_pattern: Optional[str] = None,
+        max_results: int = 100,
+        max_tokens: int = 8000,
+        max_hits_without_exact_match: int = 100,
+        max_exact_results: int = 5,
+        max_spans_per_file: Optional[int] = None,
+        exact_match_if_possible: bool = False,
+    ) -> SearchCodeResponse:
+        message = ""
         files_with_spans: dict[str, SearchCodeHit] = {}
 
         span_count = 0
@@ -303,36 +469,36 @@ class CodeIndex:
 
         require_exact_query_match = False
 
+        # Hits are grouped by file so that each file is read and parsed at most once per search
+        modules: dict[str, Module | None] = {}
+
         sum_tokens = 0
         for rank, search_hit in enumerate(search_results):
-            file = self._file_repo.get_file(search_hit.file_path)
-            if not file:
-                logger.warning(
-                    f"semantic_search(query={query}, file_pattern={file_pattern}) Could not find search hit file {search_hit.file_path}."
-                )
-                continue
-            elif not file.module:
-                logger.warning(
-                    f"semantic_search(query={query}, file_pattern={file_pattern}) Could not parse module for search hit file {search_hit.file_path}."
-                )
-                continue
-
-            # TODO: Add a check before span is added...
+            # Checked before the hit is resolved so that no more files are parsed once the budget is spent
             if sum_tokens > max_tokens:
                 break
 
+            if search_hit.file_path not in modules:
+                modules[search_hit.file_path] = self._get_module(
+                    search_hit.file_path, query, file_pattern
+                )
+
+            module = modules[search_hit.file_path]
+            if not module:
+                continue
+
             spans = []
             for span_id in search_hit.span_ids:
-                span = file.module.find_span_by_id(span_id)
+                span = module.find_span_by_id(span_id)
 
                 if span:
                     spans.append(span)
                 else:
                     logger.debug(
-                        f"semantic_search() Could not find span with id {span_id} in file {file.file_path}"
+                        f"semantic_search() Could not find span with id {span_id} in file {search_hit.file_path}"
                     )
 
-                    spans_by_line_number = file.module.find_spans_by_line_numbers(
+                    spans_by_line_number = module.find_spans_by_line_numbers(
                         search_hit.start_line, search_hit.end_line
                     )
 
@@ -382,6 +548,8 @@ class CodeIndex:
                     )
 
                     sum_tokens += span.tokens
+                    if sum_tokens > max_tokens:
+                        break
 
                     if (
                         max_spans_per_file
@@ -414,6 +582,22 @@ class CodeIndex:
 
         return SearchCodeResponse(message=message, hits=list(files_with_spans.values()))
 
+    def _get_module(
+        self, file_path: str, query: str, file_pattern: Optional[str] = None
+    ) -> Module | None:
+        file = self._file_repo.get_file(file_path)
+        if not file:
+            logger.warning(
+                f"semantic_search(query={query}, file_pattern={file_pattern}) Could not find search hit file {file_path}."
+            )
+            return None
+        elif not file.module:
+            logger.warning(
+                f"semantic_search(query={query}, file_pattern={file_pattern}) Could not parse module for search hit file {file_path}."
+            )
+            return None
+        return file.module
+
     def find_class(self, class_name: str, file_pattern: Optional[str] = None):
         return self.find_by_name(
             class_name=class_name, file_pattern=file_pattern, strict=True
@@ -446,34 +630,20 @@ class CodeIndex:
                 "At least one of class_name or function_name must be provided."
             )
 
-        paths = []
-
         # If class name is provided only find the clasees and then filter on function name if necessary
         if class_name:
-            paths = self._blocks_by_class_name.get(class_name, [])
-        elif function_name:
-            paths = self._blocks_by_function_name.get(function_name, [])
+            name = class_name
+            name_index = self._class_name_index
         else:
-            raise ValueError(
-                "At least one of class_name or function_name must be provided."
-            )
+            name = function_name
+            name_index = self._function_name_index
 
+        file_ids = None
         if file_pattern:
             include_files = self._file_repo.matching_files(file_pattern)
 
             if include_files:
-                filtered_paths = []
-                for file_path, block_path in paths:
-                    if file_path in include_files:
-                        filtered_paths.append((file_path, block_path))
-
-                filtered_out_by_file_pattern = len(paths) - len(filtered_paths)
-                if filtered_out_by_file_pattern:
-                    logger.debug(
-                        f"find_by_name() Filtered out {filtered_out_by_file_pattern} files by file pattern."
-                    )
-                paths = filtered_paths
-
+                file_ids = name_index.file_ids(include_files)
             elif "*" not in file_pattern and not self._file_repo.file_exists(
                 file_pattern
             ):
@@ -487,25 +657,39 @@ class CodeIndex:
                     hits=[],
                 )
 
+        paths = name_index.get(name, file_ids)
+        if not paths and not strict:
+            paths = name_index.get_case_insensitive(name, file_ids)
+            if paths:
+                logger.info(
+                    f"find_by_name() No exact match on {name}, found {len(paths)} case-insensitive matches."
+                )
+
         logger.info(
             f"find_by_name(class_name={class_name}, function_name={function_name}, file_pattern={file_pattern}) {len(paths)} hits."
         )
 
         if not paths:
+            suggestion = ""
+            if not strict:
+                similar_names = name_index.similar_names(name)
+                if similar_names:
+                    suggestion = f" Did you mean {', '.join(similar_names)}?"
+
             if function_name:
                 return SearchCodeResponse(
-                    message=f"No functions found with the name {function_name}."
+                    message=f"No functions found with the name {function_name}.{suggestion}"
                 )
             else:
                 return SearchCodeResponse(
-                    message=f"No classes found with the name {class_name}."
+                    message=f"No classes found with the name {class_name}.{suggestion}"
                 )
 
         filtered_out_by_class_name = 0
         invalid_blocks = 0
 
         if category and category != "test":
-            exclude_files = self._file_repo.matching_files("**/test*/**")
+            exclude_files = set(self._file_repo.matching_files("**/test*/**"))
 
             filtered_paths = []
             for file_path, block_path in paths:
@@ -614,6 +798,81 @@ class CodeIndex:
             hits=search_hits,
         )
 
+    def find_exact_match_spans(
+        self, search_text: str, file_pattern: Optional[str] = None
+    ) -> list[LineMatch]:
+        """
+        Find the lines containing the search text in indexed files, with the span ids covering each line.
+        Returns an empty list if the index has no chunk trigram index.
+        """
+        if not self._chunk_index:
+            return []
+
+        file_paths = None
+        if file_pattern:
+            file_paths = self._file_repo.matching_files(file_pattern)
+            if not file_paths:
+                return []
+
+        return self._chunk_index.search_lines(
+            search_text,
+            get_file_content=self._file_repo.get_file_content,
+            file_paths=file_paths,
+        )
+
+    def find_exact_matches(
+        self, search_text: str, file_pattern: Optional[str] = None
+    ) -> list[tuple[str, int]]:
+        """
+        Find (file path, line number) of lines containing the search text. Indexed files are searched with the
+        chunk trigram index and all other files, like files with other extensions or created after indexing,
+        with the exact match index of the repository.
+
+        The chunk trigram index only finds matches in text that was in the file when it was indexed, so use the
+        repository search for files that are changed without updating the index.
+        """
+        if not self._chunk_index:
+            return self._file_repo.find_exact_matches(
+                search_text=search_text, file_pattern=file_pattern
+            )
+
+        if file_pattern:
+            file_paths = self._file_repo.matching_files(file_pattern)
+            if not file_paths:
+                return []
+        else:
+            file_paths = self._file_repo.file_tree.match("**")
+
+        indexed_files = self._chunk_index.file_paths()
+        matches = [
+            (match.file_path, match.line_number)
+            for match in self.find_exact_match_spans(search_text, file_pattern)
+        ]
+        matches.extend(
+            self._file_repo.text_index.search(
+                search_text,
+                [file_path for file_path in file_paths if file_path not in indexed_files],
+            )
+        )
+        return sorted(matches)
+
+    def find_related_spans(
+        self,
+        files: list[FileWithSpans],
+        max_hops: int = 1,
+        max_tokens: int = 1000,
+    ) -> list[FileWithSpans]:
+        """
+        Find spans related to the given spans in the repository wide symbol graph, following references and
+        imports across files. Returns an empty list if the index has no symbol graph.
+        """
+        if not self._symbol_graph:
+            return []
+
+        return self._symbol_graph.related_spans(
+            files, max_hops=max_hops, max_tokens=max_tokens
+        )
+
     def find_test_files(
         self,
         file_path: str,
@@ -728,18 +987,12 @@ class CodeIndex:
             file_hit.add_span(span_id, rank)
         return file_hit
 
-    def _vector_search(
+    def _create_search_query(
         self,
-        query: str = "",
-        exact_query_match: bool = False,
-        category: str | None = None,
+        query: str,
         file_pattern: Optional[str] = None,
         exact_content_match: Optional[str] = None,
-        top_k: int = 500,
-    ):
-        # Import llama_index components only when needed
-        from llama_index.core.vector_stores.types import VectorStoreQuery
-
+    ) -> str:
         if file_pattern:
             query += f" file:{file_pattern}"
 
@@ -751,11 +1004,60 @@ class CodeIndex:
                 "At least one of query, span_keywords or content_keywords must be provided."
             )
 
-        logger.debug(
-            f"vector_search() Searching for query [{query[:50]}...] and file pattern [{file_pattern}]."
+        return query
+
+    def _resolve_search_mode(self, search_mode: SearchMode | str) -> SearchMode:
+        search_mode = SearchMode(search_mode)
+        if search_mode != SearchMode.DENSE and not self._bm25_index:
+            logger.warning(
+                f"vector_search() No BM25 index, falling back to dense search from {search_mode.value}."
+            )
+            return SearchMode.DENSE
+        return search_mode
+
+    def _create_file_path_filter(
+        self, file_pattern: Optional[str] = None, category: str | None = None
+    ) -> FilePathFilter | None:
+        """Returns a filter on the file paths to search in, or None if all files are searched."""
+        if file_pattern:
+            include_files = frozenset(self._file_repo.matching_files(file_pattern))
+        else:
+            include_files = frozenset()
+
+        if category and category != "test":
+            exclude_files = frozenset(
+                self._file_repo.find_files(
+                    ["**/tests/**", "tests*", "*_test.py", "test_*.py"]
+                )
+            )
+        else:
+            exclude_files = frozenset()
+
+        if not include_files and not exclude_files and not category:
+            return None
+
+        return FilePathFilter(
+            file_pattern=file_pattern,
+            category=category,
+            include_files=include_files,
+            exclude_files=exclude_files,
         )
 
-        query_embedding = self._embed_model.get_query_embedding(query)
+    def _get_query_embeddings(self, queries: list[str]) -> list[list[float]]:
+        from moatless_qa.index.embed_model import get_query_embeddings
+
+        return self._query_cache.get_embeddings(
+            queries, lambda missing: get_query_embeddings(self._embed_model, missing)
+        )
+
+    def _query_vector_store(
+        self,
+        query_embedding: list[float],
+        top_k: int,
+        file_path_filter: FilePathFilter | None = None,
+    ):
+        # Import llama_index components only when needed
+        from llama_index.core.vector_stores.types import VectorStoreQuery
 
         # FIXME: Filters can't be used ATM. Category isn't set in some instance vector stores
         # filters = MetadataFilters(filters=[], condition=FilterCondition.AND)
@@ -763,60 +1065,106 @@ class CodeIndex:
         #    filters.filters.append(MetadataFilter(key="category", value=category))
 
         query_bundle = VectorStoreQuery(
-            query_str=query,
             query_embedding=query_embedding,
-            similarity_top_k=top_k,  # TODO: Fix paging?
+            similarity_top_k=top_k,
             #    filters=filters,
         )
 
-        result = self._vector_store.query(query_bundle)
+        # The filter is applied in the vector store so that the top k hits are all in matching files
+        return self._vector_store.query(query_bundle, file_path_filter=file_path_filter)
 
-        filtered_out_snippets = 0
-        ignored_removed_snippets = 0
-        sum_tokens = 0
+    def _vector_search(self, query: str = "", **kwargs) -> list[CodeSnippet]:
+        return list(self._iter_vector_search(query, **kwargs))
 
-        sum_tokens_per_file = {}
+    def _iter_vector_search(
+        self,
+        query: str = "",
+        exact_query_match: bool = False,
+        category: str | None = None,
+        file_pattern: Optional[str] = None,
+        exact_content_match: Optional[str] = None,
+        top_k: int = 500,
+        search_mode: SearchMode | str = SearchMode.DENSE,
+        dense_hits: list[tuple[str, float]] | None = None,
+    ) -> Iterator[CodeSnippet]:
+        """
+        Search for code snippets. Snippets are loaded from the docstore as they're consumed, so callers can stop
+        once they have enough. Dense hits already retrieved for the query, e.g. in a batch search, can be provided
+        to not query the vector store again.
+        """
+        query = self._create_search_query(query, file_pattern, exact_content_match)
 
-        if file_pattern:
-            include_files = self._file_repo.matching_files(file_pattern)
-            if len(include_files) == 0:
-                logger.info(
-                    f"vector_search() No files found for file pattern {file_pattern}, return empty result..."
+        logger.debug(
+            f"vector_search() Searching for query [{query[:50]}...] and file pattern [{file_pattern}]."
+        )
+
+        search_mode = self._resolve_search_mode(search_mode)
+
+        if file_pattern and not self._file_repo.matching_files(file_pattern):
+            logger.info(
+                f"vector_search() No files found for file pattern {file_pattern}, return empty result..."
+            )
+            return
+
+        file_path_filter = self._create_file_path_filter(file_pattern, category)
+
+        if dense_hits is None:
+            dense_hits = []
+            if search_mode in (SearchMode.DENSE, SearchMode.HYBRID):
+                query_embedding = self._get_query_embeddings([query])[0]
+                result = self._query_vector_store(
+                    query_embedding, top_k, file_path_filter
                 )
-                return []
-        else:
-            include_files = []
+                dense_hits = list(zip(result.ids, result.similarities, strict=False))
 
-        if category and category != "test":
-            exclude_files = self._file_repo.find_files(
-                ["**/tests/**", "tests*", "*_test.py", "test_*.py"]
+        bm25_hits = []
+        if search_mode in (SearchMode.BM25, SearchMode.HYBRID):
+            bm25_hits = self._bm25_index.search(
+                query, top_k=top_k, file_path_filter=file_path_filter
             )
+
+        if search_mode == SearchMode.HYBRID:
+            fused = reciprocal_rank_fusion(
+                [
+                    [node_id for node_id, _ in dense_hits],
+                    [node_id for node_id, _ in bm25_hits],
+                ]
+            )
+            # Negated so that lower is better, as with vector distances
+            hits = [(node_id, -score) for node_id, score in fused[:top_k]]
+        elif search_mode == SearchMode.BM25:
+            hits = [(node_id, -score) for node_id, score in bm25_hits]
         else:
-            exclude_files = set()
+            hits = dense_hits
+
+        filtered_out_snippets = 0
+        ignored_removed_snippets = 0
+        sum_tokens = 0
 
-        search_results = []
+        sum_tokens_per_file = {}
 
-        for node_id, distance in zip(result.ids, result.similarities, strict=False):
-            node_doc = self._docstore.get_document(node_id, raise_error=False)
-            if not node_doc:
-                ignored_removed_snippets += 1
-                # TODO: Retry to get top_k results
-                continue
+        # Chunks without the trigrams of the searched content are skipped without loading them from the docstore
+        content_candidates = None
+        if exact_content_match and self._chunk_index:
+            content_candidates = self._chunk_index.candidate_node_ids(
+                exact_content_match
+            )
 
-            if exclude_files and node_doc.metadata["file_path"] in exclude_files:
-                filtered_out_snippets += 1
-                continue
+        returned_snippets = 0
 
-            if include_files and node_doc.metadata["file_path"] not in include_files:
+        for node_id, distance in hits:
+            if content_candidates is not None and node_id not in content_candidates:
                 filtered_out_snippets += 1
                 continue
 
-            is_test_file = is_test(node_doc.metadata["file_path"])
-            if category == "implementation" and is_test_file:
-                filtered_out_snippets += 1
+            node_doc = self._docstore.get_document(node_id, raise_error=False)
+            if not node_doc:
+                ignored_removed_snippets += 1
+                # TODO: Retry to get top_k results
                 continue
 
-            if category == "test" and not is_test_file:
+            # Vector stores that don't support the file path filter return unfiltered hits
+            if file_path_filter and not file_path_filter(node_doc.metadata["file_path"]):
                 filtered_out_snippets += 1
                 continue
 
@@ -849,18 +1197,17 @@ class CodeIndex:
                 end_line=node_doc.metadata.get("end_line", None),
             )
 
-            search_results.append(code_snippet)
+            returned_snippets += 1
+            yield code_snippet
 
         # TODO: Rerank by file pattern if no exact matches on file pattern
 
         logger.debug(
-            f"vector_search() Returning {len(search_results)} search results. "
+            f"vector_search() Returned {returned_snippets} search results. "
             f"(Ignored {ignored_removed_snippets} removed search results. "
-            f"Filtered out {filtered_out_snippets} search results from vector search result with {len(result.ids)} hits.)"
+            f"Filtered out {filtered_out_snippets} search results from {search_mode.value} search result with {len(hits)} hits.)"
         )
 
-        return search_results
-
     def run_ingestion(
         self,
         repo_path: Optional[str] = None,
@@ -868,11 +1215,241 @@ class CodeIndex:
         num_workers: Optional[int] = None,
     ):
         # Import llama_index components only when needed
-        from llama_index.core import SimpleDirectoryReader
         from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
 
         repo_path = repo_path or self._file_repo.path
 
+        if input_files:
+            input_files = [
+                os.path.join(repo_path, file)
+                for file in input_files
+                if not file.startswith(repo_path)
+            ]
+
+        reader = self._create_reader(repo_path, input_files=input_files)
+
+        embed_pipeline = IngestionPipeline(
+            transformations=[self._embed_model],
+            docstore_strategy=DocstoreStrategy.UPSERTS_AND_DELETE,
+            docstore=self._docstore,
+            vector_store=self._vector_store,
+        )
+
+        docs = reader.load_data()
+        logger.info(f"Read {len(docs)} documents")
+
+        blocks_by_class_name = {}
+        blocks_by_function_name = {}
+        symbol_graph_builder = SymbolGraphBuilder()
+
+        splitter = self._create_splitter(
+            repo_path,
+            index_callback=_create_index_callback(
+                blocks_by_class_name, blocks_by_function_name, symbol_graph_builder
+            ),
+            num_workers=num_workers,
+        )
+
+        prepared_nodes = splitter.get_nodes_from_documents(docs, show_progress=True)
+        self._symbol_graph = symbol_graph_builder.build()
+        prepared_tokens = sum(
+            count_tokens_batch(
+                [node.get_content() for node in prepared_nodes],
+                self._settings.embed_model,
+            )
+        )
+        logger.info(
+            f"Run embed pipeline with {len(prepared_nodes)} nodes and {prepared_tokens} tokens"
+        )
+
+        embedded_nodes = embed_pipeline.run(
+            nodes=list(prepared_nodes), show_progress=True, num_workers=num_workers
+        )
+
+        embedded_tokens = sum(
+            count_tokens_batch(
+                [node.get_content() for node in embedded_nodes],
+                self._settings.embed_model,
+            )
+        )
+        logger.info(
+            f"Embedded {len(embedded_nodes)} vectors with {embedded_tokens} tokens"
+        )
+
+        self._class_name_index = NameIndex.from_dict(blocks_by_class_name)
+        self._function_name_index = NameIndex.from_dict(blocks_by_function_name)
+        self._build_lexical_indexes()
+
+        return len(embedded_nodes), embedded_tokens
+
+    def update_from_git(
+        self,
+        repository: GitRepository,
+        base_commit: str,
+        commit: Optional[str] = None,
+        num_workers: Optional[int] = None,
+    ):
+        """
+        Incrementally update the index from the state at base_commit to commit (defaults to the current commit
+        of the repository). Only changed files are re-split and only chunks with changed content are re-embedded.
+        Vectors of removed files and chunks are deleted and the class and function name indexes are patched.
+
+        The changed files are read from the working tree, so commit must be the commit checked out in the
+        repository.
+        """
+        # Import llama_index components only when needed
+        from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
+
+        commit = commit or repository.current_commit
+        if repository.rev_parse(commit) != repository.rev_parse("HEAD"):
+            raise ValueError(
+                f"Can't update the index to {commit} as it isn't checked out in {repository.repo_path}, the files are read from the working tree."
+            )
+
+        repo_path = repository.repo_path
+        required_exts = self._required_exts()
+
+        changed_files = {
+            file_path: status
+            for file_path, status in repository.diff_files(base_commit, commit).items()
+            if os.path.splitext(file_path)[1] in required_exts
+        }
+
+        if not changed_files:
+            logger.info(
+                f"update_from_git() No indexed files changed since {base_commit}."
+            )
+            return 0, 0
+
+        deleted_files = {
+            file_path for file_path, status in changed_files.items() if status == "D"
+        }
+        updated_files = [
+            file_path for file_path in changed_files if file_path not in deleted_files
+        ]
+
+        logger.info(
+            f"update_from_git() {len(updated_files)} updated and {len(deleted_files)} deleted files since {base_commit}."
+        )
+
+        existing_node_ids = self._node_ids_by_file(set(changed_files.keys()))
+
+        blocks_by_class_name = {}
+        blocks_by_function_name = {}
+
+        # Indexes created before the symbol graph was added don't have the symbols of the unchanged files
+        symbol_graph_builder = None
+        if self._symbol_graph:
+            symbol_graph_builder = SymbolGraphBuilder(self._symbol_graph.file_symbols())
+            symbol_graph_builder.remove_files(changed_files.keys())
+
+        prepared_nodes = []
+        if updated_files:
+            reader = self._create_reader(
+                repo_path,
+                input_files=[os.path.join(repo_path, file) for file in updated_files],
+            )
+            docs = reader.load_data()
+
+            splitter = self._create_splitter(
+                repo_path,
+                index_callback=_create_index_callback(
+                    blocks_by_class_name, blocks_by_function_name, symbol_graph_builder
+                ),
+                num_workers=num_workers,
+            )
+            prepared_nodes = splitter.get_nodes_from_documents(
+                docs, show_progress=True
+            )
+
+        if symbol_graph_builder:
+            self._symbol_graph = symbol_graph_builder.build()
+
+        # Delete vectors for removed files and for chunks that no longer exist in updated files
+        new_node_ids = {node.id_ for node in prepared_nodes}
+        removed_node_ids = [
+            node_id
+            for node_ids in existing_node_ids.values()
+            for node_id in node_ids
+            if node_id not in new_node_ids
+        ]
+        for node_id in removed_node_ids:
+            self._docstore.delete_document(node_id, raise_error=False)
+            self._vector_store.delete(node_id)
+
+        # Upserts only re-embed nodes that are new or where the content hash has changed
+        embed_pipeline = IngestionPipeline(
+            transformations=[self._embed_model],
+            docstore_strategy=DocstoreStrategy.UPSERTS,
+            docstore=self._docstore,
+            vector_store=self._vector_store,
+        )
+
+        embedded_nodes = embed_pipeline.run(
+            nodes=list(prepared_nodes), show_progress=True, num_workers=num_workers
+        )
+
+        embedded_tokens = sum(
+            count_tokens_batch(
+                [node.get_content() for node in embedded_nodes],
+                self._settings.embed_model,
+            )
+        )
+        logger.info(
+            f"update_from_git() Removed {len(removed_node_ids)} and embedded {len(embedded_nodes)} vectors with {embedded_tokens} tokens."
+        )
+
+        class_names = self._class_name_index.to_dict()
+        _patch_name_index(class_names, blocks_by_class_name, changed_files.keys())
+        self._class_name_index = NameIndex.from_dict(class_names)
+
+        function_names = self._function_name_index.to_dict()
+        _patch_name_index(function_names, blocks_by_function_name, changed_files.keys())
+        self._function_name_index = NameIndex.from_dict(function_names)
+
+        self._update_lexical_indexes(changed_files.keys(), prepared_nodes)
+
+        return len(embedded_nodes), embedded_tokens
+
+    def _build_lexical_indexes(self):
+        nodes = list(self._docstore.docs.values())
+        self._chunk_index = ChunkTrigramIndex.build(nodes)
+        self._bm25_index = BM25Index.build(nodes)
+
+    def _update_lexical_indexes(
+        self, file_paths: Iterable[str], nodes: list[BaseNode]
+    ):
+        """Replace the chunks of the files in the lexical indexes, without reading the chunks of other files."""
+        if not self._chunk_index or not self._bm25_index:
+            # Indexes persisted before the lexical indexes were added are built from the docstore once
+            self._build_lexical_indexes()
+            return
+
+        file_paths = list(file_paths)
+        self._chunk_index = self._chunk_index.update(file_paths, nodes)
+        self._bm25_index = self._bm25_index.update(file_paths, nodes)
+
+    def _node_ids_by_file(self, file_paths: set[str]) -> Dict[str, List[str]]:
+        if self._chunk_index:
+            return self._chunk_index.node_ids_by_file(file_paths)
+
+        node_ids_by_file = {}
+        for node_id, node in self._docstore.docs.items():
+            file_path = node.metadata.get("file_path")
+            if file_path in file_paths:
+                node_ids_by_file.setdefault(file_path, []).append(node_id)
+        return node_ids_by_file
+
+    def _required_exts(self) -> list[str]:
+        if self._settings and self._settings.language == "java":
+            return [".java"]
+        else:
+            return [".py"]
+
+    def _create_reader(self, repo_path: str, input_files: list[str] | None = None):
+        # Import llama_index components only when needed
+        from llama_index.core import SimpleDirectoryReader
+
         # Only extract file name and type to not trigger unnecessary embedding jobs
         def file_metadata_func(file_path: str) -> dict:
             file_path = file_path.replace(repo_path, "")
@@ -888,20 +1465,10 @@ class CodeIndex:
                 "category": category,
             }
 
-        if self._settings and self._settings.language == "java":
-            required_exts = [".java"]
-        else:
-            required_exts = [".py"]
-
-        if input_files:
-            input_files = [
-                os.path.join(repo_path, file)
-                for file in input_files
-                if not file.startswith(repo_path)
-            ]
+        required_exts = self._required_exts()
 
         try:
-            reader = SimpleDirectoryReader(
+            return SimpleDirectoryReader(
                 input_dir=repo_path,
                 file_metadata=file_metadata_func,
                 input_files=input_files,
@@ -915,39 +1482,15 @@ class CodeIndex:
             )
             raise e
 
-        embed_pipeline = IngestionPipeline(
-            transformations=[self._embed_model],
-            docstore_strategy=DocstoreStrategy.UPSERTS_AND_DELETE,
-            docstore=self._docstore,
-            vector_store=self._vector_store,
-        )
-
-        docs = reader.load_data()
-        # print(docs)
-        print(len(docs))
-        logger.info(f"Read {len(docs)} documents")
-
-        blocks_by_class_name = {}
-        blocks_by_function_name = {}
-
-        def index_callback(codeblock: CodeBlock):
-            if codeblock.type == CodeBlockType.CLASS:
-                if codeblock.identifier not in blocks_by_class_name:
-                    blocks_by_class_name[codeblock.identifier] = []
-                blocks_by_class_name[codeblock.identifier].append(
-                    (codeblock.module.file_path, codeblock.full_path())
-                )
-
-            if codeblock.type == CodeBlockType.FUNCTION:
-                if codeblock.identifier not in blocks_by_function_name:
-                    blocks_by_function_name[codeblock.identifier] = []
-                blocks_by_function_name[codeblock.identifier].append(
-                    (codeblock.module.file_path, codeblock.full_path())
-                )
-
+    def _create_splitter(
+        self,
+        repo_path: str,
+        index_callback: Callable[[CodeBlock], None],
+        num_workers: Optional[int] = None,
+    ):
         from moatless_qa.index.epic_split import EpicSplitter
 
-        splitter = EpicSplitter(
+        return EpicSplitter(
             language=self._settings.language,
             min_chunk_size=self._settings.min_chunk_size,
             chunk_size=self._settings.chunk_size,
@@ -956,38 +1499,9 @@ class CodeIndex:
             comment_strategy=self._settings.comment_strategy,
             index_callback=index_callback,
             repo_path=repo_path,
+            num_workers=num_workers,
         )
 
-        prepared_nodes = splitter.get_nodes_from_documents(docs, show_progress=True)
-        prepared_tokens = sum(
-            [
-                count_tokens(node.get_content(), self._settings.embed_model)
-                for node in prepared_nodes
-            ]
-        )
-        logger.info(
-            f"Run embed pipeline with {len(prepared_nodes)} nodes and {prepared_tokens} tokens"
-        )
-
-        embedded_nodes = embed_pipeline.run(
-            nodes=list(prepared_nodes), show_progress=True, num_workers=num_workers
-        )
-        
-        embedded_tokens = sum(
-            [
-                count_tokens(node.get_content(), self._settings.embed_model)
-                for node in embedded_nodes
-            ]
-        )
-        logger.info(
-            f"Embedded {len(embedded_nodes)} vectors with {embedded_tokens} tokens"
-        )
-
-        self._blocks_by_class_name = blocks_by_class_name
-        self._blocks_by_function_name = blocks_by_function_name
-
-        return len(embedded_nodes), embedded_tokens
-
     def persist(self, persist_dir: str):
         self._vector_store.persist(persist_dir)
         self._docstore.persist(
@@ -996,11 +1510,85 @@ class CodeIndex:
         )
         self._settings.persist(persist_dir)
 
-        with open(os.path.join(persist_dir, "blocks_by_class_name.json"), "w") as f:
-            f.write(json.dumps(self._blocks_by_class_name, indent=2))
+        self._class_name_index.persist(persist_dir, "blocks_by_class_name")
+        self._function_name_index.persist(persist_dir, "blocks_by_function_name")
+
+        # Remove name indexes in the old JSON format to not leave a stale copy behind
+        for prefix in ("blocks_by_class_name", "blocks_by_function_name"):
+            if os.path.exists(os.path.join(persist_dir, f"{prefix}.json")):
+                os.remove(os.path.join(persist_dir, f"{prefix}.json"))
+
+        if self._chunk_index:
+            self._chunk_index.persist(persist_dir)
+
+        if self._bm25_index:
+            self._bm25_index.persist(persist_dir)
+
+        if self._symbol_graph:
+            self._symbol_graph.persist(persist_dir)
+
+
+def _create_index_callback(
+    blocks_by_class_name: dict,
+    blocks_by_function_name: dict,
+    symbol_graph_builder: SymbolGraphBuilder | None = None,
+) -> Callable[[CodeBlock], None]:
+    def index_callback(codeblock: CodeBlock):
+        if symbol_graph_builder:
+            symbol_graph_builder.add_block(codeblock)
+
+        if codeblock.type == CodeBlockType.CLASS:
+            if codeblock.identifier not in blocks_by_class_name:
+                blocks_by_class_name[codeblock.identifier] = []
+            blocks_by_class_name[codeblock.identifier].append(
+                (codeblock.module.file_path, codeblock.full_path())
+            )
+
+        if codeblock.type == CodeBlockType.FUNCTION:
+            if codeblock.identifier not in blocks_by_function_name:
+                blocks_by_function_name[codeblock.identifier] = []
+            blocks_by_function_name[codeblock.identifier].append(
+                (codeblock.module.file_path, codeblock.full_path())
+            )
+
+    return index_callback
+
+
+def _to_name_index(blocks_by_name: dict | NameIndex | None) -> NameIndex:
+    if isinstance(blocks_by_name, NameIndex):
+        return blocks_by_name
+    return NameIndex.from_dict(blocks_by_name or {})
+
+
+def _load_name_index(persist_dir: str, prefix: str) -> NameIndex:
+    if NameIndex.exists(persist_dir, prefix):
+        return NameIndex.from_persist_dir(persist_dir, prefix)
+
+    # Indexes persisted before the columnar format
+    if os.path.exists(os.path.join(persist_dir, f"{prefix}.json")):
+        with open(os.path.join(persist_dir, f"{prefix}.json")) as f:
+            return NameIndex.from_dict(json.load(f))
+
+    return NameIndex.from_dict({})
+
+
+def _patch_name_index(
+    name_index: dict, updated_index: dict, changed_file_paths: Iterable[str]
+):
+    """
+    Replace the entries for the changed files in name_index with the entries in updated_index.
+    """
+    changed_file_paths = set(changed_file_paths)
+    for name in list(name_index.keys()):
+        paths = [path for path in name_index[name] if path[0] not in changed_file_paths]
+        if paths:
+            name_index[name] = paths
+        else:
+            del name_index[name]
+
+    for name, paths in updated_index.items():
+        name_index.setdefault(name, []).extend(paths)
 
-        with open(os.path.join(persist_dir, "blocks_by_function_name.json"), "w") as f:
-            f.write(json.dumps(self._blocks_by_function_name, indent=2))
 
 def _rerank_files(file_paths: list[str], file_pattern: str):
     if len(file_paths) < 2:
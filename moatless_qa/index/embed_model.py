@@ -3,7 +3,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from moatless_qa.index.retry_voyage_embedding import VoyageEmbeddingWithRetry
+# Models with this prefix are run locally with sentence-transformers, e.g. "local/BAAI/bge-small-en-v1.5"
+LOCAL_EMBED_MODEL_PREFIX = "local/"
 
 
 # def get_embed_model(model_name: str) -> "BaseEmbedding":
@@ -38,7 +39,33 @@ from moatless_qa.index.retry_voyage_embedding import VoyageEmbeddingWithRetry
     
 
 def get_embed_model(model_name: str) -> "BaseEmbedding":
+    if model_name.startswith(LOCAL_EMBED_MODEL_PREFIX):
+        embed_model = get_local_embed_model(model_name)
+    else:
+        embed_model = get_voyage_embed_model()
 
+    # Cache embeddings on disk to not re-embed identical chunks when indexing the same repository at different commits
+    if os.getenv("EMBEDDING_CACHE_DIR"):
+        from moatless_qa.index.embedding_cache import CachedEmbedding
+
+        return CachedEmbedding(
+            embed_model=embed_model, cache_dir=os.getenv("EMBEDDING_CACHE_DIR")
+        )
+
+    return embed_model
+
+
+def get_local_embed_model(model_name: str) -> "BaseEmbedding":
+    from moatless_qa.index.local_embedding import LocalEmbedding
+
+    return LocalEmbedding(
+        model_name=model_name[len(LOCAL_EMBED_MODEL_PREFIX) :],
+        device=os.getenv("LOCAL_EMBED_DEVICE", "cpu"),
+        backend=os.getenv("LOCAL_EMBED_BACKEND", "torch"),
+    )
+
+
+def get_voyage_embed_model() -> "BaseEmbedding":
     try:
         from llama_index.embeddings.voyageai import VoyageEmbedding
     except ImportError as e:
@@ -46,6 +73,8 @@ def get_embed_model(model_name: str) -> "BaseEmbedding":
             "llama-index-embeddings-voyageai is not installed. Please install it using `pip install llama-index-embeddings-voyageai`"
         ) from e
 
+    from moatless_qa.index.retry_voyage_embedding import VoyageEmbeddingWithRetry
+
     if "VOYAGE_API_KEY" not in os.environ:
         raise ValueError(
             "VOYAGE_API_KEY environment variable is not set. Please set it to your Voyage API key."
@@ -56,3 +85,44 @@ def get_embed_model(model_name: str) -> "BaseEmbedding":
         truncation=True,
         embed_batch_size=80,
     )
+
+
+def get_query_embeddings(
+    embed_model: "BaseEmbedding", queries: list[str]
+) -> list[list[float]]:
+    """
+    Embed queries in one batch if the model supports it, otherwise one at a time.
+    """
+    if hasattr(embed_model, "get_query_embedding_batch"):
+        return embed_model.get_query_embedding_batch(queries)
+    return [embed_model.get_query_embedding(query) for query in queries]
+
+
+def get_embed_dimensions(embed_model: "BaseEmbedding") -> int | None:
+    """
+    Returns the number of dimensions of the vectors if it's known without calling a remote API.
+    """
+    from moatless_qa.index.embedding_cache import CachedEmbedding
+    from moatless_qa.index.local_embedding import LocalEmbedding
+
+    if isinstance(embed_model, CachedEmbedding):
+        embed_model = embed_model.wrapped_model
+
+    if isinstance(embed_model, LocalEmbedding):
+        return embed_model.dimensions
+
+    return None
+
+
+def get_embed_model_key(embed_model: "BaseEmbedding", dimensions: int) -> str:
+    """
+    Returns a key identifying the vectors of the embedding model, from the class and name of the model that
+    creates them and the number of dimensions.
+    """
+    from moatless_qa.index.embedding_cache import CachedEmbedding
+
+    if isinstance(embed_model, CachedEmbedding):
+        embed_model = embed_model.wrapped_model
+
+    dimensions = get_embed_dimensions(embed_model) or dimensions
+    return f"{embed_model.class_name()}/{embed_model.model_name}/{dimensions}"
@@ -0,0 +1,230 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+# SQLite has a limit on the number of variables in one statement
+_MAX_LOOKUP_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class EmbeddingCacheStore:
+    """
+    On-disk store of embeddings keyed by (model, sha256(text)). Vectors are stored as float16 blobs in SQLite.
+    The connection is opened lazily so the store can be pickled to worker processes.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cache_dir, "embeddings.sqlite")
+
+    def __getstate__(self):
+        return {"cache_dir": self.cache_dir}
+
+    def __setstate__(self, state):
+        self.cache_dir = state["cache_dir"]
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "text_hash TEXT NOT NULL, "
+                "vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        conn = self._connection()
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique_hashes), _MAX_LOOKUP_BATCH):
+            batch = unique_hashes[i : i + _MAX_LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch],
+            )
+            for hash_, blob in rows:
+                found[hash_] = (
+                    np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+                )
+        return found
+
+    def put_many(self, model: str, hashes: list[str], embeddings: list[list[float]]):
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [
+                (model, hash_, np.asarray(embedding, dtype=np.float16).tobytes())
+                for hash_, embedding in zip(hashes, embeddings, strict=True)
+            ],
+        )
+        conn.commit()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings, backed by the on-disk store when a cache directory is set. Queries
+    are normalized on whitespace so that near-identical queries share an entry.
+    """
+
+    def __init__(
+        self, model_name: str, max_size: int = 1024, cache_dir: Optional[str] = None
+    ):
+        # Query embeddings can differ from text embeddings of the same text
+        self._model_key = f"{model_name}:query"
+        self._max_size = max_size
+        self._entries: OrderedDict[str, list[float]] = OrderedDict()
+        self._store = EmbeddingCacheStore(cache_dir) if cache_dir else None
+
+    def _put(self, key: str, embedding: list[float]):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def get_embeddings(
+        self,
+        queries: list[str],
+        embed_fn: Callable[[list[str]], list[list[float]]],
+    ) -> list[list[float]]:
+        """Returns embeddings for the queries, embedding the ones not in the cache with one call to embed_fn."""
+        keys = [normalize_query(query) for query in queries]
+
+        found = {key: self._entries[key] for key in keys if key in self._entries}
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+
+        if missing and self._store:
+            keys_by_hash = {text_hash(key): key for key in missing}
+            stored = self._store.get_many(self._model_key, list(keys_by_hash.keys()))
+            for hash_, embedding in stored.items():
+                found[keys_by_hash[hash_]] = embedding
+            missing = [key for key in missing if key not in found]
+
+        if missing:
+            logger.debug(f"Embedding {len(missing)} of {len(keys)} queries.")
+            embeddings = embed_fn(missing)
+            if self._store:
+                self._store.put_many(
+                    self._model_key, [text_hash(key) for key in missing], embeddings
+                )
+                # Return the stored precision so results don't depend on whether a query was cached
+                embeddings = [
+                    np.asarray(embedding, dtype=np.float16).astype(np.float32).tolist()
+                    for embedding in embeddings
+                ]
+            found.update(zip(missing, embeddings, strict=True))
+
+        for key in keys:
+            self._put(key, found[key])
+
+        return [found[key] for key in keys]
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model and caches text embeddings on disk. Only texts that aren't already
+    in the cache are sent to the wrapped model, in as few batches as possible.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingCacheStore = PrivateAttr()
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        cache_dir: str,
+        embed_batch_size: int = 1000,
+        **kwargs: Any,
+    ):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._store = EmbeddingCacheStore(cache_dir)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def wrapped_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed_model.get_query_embedding(query)
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        from moatless_qa.index.embed_model import get_query_embeddings
+
+        return get_query_embeddings(self._embed_model, queries)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._embed_model.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        cached = self._store.get_many(self.model_name, hashes)
+
+        missing = {}
+        for hash_, text in zip(hashes, texts, strict=True):
+            if hash_ not in cached and hash_ not in missing:
+                missing[hash_] = text
+
+        if missing:
+            logger.info(
+                f"Embedding {len(missing)} texts, {len(texts) - len(missing)} found in cache."
+            )
+            missing_hashes = list(missing.keys())
+            embeddings = self._embed_model.get_text_embedding_batch(
+                list(missing.values())
+            )
+            self._store.put_many(self.model_name, missing_hashes, embeddings)
+
+            # Return the stored precision so results don't depend on whether a text was cached
+            cached.update(
+                zip(
+                    missing_hashes,
+                    [
+                        np.asarray(embedding, dtype=np.float16)
+                        .astype(np.float32)
+                        .tolist()
+                        for embedding in embeddings
+                    ],
+                    strict=True,
+                )
+            )
+
+        return [cached[hash_] for hash_ in hashes]
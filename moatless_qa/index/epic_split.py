@@ -1,6 +1,9 @@
+import math
 import re
 import time
 from collections.abc import Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from typing import Any, Optional
 
 from llama_index.core.bridge.pydantic import Field, PrivateAttr
@@ -8,12 +11,19 @@ from llama_index.core.callbacks import CallbackManager
 from llama_index.core.node_parser import NodeParser, TextSplitter, TokenTextSplitter
 from llama_index.core.node_parser.node_utils import logger
 from llama_index.core.schema import BaseNode, TextNode
-from llama_index.core.utils import get_tokenizer, get_tqdm_iterable
+from llama_index.core.utils import get_tqdm_iterable
 
 from moatless_qa.codeblocks import create_parser, CodeParser
-from moatless_qa.codeblocks.codeblocks import CodeBlock, CodeBlockType, PathTree
+from moatless_qa.codeblocks.codeblocks import (
+    INDEXED_BLOCKS,
+    CodeBlock,
+    CodeBlockType,
+    PathTree,
+    Relationship,
+)
 from moatless_qa.index.code_node import CodeNode
 from moatless_qa.index.settings import CommentStrategy
+from moatless_qa.utils.tokenizer import count_tokens
 
 CodeBlockChunk = list[CodeBlock]
 
@@ -38,6 +48,73 @@ SPLIT_BLOCK_TYPES = [
 ]
 
 
+@dataclass
+class IndexedBlock:
+    """
+    Picklable stand-in for a CodeBlock that is passed to index_callback when
+    documents are split in worker processes. Exposes the same attributes as a
+    CodeBlock that index callbacks use.
+    """
+
+    type: CodeBlockType
+    identifier: Optional[str]
+    file_path: Optional[str]
+    block_path: list[str]
+    span_id: Optional[str] = None
+    span_tokens: int = 0
+    relationships: list[Relationship] = field(default_factory=list)
+
+    @property
+    def module(self) -> "IndexedBlock":
+        return self
+
+    def full_path(self) -> list[str]:
+        return self.block_path
+
+
+_worker_splitter: Optional["EpicSplitter"] = None
+_worker_indexed_blocks: list[IndexedBlock] = []
+
+
+def _collect_indexed_block(codeblock: CodeBlock):
+    # Blocks with relationships are collected for the symbol graph
+    if codeblock.type in INDEXED_BLOCKS or codeblock.relationships:
+        span = codeblock.belongs_to_span
+        _worker_indexed_blocks.append(
+            IndexedBlock(
+                type=codeblock.type,
+                identifier=codeblock.identifier,
+                file_path=codeblock.module.file_path,
+                block_path=codeblock.full_path(),
+                span_id=span.span_id if span else None,
+                span_tokens=span.tokens if span else 0,
+                relationships=list(codeblock.relationships),
+            )
+        )
+
+
+def _init_worker(splitter_kwargs: dict):
+    # Each worker process gets its own splitter and CodeParser as the parser isn't thread safe
+    global _worker_splitter
+    _worker_splitter = EpicSplitter(
+        index_callback=_collect_indexed_block, **splitter_kwargs
+    )
+
+
+def _split_in_worker(
+    nodes: list[BaseNode],
+) -> tuple[list[dict], list[IndexedBlock]]:
+    _worker_indexed_blocks.clear()
+
+    chunk_nodes = []
+    for node in nodes:
+        chunk_nodes.extend(_worker_splitter._split_node(node))
+
+    indexed_blocks = list(_worker_indexed_blocks)
+    _worker_indexed_blocks.clear()
+    return [chunk_node.to_dict() for chunk_node in chunk_nodes], indexed_blocks
+
+
 class EpicSplitter(NodeParser):
     language: str = Field(
         default="python", description="Language of the code blocks to parse."
@@ -82,7 +159,13 @@ class EpicSplitter(NodeParser):
         default=None, description="Callback to call when indexing a code block."
     )
 
+    num_workers: Optional[int] = Field(
+        default=None,
+        description="Number of worker processes to parse and split documents in. Documents are split in the current process if not set.",
+    )
+
     _parser: CodeParser = PrivateAttr()
+    _min_lines_to_parse_block: int = PrivateAttr()
     # _fallback_code_splitter: Optional[TextSplitter] = PrivateAttr() TODO: Implement fallback when tree sitter fails
 
     def __init__(
@@ -104,6 +187,7 @@ class EpicSplitter(NodeParser):
         include_non_code_files: bool = True,
         tokenizer: Optional[Callable] = None,
         non_code_file_extensions: list[str] | None = None,
+        num_workers: Optional[int] = None,
         callback_manager: CallbackManager | None = None,
     ) -> None:
         if non_code_file_extensions is None:
@@ -115,6 +199,8 @@ class EpicSplitter(NodeParser):
             index_callback=index_callback,
             min_lines_to_parse_block=min_lines_to_parse_block,
             enable_code_graph=False,
+            # Relationships are read from the blocks by the index callback to build the symbol graph
+            enable_references=True,
         )
         # self._fallback_code_splitter = fallback_code_splitter
 
@@ -133,11 +219,14 @@ class EpicSplitter(NodeParser):
             comment_strategy=comment_strategy,
             include_non_code_files=include_non_code_files,
             non_code_file_extensions=non_code_file_extensions,
+            num_workers=num_workers,
             include_metadata=include_metadata,
             include_prev_next_rel=include_prev_next_rel,
             callback_manager=callback_manager,
         )
 
+        self._min_lines_to_parse_block = min_lines_to_parse_block
+
     @classmethod
     def class_name(cls):
         return "GhostcoderNodeParser"
@@ -148,55 +237,113 @@ class EpicSplitter(NodeParser):
         show_progress: bool = False,
         **kwargs: Any,
     ) -> list[BaseNode]:
+        if self.num_workers and self.num_workers > 1 and len(nodes) > 1:
+            return self._parse_nodes_in_workers(nodes, show_progress=show_progress)
+
         nodes_with_progress = get_tqdm_iterable(nodes, show_progress, "Parsing nodes")
 
         all_nodes: list[BaseNode] = []
-
         for node in nodes_with_progress:
-            file_path = node.metadata.get("file_path")
-            content = node.text
-            try:
-                starttime = time.time_ns()
-
-                # TODO: Derive language from file extension
-                codeblock = self._parser.parse(content, file_path=file_path)
-
-                parse_time = time.time_ns() - starttime
-                if parse_time > 1e9:
-                    logger.warning(
-                        f"Parsing file {file_path} took {parse_time / 1e9:.2f} seconds."
-                    )
+            all_nodes.extend(self._split_node(node))
+        return all_nodes
 
-            except Exception as e:
-                logger.warning(
-                    f"Failed to use epic splitter to split {file_path}. Fallback to treesitter_split(). Error: {e}"
-                )
-                # TODO: Fall back to treesitter or text split
-                continue
+    def _parse_nodes_in_workers(
+        self, nodes: Sequence[BaseNode], show_progress: bool = False
+    ) -> list[BaseNode]:
+        # Use several batches per worker to even out the load from files of very different sizes
+        batch_size = max(1, math.ceil(len(nodes) / (self.num_workers * 4)))
+        batches = [
+            list(nodes[i : i + batch_size]) for i in range(0, len(nodes), batch_size)
+        ]
 
-            starttime = time.time_ns()
-            chunks = self._chunk_contents(codeblock=codeblock, file_path=file_path)
-            parse_time = time.time_ns() - starttime
-            if parse_time > 1e8:
-                logger.warning(
-                    f"Splitting file {file_path} took {parse_time / 1e9:.2f} seconds."
-                )
-            if len(chunks) > 100:
-                logger.info(f"Splitting file {file_path} in {len(chunks)} chunks")
+        logger.info(
+            f"Splitting {len(nodes)} documents in {len(batches)} batches with {self.num_workers} workers."
+        )
 
+        all_nodes: list[BaseNode] = []
+        with ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=_init_worker,
+            initargs=(self._worker_kwargs(),),
+        ) as executor:
+            # map() returns results in submission order so the merged result doesn't depend on worker scheduling
+            results = get_tqdm_iterable(
+                executor.map(_split_in_worker, batches),
+                show_progress,
+                "Parsing nodes",
+            )
+            for node_dicts, indexed_blocks in results:
+                all_nodes.extend(CodeNode.from_dict(node_dict) for node_dict in node_dicts)
+
+                if self.index_callback:
+                    for indexed_block in indexed_blocks:
+                        self.index_callback(indexed_block)
+
+        return all_nodes
+
+    def _worker_kwargs(self) -> dict:
+        return {
+            "language": self.language,
+            "chunk_size": self.chunk_size,
+            "min_chunk_size": self.min_chunk_size,
+            "max_chunk_size": self.max_chunk_size,
+            "hard_token_limit": self.hard_token_limit,
+            "max_chunks": self.max_chunks,
+            "include_metadata": self.include_metadata,
+            "include_prev_next_rel": self.include_prev_next_rel,
+            "repo_path": self.repo_path,
+            "comment_strategy": self.comment_strategy,
+            "min_lines_to_parse_block": self._min_lines_to_parse_block,
+            "include_non_code_files": self.include_non_code_files,
+            "non_code_file_extensions": self.non_code_file_extensions,
+        }
+
+    def _split_node(self, node: BaseNode) -> list[BaseNode]:
+        file_path = node.metadata.get("file_path")
+        content = node.text
+        try:
             starttime = time.time_ns()
-            for chunk in chunks:
-                path_tree = self._create_path_tree(chunk)
-                content = self._to_context_string(codeblock, path_tree)
-                chunk_node = self._create_node(content, node, chunk=chunk)
-                if chunk_node:
-                    all_nodes.append(chunk_node)
+
+            # TODO: Derive language from file extension
+            codeblock = self._parser.parse(content, file_path=file_path)
+
             parse_time = time.time_ns() - starttime
             if parse_time > 1e9:
                 logger.warning(
-                    f"Create nodes for file {file_path} took {parse_time / 1e9:.2f} seconds."
+                    f"Parsing file {file_path} took {parse_time / 1e9:.2f} seconds."
                 )
-        return all_nodes
+
+        except Exception as e:
+            logger.warning(
+                f"Failed to use epic splitter to split {file_path}. Fallback to treesitter_split(). Error: {e}"
+            )
+            # TODO: Fall back to treesitter or text split
+            return []
+
+        starttime = time.time_ns()
+        chunks = self._chunk_contents(codeblock=codeblock, file_path=file_path)
+        parse_time = time.time_ns() - starttime
+        if parse_time > 1e8:
+            logger.warning(
+                f"Splitting file {file_path} took {parse_time / 1e9:.2f} seconds."
+            )
+        if len(chunks) > 100:
+            logger.info(f"Splitting file {file_path} in {len(chunks)} chunks")
+
+        starttime = time.time_ns()
+        chunk_nodes = []
+        for chunk in chunks:
+            path_tree = self._create_path_tree(chunk)
+            content = self._to_context_string(codeblock, path_tree)
+            chunk_node = self._create_node(content, node, chunk=chunk)
+            if chunk_node:
+                chunk_nodes.append(chunk_node)
+        parse_time = time.time_ns() - starttime
+        if parse_time > 1e9:
+            logger.warning(
+                f"Create nodes for file {file_path} took {parse_time / 1e9:.2f} seconds."
+            )
+        return chunk_nodes
 
     def _chunk_contents(
         self, codeblock: CodeBlock | None = None, file_path: Optional[str] = None
@@ -513,5 +660,4 @@ class EpicSplitter(NodeParser):
         )
 
     def _count_tokens(self, text: str):
-        tokenizer = get_tokenizer()
-        return len(tokenizer(text))
+        return count_tokens(text)
@@ -0,0 +1,96 @@
+import logging
+from typing import Any, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    Embedding model that runs locally with sentence-transformers, on CPU by default. No network access is needed
+    once the model is available in the local Hugging Face cache.
+    """
+
+    device: str = Field(default="cpu", description="Device to run the model on.")
+    backend: str = Field(
+        default="torch", description="Inference backend, 'torch' or 'onnx'."
+    )
+    normalize: bool = Field(
+        default=True, description="Whether to L2 normalize the embeddings."
+    )
+    query_instruction: Optional[str] = Field(
+        default=None, description="Instruction to prepend to queries."
+    )
+
+    _model: Any = PrivateAttr()
+
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "cpu",
+        backend: str = "torch",
+        embed_batch_size: int = 32,
+        normalize: bool = True,
+        query_instruction: Optional[str] = None,
+        **kwargs: Any,
+    ):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "sentence-transformers is not installed. Please install it using `pip install sentence-transformers`"
+            ) from e
+
+        super().__init__(
+            model_name=model_name,
+            embed_batch_size=embed_batch_size,
+            device=device,
+            backend=backend,
+            normalize=normalize,
+            query_instruction=query_instruction,
+            **kwargs,
+        )
+
+        logger.info(
+            f"Loading local embedding model {model_name} on {device} with backend {backend}."
+        )
+        self._model = SentenceTransformer(model_name, device=device, backend=backend)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    @property
+    def dimensions(self) -> int:
+        return self._model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self._model.encode(
+            texts,
+            batch_size=self.embed_batch_size,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return embeddings.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        if self.query_instruction:
+            query = f"{self.query_instruction}{query}"
+        return self._encode([query])[0]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        if self.query_instruction:
+            queries = [f"{self.query_instruction}{query}" for query in queries]
+        return self._encode(queries)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
@@ -0,0 +1,415 @@
+"""Memory-mapped binary storage of the vector store id mappings and metadata."""
+
+import bisect
+import json
+import logging
+import os
+from collections.abc import Callable, Iterator, Mapping, MutableMapping
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_IDS_FILE = "vector_index.ids.npy"
+VECTOR_ROWS_FILE = "vector_index.rows.npy"
+TEXT_IDS_FILE = "vector_index.text_ids"
+REF_DOC_IDS_FILE = "vector_index.ref_doc_ids"
+METADATA_FILE = "vector_index.metadata"
+REF_DOC_KEYS_FILE = "vector_index.ref_doc_keys"
+REF_DOC_VECTOR_IDS_FILE = "vector_index.ref_doc_vector_ids"
+STATE_FILE = "vector_index.state.json"
+FILE_PATHS_FILE = "vector_index.file_paths"
+VECTOR_FILE_IDS_FILE = "vector_index.file_ids.npy"
+VECTOR_CATEGORIES_FILE = "vector_index.categories.npy"
+
+
+def _load_array(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty arrays can't be memory-mapped
+        return np.load(path)
+
+
+def _save_array(path: str, array: np.ndarray):
+    # Write to a temporary file and replace so that memory-mapped readers of the old file aren't affected
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class StringColumn:
+    """
+    A column of strings stored as one utf-8 blob and an array of offsets, with row i
+    at blob[offsets[i]:offsets[i + 1]]. Empty values are treated as missing.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def load(cls, path: str) -> "StringColumn":
+        return cls(_load_array(f"{path}.npy"), _load_array(f"{path}.offsets.npy"))
+
+    @staticmethod
+    def write(path: str, values: list[bytes]):
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        if values:
+            offsets[1:] = np.cumsum([len(value) for value in values])
+        blob = np.frombuffer(b"".join(values), dtype=np.uint8)
+        _save_array(f"{path}.npy", blob)
+        _save_array(f"{path}.offsets.npy", offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def raw(self, row: int) -> bytes:
+        return self._blob[self._offsets[row] : self._offsets[row + 1]].tobytes()
+
+    def __getitem__(self, row: int) -> str:
+        return self.raw(row).decode("utf-8")
+
+    def has_value(self, row: int) -> bool:
+        return self._offsets[row + 1] > self._offsets[row]
+
+    def count_values(self) -> int:
+        return int(np.count_nonzero(np.diff(self._offsets)))
+
+
+class MappedStringMap(Mapping):
+    """Read-only mapping from a sorted column of string keys to a column of values on the same rows."""
+
+    def __init__(
+        self,
+        keys: StringColumn,
+        values: StringColumn,
+        decode: Callable[[bytes], Any] = lambda value: value.decode("utf-8"),
+    ):
+        self._keys = keys
+        self._values = values
+        self._decode = decode
+        self._len = values.count_values()
+
+    def row(self, key: str) -> int | None:
+        row = bisect.bisect_left(self._keys, key)
+        if row < len(self._keys) and self._keys[row] == key:
+            return row
+        return None
+
+    def __getitem__(self, key: str) -> Any:
+        row = self.row(key)
+        if row is None or not self._values.has_value(row):
+            raise KeyError(key)
+        return self._decode(self._values.raw(row))
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        row = self.row(key)
+        return row is not None and self._values.has_value(row)
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self._keys)):
+            if self._values.has_value(row):
+                yield self._keys[row]
+
+    def __len__(self) -> int:
+        return self._len
+
+
+class MappedIdMap(Mapping):
+    """Read-only mapping from sorted integer vector ids to the text ids on the referenced rows."""
+
+    def __init__(self, ids: np.ndarray, rows: np.ndarray, text_ids: StringColumn):
+        self._ids = ids
+        self._rows = rows
+        self._text_ids = text_ids
+
+    def _index(self, key: Any) -> int | None:
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return None
+        index = int(np.searchsorted(self._ids, key))
+        if index < len(self._ids) and self._ids[index] == key:
+            return index
+        return None
+
+    def __getitem__(self, key: int) -> str:
+        index = self._index(key)
+        if index is None:
+            raise KeyError(key)
+        return self._text_ids[int(self._rows[index])]
+
+    def __contains__(self, key: object) -> bool:
+        return self._index(key) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        for vector_id in self._ids:
+            yield int(vector_id)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class MappedListMap(Mapping):
+    """
+    Read-only mapping from a sorted column of string keys to lists of integers, stored as
+    one array of values and an array of offsets per key.
+    """
+
+    def __init__(self, keys: StringColumn, values: np.ndarray, offsets: np.ndarray):
+        self._keys = keys
+        self._values = values
+        self._offsets = offsets
+
+    def _row(self, key: Any) -> int | None:
+        if not isinstance(key, str):
+            return None
+        row = bisect.bisect_left(self._keys, key)
+        if row < len(self._keys) and self._keys[row] == key:
+            return row
+        return None
+
+    def __getitem__(self, key: str) -> list[int]:
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+        return self._values[self._offsets[row] : self._offsets[row + 1]].tolist()
+
+    def __contains__(self, key: object) -> bool:
+        return self._row(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self._keys)):
+            yield self._keys[row]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class OverlayDict(MutableMapping):
+    """
+    A dict backed by a read-only base mapping, with changes kept in memory. Reads fall through
+    to the base mapping for keys that haven't been changed.
+    """
+
+    def __init__(self, base: Mapping | None = None):
+        self._base = base if base is not None else {}
+        self._added = {}
+        self._removed = set()
+        self._shadowed = set()  # Keys in the base mapping that have been changed or removed
+
+    def __getitem__(self, key: Any) -> Any:
+        if key in self._added:
+            return self._added[key]
+        if key in self._removed:
+            raise KeyError(key)
+        return self._base[key]
+
+    def __setitem__(self, key: Any, value: Any):
+        self._added[key] = value
+        self._removed.discard(key)
+        if key in self._base:
+            self._shadowed.add(key)
+
+    def __delitem__(self, key: Any):
+        if key in self._added:
+            del self._added[key]
+            if key in self._base:
+                self._removed.add(key)
+        elif key not in self._removed and key in self._base:
+            self._removed.add(key)
+            self._shadowed.add(key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._added:
+            return True
+        if key in self._removed:
+            return False
+        return key in self._base
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from self._added
+        for key in self._base:
+            if key not in self._shadowed:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._shadowed) + len(self._added)
+
+
+def exists(persist_dir: str) -> bool:
+    return os.path.exists(os.path.join(persist_dir, VECTOR_IDS_FILE))
+
+
+def write_vector_store_data(
+    persist_dir: str,
+    vector_id_to_text_id: Mapping[int, str],
+    text_id_to_ref_doc_id: Mapping[str, str],
+    metadata_dict: Mapping[str, Any],
+    ref_doc_id_to_vector_ids: Mapping[str, list[int]],
+    next_vector_id: int,
+):
+    text_ids = sorted(
+        set(text_id_to_ref_doc_id.keys())
+        | set(metadata_dict.keys())
+        | set(vector_id_to_text_id.values())
+    )
+    row_by_text_id = {text_id: row for row, text_id in enumerate(text_ids)}
+
+    vector_ids = np.array(sorted(int(k) for k in vector_id_to_text_id), dtype=np.int64)
+    rows = np.array(
+        [row_by_text_id[vector_id_to_text_id[vector_id]] for vector_id in vector_ids],
+        dtype=np.int64,
+    )
+
+    StringColumn.write(
+        os.path.join(persist_dir, TEXT_IDS_FILE),
+        [text_id.encode("utf-8") for text_id in text_ids],
+    )
+    StringColumn.write(
+        os.path.join(persist_dir, REF_DOC_IDS_FILE),
+        [text_id_to_ref_doc_id.get(text_id, "").encode("utf-8") for text_id in text_ids],
+    )
+    StringColumn.write(
+        os.path.join(persist_dir, METADATA_FILE),
+        [
+            json.dumps(metadata_dict[text_id]).encode("utf-8")
+            if text_id in metadata_dict
+            else b""
+            for text_id in text_ids
+        ],
+    )
+
+    ref_doc_ids = sorted(
+        ref_doc_id
+        for ref_doc_id, vector_ids_ in ref_doc_id_to_vector_ids.items()
+        if vector_ids_
+    )
+    ref_doc_vector_ids = [ref_doc_id_to_vector_ids[ref_doc_id] for ref_doc_id in ref_doc_ids]
+    ref_doc_offsets = np.zeros(len(ref_doc_ids) + 1, dtype=np.int64)
+    if ref_doc_ids:
+        ref_doc_offsets[1:] = np.cumsum([len(ids) for ids in ref_doc_vector_ids])
+    StringColumn.write(
+        os.path.join(persist_dir, REF_DOC_KEYS_FILE),
+        [ref_doc_id.encode("utf-8") for ref_doc_id in ref_doc_ids],
+    )
+    _save_array(
+        os.path.join(persist_dir, f"{REF_DOC_VECTOR_IDS_FILE}.npy"),
+        np.fromiter(
+            (vector_id for ids in ref_doc_vector_ids for vector_id in ids),
+            dtype=np.int64,
+            count=int(ref_doc_offsets[-1]),
+        ),
+    )
+    _save_array(
+        os.path.join(persist_dir, f"{REF_DOC_VECTOR_IDS_FILE}.offsets.npy"),
+        ref_doc_offsets,
+    )
+
+    tmp_path = os.path.join(persist_dir, f"{STATE_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"next_vector_id": next_vector_id}, f)
+    os.replace(tmp_path, os.path.join(persist_dir, STATE_FILE))
+
+    _save_array(os.path.join(persist_dir, VECTOR_ROWS_FILE), rows)
+    # Written last as its existence marks the data as complete
+    _save_array(os.path.join(persist_dir, VECTOR_IDS_FILE), vector_ids)
+
+    logger.info(
+        f"Persisted {len(vector_ids)} vector ids and {len(text_ids)} text ids to {persist_dir}."
+    )
+
+
+def load_vector_store_data(
+    persist_dir: str,
+) -> tuple[OverlayDict, OverlayDict, OverlayDict, OverlayDict, int]:
+    """
+    Memory-map the persisted data and return the mappings vector_id_to_text_id, text_id_to_ref_doc_id,
+    metadata_dict and ref_doc_id_to_vector_ids, and the next vector id to allocate.
+    """
+    text_ids = StringColumn.load(os.path.join(persist_dir, TEXT_IDS_FILE))
+    ref_doc_ids = StringColumn.load(os.path.join(persist_dir, REF_DOC_IDS_FILE))
+    metadata = StringColumn.load(os.path.join(persist_dir, METADATA_FILE))
+
+    vector_id_to_text_id = MappedIdMap(
+        ids=_load_array(os.path.join(persist_dir, VECTOR_IDS_FILE)),
+        rows=_load_array(os.path.join(persist_dir, VECTOR_ROWS_FILE)),
+        text_ids=text_ids,
+    )
+
+    ref_doc_id_to_vector_ids = None
+    if os.path.exists(os.path.join(persist_dir, f"{REF_DOC_VECTOR_IDS_FILE}.npy")):
+        ref_doc_id_to_vector_ids = MappedListMap(
+            keys=StringColumn.load(os.path.join(persist_dir, REF_DOC_KEYS_FILE)),
+            values=_load_array(
+                os.path.join(persist_dir, f"{REF_DOC_VECTOR_IDS_FILE}.npy")
+            ),
+            offsets=_load_array(
+                os.path.join(persist_dir, f"{REF_DOC_VECTOR_IDS_FILE}.offsets.npy")
+            ),
+        )
+
+    state_path = os.path.join(persist_dir, STATE_FILE)
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            next_vector_id = json.load(f)["next_vector_id"]
+    else:
+        next_vector_id = (
+            int(vector_id_to_text_id._ids[-1]) + 1 if len(vector_id_to_text_id) else 0
+        )
+
+    return (
+        OverlayDict(vector_id_to_text_id),
+        OverlayDict(MappedStringMap(text_ids, ref_doc_ids)),
+        OverlayDict(MappedStringMap(text_ids, metadata, decode=json.loads)),
+        OverlayDict(ref_doc_id_to_vector_ids),
+        next_vector_id,
+    )
+
+
+def write_vector_attributes(
+    persist_dir: str,
+    file_paths: list[str],
+    vector_file_ids: np.ndarray,
+    vector_categories: np.ndarray,
+):
+    StringColumn.write(
+        os.path.join(persist_dir, FILE_PATHS_FILE),
+        [file_path.encode("utf-8") for file_path in file_paths],
+    )
+    _save_array(os.path.join(persist_dir, VECTOR_FILE_IDS_FILE), vector_file_ids)
+    _save_array(
+        os.path.join(persist_dir, VECTOR_CATEGORIES_FILE), vector_categories
+    )
+
+
+def load_vector_attributes(
+    persist_dir: str,
+) -> tuple[list[str], np.ndarray, np.ndarray | None] | None:
+    """
+    Load the file path table and the file id and category of each vector. The arrays are small and grow when
+    vectors are added, so they are read into memory instead of being memory-mapped. Categories are None for
+    indexes persisted before they were stored.
+    """
+    if not os.path.exists(os.path.join(persist_dir, VECTOR_FILE_IDS_FILE)):
+        return None
+
+    column = StringColumn.load(os.path.join(persist_dir, FILE_PATHS_FILE))
+    file_paths = [column[row] for row in range(len(column))]
+    vector_file_ids = np.array(
+        np.load(os.path.join(persist_dir, VECTOR_FILE_IDS_FILE)), dtype=np.int32
+    )
+
+    vector_categories = None
+    if os.path.exists(os.path.join(persist_dir, VECTOR_CATEGORIES_FILE)):
+        vector_categories = np.array(
+            np.load(os.path.join(persist_dir, VECTOR_CATEGORIES_FILE)), dtype=np.int8
+        )
+    return file_paths, vector_file_ids, vector_categories
@@ -0,0 +1,226 @@
+"""Columnar index from class and function names to the code blocks defining them."""
+
+import bisect
+import logging
+import os
+from collections.abc import Iterable, Sequence
+from typing import Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from moatless_qa.index.mmap_data import StringColumn, _load_array, _save_array
+
+logger = logging.getLogger(__name__)
+
+BLOCK_PATH_SEPARATOR = "."
+
+
+class NameIndex:
+    """
+    Maps names to the (file path, block path) of each block with that name. Names are stored as a sorted
+    column with a case-folded sort order, entries as CSR arrays over the names and file paths are interned
+    in one table. Persisted indexes are memory-mapped and only the rows that are looked up are decoded.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        folded_order: np.ndarray,
+        offsets: np.ndarray,
+        file_paths: Sequence[str],
+        entry_file_ids: np.ndarray,
+        block_paths: Sequence[str],
+    ):
+        self._names = names
+        self._folded_order = folded_order
+        self._offsets = offsets
+        self._file_paths = file_paths
+        self._entry_file_ids = entry_file_ids
+        self._block_paths = block_paths
+        self._file_id_by_path: Optional[dict[str, int]] = None
+        self._name_list: Optional[list[str]] = None
+
+    @classmethod
+    def from_dict(cls, blocks_by_name: dict[str, list]) -> "NameIndex":
+        """Build from a dict of names to lists of (file path, block path), the format of the old JSON files."""
+        names = sorted(name for name, paths in blocks_by_name.items() if paths)
+        file_ids: dict[str, int] = {}
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        entry_file_ids = []
+        block_paths = []
+
+        for row, name in enumerate(names):
+            for file_path, block_path in blocks_by_name[name]:
+                entry_file_ids.append(file_ids.setdefault(file_path, len(file_ids)))
+                block_paths.append(BLOCK_PATH_SEPARATOR.join(block_path))
+            offsets[row + 1] = len(block_paths)
+
+        folded_order = np.array(
+            sorted(range(len(names)), key=lambda row: names[row].casefold()),
+            dtype=np.int32,
+        )
+
+        return cls(
+            names=names,
+            folded_order=folded_order,
+            offsets=offsets,
+            file_paths=list(file_ids.keys()),
+            entry_file_ids=np.array(entry_file_ids, dtype=np.int32),
+            block_paths=block_paths,
+        )
+
+    def to_dict(self) -> dict[str, list[tuple[str, list[str]]]]:
+        return {self._names[row]: self._entries(row) for row in range(len(self._names))}
+
+    @staticmethod
+    def exists(persist_dir: str, prefix: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, f"{prefix}.offsets.npy"))
+
+    def persist(self, persist_dir: str, prefix: str):
+        path = os.path.join(persist_dir, prefix)
+        StringColumn.write(
+            f"{path}.names",
+            [self._names[row].encode("utf-8") for row in range(len(self._names))],
+        )
+        StringColumn.write(
+            f"{path}.file_paths",
+            [self._file_paths[i].encode("utf-8") for i in range(len(self._file_paths))],
+        )
+        StringColumn.write(
+            f"{path}.block_paths",
+            [
+                self._block_paths[i].encode("utf-8")
+                for i in range(len(self._block_paths))
+            ],
+        )
+        _save_array(f"{path}.folded_order.npy", np.asarray(self._folded_order))
+        _save_array(f"{path}.file_ids.npy", np.asarray(self._entry_file_ids))
+        # Written last as exists() checks for the offsets
+        _save_array(f"{path}.offsets.npy", np.asarray(self._offsets))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, prefix: str) -> "NameIndex":
+        path = os.path.join(persist_dir, prefix)
+        return cls(
+            names=StringColumn.load(f"{path}.names"),
+            folded_order=_load_array(f"{path}.folded_order.npy"),
+            offsets=_load_array(f"{path}.offsets.npy"),
+            file_paths=StringColumn.load(f"{path}.file_paths"),
+            entry_file_ids=_load_array(f"{path}.file_ids.npy"),
+            block_paths=StringColumn.load(f"{path}.block_paths"),
+        )
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return self._row(name) is not None
+
+    def _row(self, name: str) -> Optional[int]:
+        row = bisect.bisect_left(self._names, name)
+        if row < len(self._names) and self._names[row] == name:
+            return row
+        return None
+
+    def _folded_rows(self, folded_prefix: str) -> Iterable[int]:
+        """Yields the rows of the names starting with the case-folded prefix."""
+        i = bisect.bisect_left(
+            self._folded_order,
+            folded_prefix,
+            key=lambda row: self._names[int(row)].casefold(),
+        )
+        while i < len(self._folded_order):
+            row = int(self._folded_order[i])
+            if not self._names[row].casefold().startswith(folded_prefix):
+                break
+            yield row
+            i += 1
+
+    def _entries(
+        self, row: int, file_ids: Optional[np.ndarray] = None
+    ) -> list[tuple[str, list[str]]]:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        entry_ids = np.arange(start, end)
+        if file_ids is not None:
+            entry_ids = entry_ids[np.isin(self._entry_file_ids[start:end], file_ids)]
+
+        entries = []
+        for i in entry_ids:
+            block_path = self._block_paths[int(i)]
+            entries.append(
+                (
+                    self._file_paths[int(self._entry_file_ids[i])],
+                    block_path.split(BLOCK_PATH_SEPARATOR) if block_path else [],
+                )
+            )
+        return entries
+
+    def file_ids(self, file_paths: Iterable[str]) -> np.ndarray:
+        """Returns the ids of the given file paths that have entries in the index."""
+        if self._file_id_by_path is None:
+            self._file_id_by_path = {
+                self._file_paths[i]: i for i in range(len(self._file_paths))
+            }
+        return np.array(
+            [
+                self._file_id_by_path[file_path]
+                for file_path in file_paths
+                if file_path in self._file_id_by_path
+            ],
+            dtype=np.int32,
+        )
+
+    def get(
+        self, name: str, file_ids: Optional[np.ndarray] = None
+    ) -> list[tuple[str, list[str]]]:
+        """Returns the (file path, block path) of the blocks with the name, optionally only in the given files."""
+        row = self._row(name)
+        if row is None:
+            return []
+        return self._entries(row, file_ids)
+
+    def get_case_insensitive(
+        self, name: str, file_ids: Optional[np.ndarray] = None
+    ) -> list[tuple[str, list[str]]]:
+        folded_name = name.casefold()
+        entries = []
+        for row in self._folded_rows(folded_name):
+            if self._names[row].casefold() == folded_name:
+                entries.extend(self._entries(row, file_ids))
+        return entries
+
+    def names_with_prefix(
+        self, prefix: str, case_sensitive: bool = True, limit: Optional[int] = None
+    ) -> list[str]:
+        if case_sensitive:
+            row = bisect.bisect_left(self._names, prefix)
+            rows = range(row, len(self._names))
+        else:
+            rows = self._folded_rows(prefix.casefold())
+
+        names = []
+        for row in rows:
+            name = self._names[row]
+            if case_sensitive and not name.startswith(prefix):
+                break
+            names.append(name)
+            if limit and len(names) >= limit:
+                break
+        return names
+
+    def similar_names(
+        self, name: str, limit: int = 5, score_cutoff: float = 80.0
+    ) -> list[str]:
+        """Returns the names most similar to the name, best match first."""
+        if self._name_list is None:
+            self._name_list = [self._names[row] for row in range(len(self._names))]
+
+        matches = process.extract(
+            name,
+            self._name_list,
+            scorer=fuzz.ratio,
+            limit=limit,
+            score_cutoff=score_cutoff,
+        )
+        return [match for match, _, _ in matches]
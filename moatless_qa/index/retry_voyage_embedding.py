@@ -38,3 +38,14 @@ class VoyageEmbeddingWithRetry(VoyageEmbedding):
 
                 return embeddings_first + embeddings_second
             raise
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        """Embed queries in as few requests as possible."""
+        embeddings = []
+        for i in range(0, len(queries), self.embed_batch_size):
+            embeddings.extend(
+                self._get_embedding(
+                    queries[i : i + self.embed_batch_size], input_type="query"
+                )
+            )
+        return embeddings
@@ -16,9 +16,24 @@ class CommentStrategy(Enum):
     EXCLUDE = "exclude"
 
 
+class FaissIndexType(Enum):
+    # Exact brute-force search
+    FLAT = "flat"
+
+    # Inverted file index with product quantization, requires training
+    IVF_PQ = "ivf_pq"
+
+    # Graph based index, doesn't support removal of vectors
+    HNSW = "hnsw"
+
+    # 8 bit scalar quantization of the vectors, requires training
+    SQ8 = "sq8"
+
+
 class IndexSettings(BaseModel):
     embed_model: str = Field(
-        default="text-embedding-3-small", description="The embedding model to use."
+        default="text-embedding-3-small",
+        description="The embedding model to use. Prefix with 'local/' to run a sentence-transformers model locally.",
     )
     dimensions: int = Field(
         default=1536, description="The number of dimensions of the vectors."
@@ -36,9 +51,34 @@ class IndexSettings(BaseModel):
         description="Strategy on how comments will be indexed.",
     )
 
+    index_type: FaissIndexType = Field(
+        default=FaissIndexType.FLAT,
+        description="The type of FAISS index to store the vectors in.",
+    )
+    nlist: int = Field(
+        default=1024, description="The number of inverted lists in an IVF index."
+    )
+    pq_m: int = Field(
+        default=64,
+        description="The number of sub-quantizers in a PQ index, must divide dimensions.",
+    )
+    pq_nbits: int = Field(
+        default=8, description="The number of bits per sub-quantizer in a PQ index."
+    )
+    hnsw_m: int = Field(
+        default=32, description="The number of neighbors per node in a HNSW index."
+    )
+    nprobe: int = Field(
+        default=32, description="The number of inverted lists to visit on search."
+    )
+    ef_search: int = Field(
+        default=128, description="The size of the dynamic candidate list on HNSW search."
+    )
+
     def to_serializable_dict(self):
         data = self.dict()
         data["comment_strategy"] = data["comment_strategy"].value
+        data["index_type"] = data["index_type"].value
         return data
 
     def persist(self, persist_dir: str):
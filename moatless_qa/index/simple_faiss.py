@@ -3,7 +3,9 @@
 import json
 import logging
 import os
+from collections import OrderedDict
 from dataclasses import dataclass, field
+from collections.abc import Callable
 from typing import Any, cast
 
 import faiss
@@ -23,6 +25,10 @@ from llama_index.core.vector_stores.types import (
 )
 from llama_index.core.vector_stores.utils import node_to_metadata_dict
 
+from moatless_qa.index import mmap_data
+from moatless_qa.index.types import FilePathFilter
+from moatless_qa.utils.file import is_test
+
 logger = logging.getLogger(__name__)
 
 LEARNER_MODES = {
@@ -36,12 +42,55 @@ MMR_MODE = VectorStoreQueryMode.MMR
 NAMESPACE_SEP = "__"
 DEFAULT_VECTOR_STORE = "default"
 
+CATEGORY_IDS = {"implementation": 0, "test": 1}
+
+# Number of file masks to keep, one for each file pattern and category searched
+FILE_MASK_CACHE_SIZE = 64
+
+
+def _category_id(category: str | None, file_path: str | None) -> int:
+    if file_path is None:
+        return -1
+    if category not in CATEGORY_IDS:
+        category = "test" if is_test(file_path) else "implementation"
+    return CATEGORY_IDS[category]
+
 
 @dataclass
 class SimpleVectorStoreData(DataClassJsonMixin):
     text_id_to_ref_doc_id: dict[str, str] = field(default_factory=dict)
     vector_id_to_text_id: dict[int, str] = field(default_factory=dict)
     metadata_dict: dict[str, Any] = field(default_factory=dict)
+    ref_doc_id_to_vector_ids: dict[str, list[int]] = field(default_factory=dict)
+    next_vector_id: int = 0
+
+    def rebuild_ref_doc_index(self):
+        """Rebuild the reverse index and id counter for data persisted before they were stored."""
+        self.ref_doc_id_to_vector_ids = {}
+        for vector_id, text_id in self.vector_id_to_text_id.items():
+            ref_doc_id = self.text_id_to_ref_doc_id.get(text_id, text_id)
+            self.ref_doc_id_to_vector_ids.setdefault(ref_doc_id, []).append(
+                int(vector_id)
+            )
+            self.next_vector_id = max(self.next_vector_id, int(vector_id) + 1)
+
+
+@dataclass
+class VectorColumns:
+    """
+    File path and category of each vector, indexed by vector id. The columns are kept in one object that is
+    shared with copies of the vector store, like the one made when it's set on an IngestionPipeline, so that
+    vectors added through a copy are seen when the columns are grown.
+    """
+
+    # File path of each vector as an id in the file path table, -1 for removed vectors
+    file_paths: list[str]
+    file_id_by_path: dict[str, int]
+    file_ids: np.ndarray
+    # Category of each vector as an id in CATEGORY_IDS, -1 for removed vectors
+    categories: np.ndarray
+    # Allowed files by filter key and the size of the file path table when the mask was created
+    file_masks: OrderedDict = field(default_factory=OrderedDict)
 
 
 class SimpleFaissVectorStore(BasePydanticVectorStore):
@@ -63,6 +112,8 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
     _vector_ids_to_delete: list[int] = PrivateAttr(default_factory=list)
     _text_ids_to_delete: set[str] = PrivateAttr(default_factory=set)
 
+    _columns: VectorColumns = PrivateAttr()
+
     stores_text: bool = False
 
     def __init__(
@@ -71,6 +122,9 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         d: int = 1536,
         data: SimpleVectorStoreData | None = None,
         fs: fsspec.AbstractFileSystem | None = None,
+        file_paths: list[str] | None = None,
+        vector_file_ids: np.ndarray | None = None,
+        vector_categories: np.ndarray | None = None,
         **kwargs: Any,
     ) -> None:
         """Initialize params."""
@@ -89,11 +143,35 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         self._faiss_index = cast(faiss.Index, faiss_index)
         self._data = data or SimpleVectorStoreData()
         self._fs = fs or fsspec.filesystem("file")
+        file_paths = file_paths or []
+        if vector_file_ids is None:
+            vector_file_ids = np.full(0, -1, dtype=np.int32)
+        self._columns = VectorColumns(
+            file_paths=file_paths,
+            file_id_by_path={
+                file_path: file_id for file_id, file_path in enumerate(file_paths)
+            },
+            file_ids=vector_file_ids,
+            categories=(
+                vector_categories
+                if vector_categories is not None
+                else np.full(len(vector_file_ids), -1, dtype=np.int8)
+            ),
+        )
         super().__init__(**kwargs)
 
+        if (
+            vector_file_ids is None
+            and self._data.vector_id_to_text_id
+            and self._data.metadata_dict is not None
+        ):
+            self._rebuild_vector_file_ids()
+        elif vector_categories is None and len(vector_file_ids):
+            self._rebuild_vector_categories()
+
     @classmethod
     def from_defaults(cls, d: int = 1536):
-        faiss_index = faiss.IndexIDMap(faiss.IndexFlatL2(1536))
+        faiss_index = faiss.IndexIDMap(faiss.IndexFlatL2(d))
         return cls(faiss_index, d)
 
     @property
@@ -101,6 +179,178 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         """Return the faiss index."""
         return self._faiss_index
 
+    def _base_index(self) -> Any:
+        # Vectors are stored in an IndexIDMap wrapping the index that does the actual search
+        if isinstance(self._faiss_index, faiss.IndexIDMap):
+            return faiss.downcast_index(self._faiss_index.index)
+        return self._faiss_index
+
+    def set_search_params(
+        self, nprobe: int | None = None, ef_search: int | None = None
+    ) -> None:
+        """Set search time parameters on approximate indexes. Ignored for index types they don't apply to."""
+        base_index = self._base_index()
+
+        if nprobe:
+            try:
+                faiss.extract_index_ivf(base_index).nprobe = nprobe
+            except RuntimeError:
+                pass
+
+        if ef_search and hasattr(base_index, "hnsw"):
+            base_index.hnsw.efSearch = ef_search
+
+    def _file_id(self, file_path: str | None) -> int:
+        if file_path is None:
+            return -1
+
+        file_id = self._columns.file_id_by_path.get(file_path)
+        if file_id is None:
+            file_id = len(self._columns.file_paths)
+            self._columns.file_paths.append(file_path)
+            self._columns.file_id_by_path[file_path] = file_id
+        return file_id
+
+    def _set_vector_attributes(
+        self, start_id: int, file_ids: np.ndarray, categories: np.ndarray
+    ) -> None:
+        columns = self._columns
+        end_id = start_id + len(file_ids)
+        if end_id > len(columns.file_ids):
+            # Grow by doubling to keep repeated small adds linear
+            capacity = max(end_id, 2 * len(columns.file_ids))
+            grown_file_ids = np.full(capacity, -1, dtype=np.int32)
+            grown_file_ids[: len(columns.file_ids)] = columns.file_ids
+            columns.file_ids = grown_file_ids
+
+            grown_categories = np.full(capacity, -1, dtype=np.int8)
+            grown_categories[: len(columns.categories)] = columns.categories
+            columns.categories = grown_categories
+
+        columns.file_ids[start_id:end_id] = file_ids
+        columns.categories[start_id:end_id] = categories
+
+    def _rebuild_vector_file_ids(self) -> None:
+        """Derive file ids and categories from the metadata for indexes persisted before they were stored."""
+        logger.info("Rebuilding file ids for vector store.")
+        columns = self._columns
+        columns.file_ids = np.full(self._data.next_vector_id, -1, dtype=np.int32)
+        columns.categories = np.full(self._data.next_vector_id, -1, dtype=np.int8)
+        for vector_id, text_id in self._data.vector_id_to_text_id.items():
+            metadata = self._data.metadata_dict.get(text_id) or {}
+            file_path = metadata.get("file_path")
+            columns.file_ids[int(vector_id)] = self._file_id(file_path)
+            columns.categories[int(vector_id)] = _category_id(
+                metadata.get("category"), file_path
+            )
+
+    def _rebuild_vector_categories(self) -> None:
+        """Derive the categories from the file paths for indexes persisted before they were stored."""
+        logger.info("Rebuilding categories for vector store.")
+        columns = self._columns
+        file_categories = np.array(
+            [_category_id(None, file_path) for file_path in columns.file_paths],
+            dtype=np.int8,
+        )
+        columns.categories = np.full(len(columns.file_ids), -1, dtype=np.int8)
+        assigned = columns.file_ids >= 0
+        columns.categories[assigned] = file_categories[columns.file_ids[assigned]]
+
+    def _file_ids(self, file_paths: frozenset[str]) -> np.ndarray:
+        file_id_by_path = self._columns.file_id_by_path
+        return np.fromiter(
+            (
+                file_id_by_path[file_path]
+                for file_path in file_paths
+                if file_path in file_id_by_path
+            ),
+            dtype=np.int64,
+        )
+
+    def _allowed_files(self, file_path_filter: FilePathFilter) -> np.ndarray:
+        """Returns a mask over the file path table of the files in the filter's file sets."""
+        columns = self._columns
+
+        # New files are appended to the table, so a mask is valid as long as the table hasn't grown
+        key = (file_path_filter.key, len(columns.file_paths))
+        allowed_files = columns.file_masks.get(key)
+        if allowed_files is not None:
+            columns.file_masks.move_to_end(key)
+            return allowed_files
+
+        if file_path_filter.include_files:
+            allowed_files = np.zeros(len(columns.file_paths), dtype=bool)
+            allowed_files[self._file_ids(file_path_filter.include_files)] = True
+        else:
+            allowed_files = np.ones(len(columns.file_paths), dtype=bool)
+
+        if file_path_filter.exclude_files:
+            allowed_files[self._file_ids(file_path_filter.exclude_files)] = False
+
+        columns.file_masks[key] = allowed_files
+        while len(columns.file_masks) > FILE_MASK_CACHE_SIZE:
+            columns.file_masks.popitem(last=False)
+
+        return allowed_files
+
+    def _filter_vector_ids(
+        self, file_path_filter: FilePathFilter | Callable[[str], bool]
+    ) -> np.ndarray:
+        """Returns the ids of the vectors in files accepted by the filter."""
+        columns = self._columns
+        file_ids = columns.file_ids[: self._data.next_vector_id]
+        allowed = file_ids >= 0
+
+        if isinstance(file_path_filter, FilePathFilter):
+            if file_path_filter.include_files or file_path_filter.exclude_files:
+                allowed_files = self._allowed_files(file_path_filter)
+                allowed[allowed] = allowed_files[file_ids[allowed]]
+
+            category_id = CATEGORY_IDS.get(file_path_filter.category)
+            if category_id is not None:
+                categories = columns.categories[: self._data.next_vector_id]
+                allowed &= categories == category_id
+        else:
+            # Plain filter functions are called once for each file
+            allowed_files = np.fromiter(
+                (bool(file_path_filter(file_path)) for file_path in columns.file_paths),
+                dtype=bool,
+                count=len(columns.file_paths),
+            )
+            allowed[allowed] = allowed_files[file_ids[allowed]]
+
+        return np.flatnonzero(allowed).astype(np.int64)
+
+    def _search_params(self, selector: Any) -> Any:
+        # Search parameters must match the type of the index, and then override the parameters set on the index
+        base_index = self._base_index()
+        try:
+            index_ivf = faiss.extract_index_ivf(base_index)
+            return faiss.SearchParametersIVF(sel=selector, nprobe=index_ivf.nprobe)
+        except RuntimeError:
+            pass
+
+        if hasattr(base_index, "hnsw"):
+            return faiss.SearchParametersHNSW(
+                sel=selector, efSearch=base_index.hnsw.efSearch
+            )
+
+        return faiss.SearchParameters(sel=selector)
+
+    def _train(self, vectors: np.ndarray) -> None:
+        try:
+            nlist = faiss.extract_index_ivf(self._base_index()).nlist
+        except RuntimeError:
+            nlist = 0
+
+        if len(vectors) < nlist:
+            raise ValueError(
+                f"Can't train index with {nlist} inverted lists on {len(vectors)} vectors. Use a smaller nlist or a flat index."
+            )
+
+        logger.info(f"Training index on {len(vectors)} vectors.")
+        self._faiss_index.train(vectors)
+
     def add(
         self,
         nodes: list[BaseNode],
@@ -111,22 +361,43 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         if not nodes:
             return []
 
-        vector_id = (
-            max([int(k) for k in self._data.vector_id_to_text_id])
-            if self._data.vector_id_to_text_id
-            else 0
+        start_id = self._data.next_vector_id
+        logger.info(f"Adding {len(nodes)} nodes to index, start at id {start_id}.")
+
+        vectors_ndarray = np.asarray(
+            [node.get_embedding() for node in nodes], dtype=np.float32
+        )
+        ids_ndarray = np.arange(start_id, start_id + len(nodes), dtype=np.int64)
+        self._set_vector_attributes(
+            start_id,
+            np.array(
+                [self._file_id(node.metadata.get("file_path")) for node in nodes],
+                dtype=np.int32,
+            ),
+            np.array(
+                [
+                    _category_id(
+                        node.metadata.get("category"), node.metadata.get("file_path")
+                    )
+                    for node in nodes
+                ],
+                dtype=np.int8,
+            ),
         )
 
-        logger.info(f"Adding {len(nodes)} nodes to index, start at id {vector_id}.")
+        for vector_id, node in enumerate(nodes, start=start_id):
+            # Re-embedded nodes keep their id, so the new vector's entries must be kept when the old one is deleted
+            self._text_ids_to_delete.discard(node.id_)
 
-        embeddings = []
-        ids = []
-        for node in nodes:
-            embeddings.append(node.get_embedding())
-            ids.append(int(vector_id))
+            ref_doc_id = node.ref_doc_id or node.id_
             self._data.vector_id_to_text_id[vector_id] = node.id_
-            self._data.text_id_to_ref_doc_id[node.id_] = node.ref_doc_id or node.id_
-            vector_id += 1
+            self._data.text_id_to_ref_doc_id[node.id_] = ref_doc_id
+
+            # Assign a new list as the existing one may be read from the memory-mapped base
+            self._data.ref_doc_id_to_vector_ids[ref_doc_id] = [
+                *self._data.ref_doc_id_to_vector_ids.get(ref_doc_id, []),
+                vector_id,
+            ]
 
             metadata = node_to_metadata_dict(
                 node, remove_text=True, flat_metadata=False
@@ -134,10 +405,12 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
             metadata.pop("_node_content", None)
             self._data.metadata_dict[node.node_id] = metadata
 
-        vectors_ndarray = np.array(embeddings)
-        ids_ndarray = np.array(ids)
+        # Approximate indexes are trained on the vectors from the first ingestion
+        if not self._faiss_index.is_trained:
+            self._train(vectors_ndarray)
 
         self._faiss_index.add_with_ids(vectors_ndarray, ids_ndarray)
+        self._data.next_vector_id = start_id + len(nodes)
 
         return [node.node_id for node in nodes]
 
@@ -150,14 +423,11 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
 
         """
 
-        self._text_ids_to_delete = set()
-        for text_id, ref_doc_id_ in self._data.text_id_to_ref_doc_id.items():
-            if ref_doc_id == ref_doc_id_:
+        for vector_id in self._data.ref_doc_id_to_vector_ids.get(ref_doc_id, []):
+            text_id = self._data.vector_id_to_text_id.get(vector_id)
+            if text_id:
                 self._text_ids_to_delete.add(text_id)
-
-        for vector_id, text_id in self._data.vector_id_to_text_id.items():
-            if text_id in self._text_ids_to_delete:
-                self._vector_ids_to_delete.append(vector_id)
+            self._vector_ids_to_delete.append(vector_id)
 
     def query(
         self,
@@ -169,32 +439,90 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         Args:
             query_embedding (List[float]): query embedding
             similarity_top_k (int): top k most similar nodes
+            file_path_filter (FilePathFilter | Callable[[str], bool]): only search vectors in files accepted by the filter
 
         """
         query_filter_fn = _build_metadata_filter_fn(
             lambda node_id: self._data.metadata_dict[node_id], query.filters
         )
 
+        if "nprobe" in kwargs or "ef_search" in kwargs:
+            self.set_search_params(
+                nprobe=kwargs.get("nprobe"), ef_search=kwargs.get("ef_search")
+            )
+
         query_embedding = cast(list[float], query.query_embedding)
         query_embedding_np = np.array(query_embedding, dtype="float32")[np.newaxis, :]
-        print("query_embedding 维度:", np.array(query_embedding).shape)  # 一维原始向量
-        print("FAISS index 维度:", self._faiss_index.d)
-        dists, indices = self._faiss_index.search(
-            query_embedding_np, query.similarity_top_k
+
+        return self._search(
+            query_embedding_np,
+            query.similarity_top_k,
+            query_filter_fn,
+            file_path_filter=kwargs.get("file_path_filter"),
+        )[0]
+
+    def query_batch(
+        self,
+        query_embeddings: list[list[float]],
+        similarity_top_k: int,
+        file_path_filter: FilePathFilter | Callable[[str], bool] | None = None,
+    ) -> list[VectorStoreQueryResult]:
+        """Query the index with several embeddings in one search over the stacked matrix."""
+        if not query_embeddings:
+            return []
+
+        query_filter_fn = _build_metadata_filter_fn(
+            lambda node_id: self._data.metadata_dict[node_id], None
+        )
+        return self._search(
+            np.asarray(query_embeddings, dtype=np.float32),
+            similarity_top_k,
+            query_filter_fn,
+            file_path_filter=file_path_filter,
         )
-        dists = list(dists[0])
 
-        if len(indices) == 0:
-            return VectorStoreQueryResult(similarities=[], ids=[])
+    def _search(
+        self,
+        query_matrix: np.ndarray,
+        similarity_top_k: int,
+        query_filter_fn: Callable[[str], bool],
+        file_path_filter: FilePathFilter | Callable[[str], bool] | None = None,
+    ) -> list[VectorStoreQueryResult]:
+        search_kwargs = {}
+        if file_path_filter:
+            # Only the vectors in matching files are searched, so the top k results are all valid hits
+            allowed_ids = self._filter_vector_ids(file_path_filter)
+            if len(allowed_ids) == 0:
+                return [
+                    VectorStoreQueryResult(similarities=[], ids=[])
+                    for _ in range(len(query_matrix))
+                ]
+
+            selector = faiss.IDSelectorBatch(len(allowed_ids), faiss.swig_ptr(allowed_ids))
+            search_kwargs["params"] = self._search_params(selector)
 
-        node_idxs = indices[0]
+        dists, indices = self._faiss_index.search(
+            query_matrix, similarity_top_k, **search_kwargs
+        )
 
+        return [
+            self._create_query_result(row_dists, row_indices, query_filter_fn)
+            for row_dists, row_indices in zip(dists, indices, strict=True)
+        ]
+
+    def _create_query_result(
+        self,
+        dists: np.ndarray,
+        node_idxs: np.ndarray,
+        query_filter_fn: Callable[[str], bool],
+    ) -> VectorStoreQueryResult:
         duplicates = 0
         not_found = 0
         filtered_out = 0
 
         filtered_dists = []
         filtered_node_ids = []
+        seen_node_ids = set()
         for dist, idx in zip(dists, node_idxs, strict=False):
             if idx < 0:
                 break
@@ -202,10 +530,11 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
             node_id = self._data.vector_id_to_text_id.get(idx)
             if not query_filter_fn(node_id):
                 filtered_out += 1
-            elif node_id and node_id not in filtered_node_ids:
+            elif node_id and node_id not in seen_node_ids:
+                seen_node_ids.add(node_id)
                 filtered_node_ids.append(node_id)
                 filtered_dists.append(dist.item())
-            elif node_id in filtered_node_ids:
+            elif node_id in seen_node_ids:
                 duplicates += 1
             else:
                 not_found += 1
@@ -240,8 +569,14 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
 
         if self._vector_ids_to_delete:
             ids_to_remove_array = np.array(self._vector_ids_to_delete, dtype=np.int64)
-            removed = self._faiss_index.remove_ids(ids_to_remove_array)
-            logger.info(f"Removed {removed} vectors from index.")
+            try:
+                removed = self._faiss_index.remove_ids(ids_to_remove_array)
+                logger.info(f"Removed {removed} vectors from index.")
+            except RuntimeError as e:
+                # HNSW doesn't support removal, the vectors are kept but aren't mapped to any node
+                logger.warning(
+                    f"Index doesn't support removing vectors, {len(self._vector_ids_to_delete)} vectors will be ignored on search. Error: {e}"
+                )
 
         if self._text_ids_to_delete:
             for text_id in self._text_ids_to_delete:
@@ -253,12 +588,45 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         for vector_id in self._vector_ids_to_delete:
             text_id = self._data.vector_id_to_text_id.pop(vector_id, None)
             if text_id:
-                self._data.text_id_to_ref_doc_id.pop(text_id, None)
+                if text_id in self._text_ids_to_delete:
+                    ref_doc_id = self._data.text_id_to_ref_doc_id.pop(text_id, None)
+                else:
+                    ref_doc_id = self._data.text_id_to_ref_doc_id.get(text_id)
+                vector_ids = self._data.ref_doc_id_to_vector_ids.get(ref_doc_id)
+                if vector_ids is not None:
+                    remaining = [id_ for id_ in vector_ids if id_ != vector_id]
+                    if remaining:
+                        self._data.ref_doc_id_to_vector_ids[ref_doc_id] = remaining
+                    else:
+                        del self._data.ref_doc_id_to_vector_ids[ref_doc_id]
+
+        if self._vector_ids_to_delete:
+            deleted_ids = np.array(self._vector_ids_to_delete, dtype=np.int64)
+            deleted_ids = deleted_ids[deleted_ids < len(self._columns.file_ids)]
+            self._columns.file_ids[deleted_ids] = -1
+            self._columns.categories[deleted_ids] = -1
 
         self._vector_ids_to_delete = []
+        self._text_ids_to_delete = set()
+
+        mmap_data.write_vector_store_data(
+            persist_dir,
+            vector_id_to_text_id=self._data.vector_id_to_text_id,
+            text_id_to_ref_doc_id=self._data.text_id_to_ref_doc_id,
+            metadata_dict=self._data.metadata_dict or {},
+            ref_doc_id_to_vector_ids=self._data.ref_doc_id_to_vector_ids,
+            next_vector_id=self._data.next_vector_id,
+        )
+        mmap_data.write_vector_attributes(
+            persist_dir,
+            file_paths=self._columns.file_paths,
+            vector_file_ids=self._columns.file_ids[: self._data.next_vector_id],
+            vector_categories=self._columns.categories[: self._data.next_vector_id],
+        )
 
-        with fs.open(f"{persist_dir}/vector_index.json", "w") as f:
-            json.dump(self._data.to_dict(), f)
+        # Remove data in the old JSON format to not leave a stale copy behind
+        if fs.exists(f"{persist_dir}/vector_index.json"):
+            fs.rm(f"{persist_dir}/vector_index.json")
 
     @classmethod
     def from_persist_dir(
@@ -278,13 +646,44 @@ class SimpleFaissVectorStore(BasePydanticVectorStore):
         faiss_index = faiss.read_index(f"{persist_dir}/vector_index.faiss")
 
         logger.debug(f"Loading {__name__} from {persist_dir}.")
-        with fs.open(f"{persist_dir}/vector_index.json", "rb") as f:
-            data_dict = json.load(f)
-            data = SimpleVectorStoreData.from_dict(data_dict)
+        if mmap_data.exists(persist_dir):
+            (
+                vector_id_to_text_id,
+                text_id_to_ref_doc_id,
+                metadata_dict,
+                ref_doc_id_to_vector_ids,
+                next_vector_id,
+            ) = mmap_data.load_vector_store_data(persist_dir)
+            data = SimpleVectorStoreData(
+                text_id_to_ref_doc_id=text_id_to_ref_doc_id,
+                vector_id_to_text_id=vector_id_to_text_id,
+                metadata_dict=metadata_dict,
+                ref_doc_id_to_vector_ids=ref_doc_id_to_vector_ids,
+                next_vector_id=next_vector_id,
+            )
+        else:
+            # Indexes persisted before the binary format was introduced
+            with fs.open(f"{persist_dir}/vector_index.json", "rb") as f:
+                data_dict = json.load(f)
+                data = SimpleVectorStoreData.from_dict(data_dict)
+
+        if data.vector_id_to_text_id and not data.ref_doc_id_to_vector_ids:
+            logger.info("Rebuilding ref doc id index for vector store.")
+            data.rebuild_ref_doc_index()
+
+        file_paths, vector_file_ids, vector_categories = (
+            mmap_data.load_vector_attributes(persist_dir) or (None, None, None)
+        )
 
         logger.info(f"Loading {__name__} from {persist_dir}.")
 
-        return cls(faiss_index=faiss_index, data=data)
+        return cls(
+            faiss_index=faiss_index,
+            data=data,
+            file_paths=file_paths,
+            vector_file_ids=vector_file_ids,
+            vector_categories=vector_categories,
+        )
 
     @classmethod
     def from_index(cls, faiss_index: Any):
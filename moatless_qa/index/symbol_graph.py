@@ -0,0 +1,427 @@
+"""Repository-wide graph of the relationships between code spans, resolved across files through imports."""
+
+import bisect
+import json
+import logging
+import os
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Optional
+
+import numpy as np
+
+from moatless_qa.codeblocks.codeblocks import CodeBlock, CodeBlockType, RelationshipType
+from moatless_qa.index.mmap_data import StringColumn, _load_array, _save_array
+from moatless_qa.schema import FileWithSpans
+
+logger = logging.getLogger(__name__)
+
+SYMBOL_GRAPH_PREFIX = "symbol_graph"
+SYMBOL_TABLES_FILE = "symbol_tables.json"
+
+# Max number of re-exports to follow, e.g. a class imported from a package that imports it from a submodule
+MAX_IMPORT_DEPTH = 3
+
+_DEFINITION_TYPES = {CodeBlockType.CLASS, CodeBlockType.FUNCTION}
+
+
+@dataclass
+class FileSymbols:
+    """Definitions, imports and references of one file, collected while the file is parsed."""
+
+    # Span id to the number of tokens in the span
+    spans: dict[str, int] = field(default_factory=dict)
+    # Block path of classes and functions to the span id of the block
+    definitions: dict[str, str] = field(default_factory=dict)
+    # Imported name to the module and the path in the module
+    imports: dict[str, tuple[str, list[str]]] = field(default_factory=dict)
+    # Span id and path of the referenced block
+    references: list[tuple[str, list[str]]] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "spans": self.spans,
+            "definitions": self.definitions,
+            "imports": self.imports,
+            "references": self.references,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FileSymbols":
+        return cls(
+            spans=data["spans"],
+            definitions=data["definitions"],
+            imports={
+                name: (module, member)
+                for name, (module, member) in data["imports"].items()
+            },
+            references=[(span_id, path) for span_id, path in data["references"]],
+        )
+
+
+def _module_name(file_path: str) -> str:
+    parts = os.path.splitext(file_path)[0].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def _absolute_module(file_path: str, module: str) -> str:
+    """Resolves relative imports like `from .models import User` to the module name from the repository root."""
+    level = len(module) - len(module.lstrip("."))
+    if not level:
+        return module
+
+    package = _module_name(file_path).split(".")
+    if os.path.basename(file_path) != "__init__.py":
+        package = package[:-1]
+
+    package = package[: max(0, len(package) - level + 1)]
+    if module[level:]:
+        package.append(module[level:])
+    return ".".join(package)
+
+
+class SymbolGraphBuilder:
+    """
+    Collects the symbols of each file from the blocks passed to the index callback, and resolves the references
+    to spans in the same file or, through the imports, in other files in the repository.
+    """
+
+    def __init__(self, files: Optional[dict[str, FileSymbols]] = None):
+        self._files: dict[str, FileSymbols] = dict(files or {})
+        self._module_files: dict[str, str] = {}
+        self._module_suffixes: dict[str, Optional[str]] = {}
+
+    def add_block(self, block):
+        """Add a CodeBlock, or an IndexedBlock when the files are parsed in worker processes."""
+        if not block.relationships and block.type not in _DEFINITION_TYPES:
+            return
+
+        if isinstance(block, CodeBlock):
+            file_path = block.module.file_path
+            span = block.belongs_to_span
+            span_id, span_tokens = (span.span_id, span.tokens) if span else (None, 0)
+        else:
+            file_path = block.file_path
+            span_id, span_tokens = block.span_id, block.span_tokens
+
+        if not file_path or not span_id:
+            return
+
+        symbols = self._files.setdefault(file_path, FileSymbols())
+        # Spans grow while the file is parsed, the count from the last block in the span is the final one
+        symbols.spans[span_id] = max(symbols.spans.get(span_id, 0), span_tokens)
+
+        if block.type in _DEFINITION_TYPES:
+            symbols.definitions.setdefault(".".join(block.full_path()), span_id)
+
+        for relationship in block.relationships:
+            if relationship.type == RelationshipType.IMPORTS and relationship.external_path:
+                name = relationship.identifier or relationship.external_path[0]
+                symbols.imports[name] = (
+                    _absolute_module(file_path, relationship.external_path[0]),
+                    list(relationship.path),
+                )
+            elif relationship.path:
+                symbols.references.append((span_id, list(relationship.path)))
+
+    def remove_files(self, file_paths: Iterable[str]):
+        for file_path in file_paths:
+            self._files.pop(file_path, None)
+
+    def _index_modules(self):
+        self._module_files = {}
+        self._module_suffixes = {}
+        for file_path in self._files:
+            module_name = _module_name(file_path)
+            self._module_files[module_name] = file_path
+
+            # Files are also found by the module name without leading directories, like src/, if it's unique
+            parts = module_name.split(".")
+            for i in range(1, len(parts)):
+                suffix = ".".join(parts[i:])
+                if suffix in self._module_suffixes:
+                    self._module_suffixes[suffix] = None
+                else:
+                    self._module_suffixes[suffix] = file_path
+
+    def _module_file(self, module_name: str) -> Optional[str]:
+        return self._module_files.get(module_name) or self._module_suffixes.get(
+            module_name
+        )
+
+    def _find_module(
+        self, module_name: str, path: list[str]
+    ) -> tuple[Optional[str], list[str]]:
+        file_path = self._module_file(module_name)
+
+        # Follow submodules, like func in `from package import submodule; submodule.func()`
+        while path and self._module_file(f"{module_name}.{path[0]}"):
+            module_name = f"{module_name}.{path[0]}"
+            file_path = self._module_file(module_name)
+            path = path[1:]
+
+        return file_path, path
+
+    def _resolve(
+        self, file_path: str, path: list[str], depth: int = 0
+    ) -> Optional[tuple[str, str]]:
+        """Returns the file path and span id of the block that the path refers to from the file."""
+        symbols = self._files.get(file_path)
+        if not symbols or not path:
+            return None
+
+        for i in range(len(path), 0, -1):
+            span_id = symbols.definitions.get(".".join(path[:i]))
+            if span_id:
+                return file_path, span_id
+
+        if depth >= MAX_IMPORT_DEPTH:
+            return None
+
+        for i in range(len(path), 0, -1):
+            imported = symbols.imports.get(".".join(path[:i]))
+            if imported:
+                module_name, member_path = imported
+                target_file, target_path = self._find_module(
+                    module_name, member_path + path[i:]
+                )
+                if target_file:
+                    return self._resolve(target_file, target_path, depth + 1)
+                return None
+
+        return None
+
+    def build(self) -> "SymbolGraph":
+        self._index_modules()
+
+        file_paths = sorted(self._files.keys())
+        file_offsets = np.zeros(len(file_paths) + 1, dtype=np.int64)
+        span_ids = []
+        tokens = []
+        node_ids: dict[tuple[str, str], int] = {}
+        for i, file_path in enumerate(file_paths):
+            spans = self._files[file_path].spans
+            for span_id in sorted(spans.keys()):
+                node_ids[(file_path, span_id)] = len(span_ids)
+                span_ids.append(span_id)
+                tokens.append(spans[span_id])
+            file_offsets[i + 1] = len(span_ids)
+
+        edges = set()
+        unresolved = 0
+        for file_path in file_paths:
+            for span_id, path in self._files[file_path].references:
+                target = self._resolve(file_path, path)
+                if not target:
+                    unresolved += 1
+                    continue
+
+                source_id = node_ids[(file_path, span_id)]
+                target_id = node_ids[target]
+                if source_id != target_id:
+                    edges.add((source_id, target_id))
+
+        logger.info(
+            f"Built symbol graph with {len(span_ids)} spans in {len(file_paths)} files and {len(edges)} relationships "
+            f"({unresolved} references to code outside of the repository or that couldn't be resolved)."
+        )
+
+        sources = np.array([source for source, _ in edges], dtype=np.int32)
+        targets = np.array([target for _, target in edges], dtype=np.int32)
+        out_offsets, out_targets = _csr(sources, targets, len(span_ids))
+        in_offsets, in_sources = _csr(targets, sources, len(span_ids))
+
+        return SymbolGraph(
+            file_paths=file_paths,
+            file_offsets=file_offsets,
+            span_ids=span_ids,
+            tokens=np.array(tokens, dtype=np.int32),
+            out_offsets=out_offsets,
+            out_targets=out_targets,
+            in_offsets=in_offsets,
+            in_sources=in_sources,
+            file_symbols=self._files,
+        )
+
+
+def _csr(
+    keys: np.ndarray, values: np.ndarray, size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(keys, kind="stable")
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(keys, minlength=size))
+    return offsets, values[order]
+
+
+class SymbolGraph:
+    """
+    Graph of the relationships between the spans in the repository. Spans are nodes grouped by file, sorted by
+    file path and span id, and relationships are stored as CSR arrays in both directions. Persisted graphs are
+    memory-mapped. The collected symbols are persisted too, to patch the graph when the index is updated.
+    """
+
+    def __init__(
+        self,
+        file_paths: Sequence[str],
+        file_offsets: np.ndarray,
+        span_ids: Sequence[str],
+        tokens: np.ndarray,
+        out_offsets: np.ndarray,
+        out_targets: np.ndarray,
+        in_offsets: np.ndarray,
+        in_sources: np.ndarray,
+        file_symbols: Optional[dict[str, FileSymbols]] = None,
+        symbol_tables_path: Optional[str] = None,
+    ):
+        self._file_paths = file_paths
+        self._file_offsets = file_offsets
+        self._span_ids = span_ids
+        self._tokens = tokens
+        self._out_offsets = out_offsets
+        self._out_targets = out_targets
+        self._in_offsets = in_offsets
+        self._in_sources = in_sources
+        self._file_symbols = file_symbols
+        self._symbol_tables_path = symbol_tables_path
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(
+            os.path.join(persist_dir, f"{SYMBOL_GRAPH_PREFIX}.file_offsets.npy")
+        )
+
+    def persist(self, persist_dir: str):
+        with open(os.path.join(persist_dir, SYMBOL_TABLES_FILE), "w") as f:
+            json.dump(
+                {
+                    file_path: symbols.to_dict()
+                    for file_path, symbols in self.file_symbols().items()
+                },
+                f,
+            )
+
+        path = os.path.join(persist_dir, SYMBOL_GRAPH_PREFIX)
+        StringColumn.write(
+            f"{path}.file_paths",
+            [self._file_paths[i].encode("utf-8") for i in range(len(self._file_paths))],
+        )
+        StringColumn.write(
+            f"{path}.span_ids",
+            [self._span_ids[i].encode("utf-8") for i in range(len(self._span_ids))],
+        )
+        _save_array(f"{path}.tokens.npy", np.asarray(self._tokens))
+        _save_array(f"{path}.out_offsets.npy", np.asarray(self._out_offsets))
+        _save_array(f"{path}.out_targets.npy", np.asarray(self._out_targets))
+        _save_array(f"{path}.in_offsets.npy", np.asarray(self._in_offsets))
+        _save_array(f"{path}.in_sources.npy", np.asarray(self._in_sources))
+        # Written last as exists() checks for the file offsets
+        _save_array(f"{path}.file_offsets.npy", np.asarray(self._file_offsets))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> Optional["SymbolGraph"]:
+        if not cls.exists(persist_dir):
+            return None
+
+        path = os.path.join(persist_dir, SYMBOL_GRAPH_PREFIX)
+        return cls(
+            file_paths=StringColumn.load(f"{path}.file_paths"),
+            file_offsets=_load_array(f"{path}.file_offsets.npy"),
+            span_ids=StringColumn.load(f"{path}.span_ids"),
+            tokens=_load_array(f"{path}.tokens.npy"),
+            out_offsets=_load_array(f"{path}.out_offsets.npy"),
+            out_targets=_load_array(f"{path}.out_targets.npy"),
+            in_offsets=_load_array(f"{path}.in_offsets.npy"),
+            in_sources=_load_array(f"{path}.in_sources.npy"),
+            symbol_tables_path=os.path.join(persist_dir, SYMBOL_TABLES_FILE),
+        )
+
+    def file_symbols(self) -> dict[str, FileSymbols]:
+        """Returns the symbols the graph was built from, they're only loaded from disk when the graph is updated."""
+        if self._file_symbols is None:
+            self._file_symbols = {}
+            if self._symbol_tables_path and os.path.exists(self._symbol_tables_path):
+                with open(self._symbol_tables_path) as f:
+                    self._file_symbols = {
+                        file_path: FileSymbols.from_dict(data)
+                        for file_path, data in json.load(f).items()
+                    }
+        return self._file_symbols
+
+    def __len__(self) -> int:
+        return len(self._span_ids)
+
+    def _node_id(self, file_path: str, span_id: str) -> Optional[int]:
+        file_row = bisect.bisect_left(self._file_paths, file_path)
+        if file_row >= len(self._file_paths) or self._file_paths[file_row] != file_path:
+            return None
+
+        start = int(self._file_offsets[file_row])
+        end = int(self._file_offsets[file_row + 1])
+        node_id = bisect.bisect_left(self._span_ids, span_id, start, end)
+        if node_id < end and self._span_ids[node_id] == span_id:
+            return node_id
+        return None
+
+    def _file_path(self, node_id: int) -> str:
+        file_row = int(np.searchsorted(self._file_offsets, node_id, side="right")) - 1
+        return self._file_paths[file_row]
+
+    def _neighbours(self, node_id: int) -> Iterable[int]:
+        out_targets = self._out_targets[
+            self._out_offsets[node_id] : self._out_offsets[node_id + 1]
+        ]
+        in_sources = self._in_sources[
+            self._in_offsets[node_id] : self._in_offsets[node_id + 1]
+        ]
+        return chain(out_targets.tolist(), in_sources.tolist())
+
+    def related_spans(
+        self,
+        files: list[FileWithSpans],
+        max_hops: int = 1,
+        max_tokens: int = 1000,
+    ) -> list[FileWithSpans]:
+        """
+        Returns the spans related to the given spans within max_hops relationships, in both directions and across
+        files, nearest first. Spans that don't fit in max_tokens are skipped.
+        """
+        visited = set()
+        for file in files:
+            for span_id in file.span_ids:
+                node_id = self._node_id(file.file_path, span_id)
+                if node_id is not None:
+                    visited.add(node_id)
+
+        frontier = sorted(visited)
+        related = []
+        tokens = 0
+        for _ in range(max_hops):
+            next_frontier = []
+            for node_id in frontier:
+                for neighbour_id in self._neighbours(node_id):
+                    if neighbour_id in visited:
+                        continue
+                    visited.add(neighbour_id)
+                    next_frontier.append(neighbour_id)
+
+                    span_tokens = int(self._tokens[neighbour_id])
+                    if tokens + span_tokens > max_tokens:
+                        continue
+                    tokens += span_tokens
+                    related.append(neighbour_id)
+
+            frontier = next_frontier
+            if not frontier:
+                break
+
+        related_files: dict[str, FileWithSpans] = {}
+        for node_id in related:
+            file_path = self._file_path(node_id)
+            if file_path not in related_files:
+                related_files[file_path] = FileWithSpans(file_path=file_path)
+            related_files[file_path].add_span_id(self._span_ids[node_id])
+
+        return list(related_files.values())
@@ -1,8 +1,52 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel, Field
 
+from moatless_qa.utils.file import is_test
+
+
+class SearchMode(str, Enum):
+    DENSE = "dense"  # Vector search with the embedding model
+    BM25 = "bm25"  # Lexical search without calling the embedding model
+    HYBRID = "hybrid"  # Dense and BM25 results fused with reciprocal rank fusion
+
+
+@dataclass(frozen=True)
+class FilePathFilter:
+    """
+    Filter on the files to search in. It can be called with a file path like a plain filter function, and
+    vector stores can use the file sets and the category directly to filter without calling it per file.
+    """
+
+    file_pattern: Optional[str] = None
+    category: Optional[str] = None
+    include_files: frozenset[str] = field(default_factory=frozenset)
+    exclude_files: frozenset[str] = field(default_factory=frozenset)
+
+    @property
+    def key(self) -> tuple[Optional[str], Optional[str]]:
+        """The file sets are derived from the pattern and the category, so these identify the filter."""
+        return self.file_pattern, self.category
+
+    def matches_file(self, file_path: str) -> bool:
+        """Checks the file sets only, not the category."""
+        if self.exclude_files and file_path in self.exclude_files:
+            return False
+        if self.include_files and file_path not in self.include_files:
+            return False
+        return True
+
+    def __call__(self, file_path: str) -> bool:
+        if not self.matches_file(file_path):
+            return False
+        if self.category == "implementation" and is_test(file_path):
+            return False
+        if self.category == "test" and not is_test(file_path):
+            return False
+        return True
+
 
 @dataclass
 class CodeSnippet:
@@ -19,6 +63,14 @@ class CodeSnippet:
     end_block: Optional[str] = None
 
 
+@dataclass
+class LineMatch:
+    file_path: str
+    line_number: int
+    node_id: Optional[str] = None
+    span_ids: list[str] = None
+
+
 class SpanHit(BaseModel):
     span_id: str = Field(description="The span id of the relevant code in the file")
     rank: int = Field(
@@ -2,16 +2,17 @@ import difflib
 import glob
 import logging
 import os
-import subprocess
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, List, Dict
 
 from pydantic import BaseModel, Field, PrivateAttr
 
-from moatless_qa.codeblocks import get_parser_by_path
 from moatless_qa.codeblocks.module import Module
+from moatless_qa.codeblocks.module_cache import parse_module
+from moatless_qa.repository.file_tree import FileTreeIndex
 from moatless_qa.repository.repository import Repository
+from moatless_qa.repository.text_search import ExactMatchIndex
 
 logger = logging.getLogger(__name__)
 
@@ -89,9 +90,9 @@ class CodeFile(BaseModel):
     @property
     def module(self) -> Module | None:
         if self._module is None or self.has_been_modified() and self.content.strip():
-            parser = get_parser_by_path(self.file_path)
-            if parser:
-                self._module = parser.parse(self.content)
+            module = parse_module(self.file_path, self.content)
+            if module:
+                self._module = module
             else:
                 return None
 
@@ -101,6 +102,9 @@ class CodeFile(BaseModel):
 class FileRepository(Repository):
     repo_path: str = Field(..., description="The path to the repository")
 
+    _file_tree: Optional[FileTreeIndex] = PrivateAttr(None)
+    _text_index: Optional[ExactMatchIndex] = PrivateAttr(None)
+
     @property
     def repo_dir(self):
         return self.repo_path
@@ -168,6 +172,32 @@ class FileRepository(Repository):
     def is_directory(self, path: str):
         return os.path.isdir(self.get_full_path(path))
 
+    @property
+    def file_tree(self) -> FileTreeIndex:
+        """Index of all files in the repository, built on first use."""
+        if self._file_tree is None:
+            self._file_tree = FileTreeIndex.build(self.repo_path)
+        return self._file_tree
+
+    @property
+    def text_index(self) -> ExactMatchIndex:
+        """Contents of all files in the repository for exact match search, loaded on first use."""
+        if self._text_index is None:
+            self._text_index = ExactMatchIndex(self.repo_path, self.file_tree.match("**"))
+        return self._text_index
+
+    def invalidate_file_tree(self):
+        """Rebuild the file indexes on next use, call when files are changed outside of the repository."""
+        self._file_tree = None
+        self._text_index = None
+
+    def _add_to_file_tree(self, file_path: str):
+        relative_path = self.get_relative_path(file_path)
+        if self._file_tree is not None:
+            self._file_tree.add(relative_path)
+        if self._text_index is not None:
+            self._text_index.update(relative_path)
+
     def get_file(self, file_path: str):
         if file_path.startswith(self.repo_dir):
             file_path = file_path.replace(self.repo_dir, "")
@@ -199,6 +229,8 @@ class FileRepository(Repository):
         with open(full_file_path, "w") as f:
             f.write("")
 
+        self._add_to_file_tree(file_path)
+
     def save_file(self, file_path: str, updated_content: str):
         assert updated_content, "Updated content must be provided"
 
@@ -208,6 +240,8 @@ class FileRepository(Repository):
         with open(self.get_full_path(file_path), "w") as f:
             f.write(updated_content)
 
+        self._add_to_file_tree(file_path)
+
     def matching_files(self, file_pattern: str):
         """
         Returns a list of files matching the given pattern within the repository.
@@ -263,17 +297,11 @@ class FileRepository(Repository):
             if pattern_parts[-1] != filename:
                 file_pattern = "/".join(pattern_parts)
 
-            repo_path = Path(self.repo_path)
-            matched_files = []
-            for path in repo_path.glob(file_pattern):
-                if path.is_file():
-                    # For exact filename matches, verify the filename matches exactly
-                    if not has_wildcards and path.name != filename:
-                        continue
-                    relative_path = str(path.relative_to(self.repo_path)).replace(
-                        os.sep, "/"
-                    )
-                    matched_files.append(relative_path)
+            # A pattern ending with ** only matches directories when globbing, so it doesn't match any files
+            if file_pattern.rstrip("/").split("/")[-1] == "**":
+                return []
+
+            matched_files = self.file_tree.match(file_pattern)
         except Exception as e:
             logger.exception(f"Error finding files for pattern {file_pattern}:")
             return []
@@ -328,86 +356,31 @@ class FileRepository(Repository):
         self, search_text: str, file_pattern: Optional[str] = None
     ) -> List[tuple[str, int]]:
         """
-        Uses grep to search for exact text matches in files.
-        """
-        matches = []
-        if not file_pattern:
-            file_pattern = "."
-
-        try:
-            # Remove '**' and everything after it
-            grep_pattern = file_pattern
-            if "**" in grep_pattern:
-                grep_pattern = grep_pattern.split("**")[0]
-
-            if not grep_pattern:
-                grep_pattern = "."
-
-            # Always escape special regex characters to handle them literally
-            escaped_search_text = (
-                search_text.replace("[", "\\[")
-                .replace("]", "\\]")
-                .replace(".", "\\.")
-                .replace("+", "\\+")
-                .replace("*", "\\*")
-                .replace("?", "\\?")
-                .replace("|", "\\|")
-                .replace("{", "\\{")
-                .replace("}", "\\}")
-                .replace("$", "\\$")
-                .replace("^", "\\^")
-            )
+        Search for exact text matches in files. Returns (file path, line number) tuples for each matching line.
 
-            cmd = ["grep", "-n", "-r", escaped_search_text, grep_pattern]
-            logger.info(f"Executing grep command: {' '.join(cmd)}")
-            logger.info(f"Search directory: {self.repo_path}")
-
-            result = subprocess.run(
-                cmd, cwd=self.repo_path, capture_output=True, text=True
-            )
+        The file pattern is resolved like the search path of `grep -r`: everything from '**' is removed,
+        and the rest is a file, a directory or a glob pattern.
+        """
+        file_paths = None
+        if file_pattern:
+            search_path = file_pattern.split("**")[0].lstrip("/")
+            if search_path.startswith("./"):
+                search_path = search_path[2:]
+
+            if search_path in ("", "."):
+                file_paths = None
+            elif os.path.isfile(os.path.join(self.repo_path, search_path)):
+                file_paths = [search_path]
+            elif os.path.isdir(os.path.join(self.repo_path, search_path)):
+                file_paths = self.file_tree.match(f"{search_path.rstrip('/')}/**")
+            else:
+                file_paths = self.file_tree.match(search_path)
 
-            if result.returncode not in (0, 1):  # grep returns 1 if no matches found
-                logger.info(
-                    f"Grep returned non-standard exit code: {result.returncode}"
-                )
-                if result.stderr:
-                    logger.warning(f"Grep error output: {result.stderr}")
+            if file_paths is not None and not file_paths:
+                logger.info(f"No files found for file pattern {file_pattern}")
                 return []
 
-            logger.info(f"Found {len(result.stdout.splitlines())} potential matches")
-
-            for line in result.stdout.splitlines():
-                try:
-                    parts = line.split(":", 2)
-                    if len(parts) < 2:
-                        logger.info(f"Skipping malformed line: {line}")
-                        continue
-
-                    if (
-                        os.path.isfile(os.path.join(self.repo_path, file_pattern))
-                        and "/" not in parts[0]
-                    ):
-                        # Format: "5:def test_partitions():"
-                        line_num = int(parts[0])
-                        content = parts[1]
-                        file_path = file_pattern
-                    else:
-                        # Format: "path/to/file:5:def test_partitions():"
-                        file_path = parts[0]
-                        if file_path.startswith("./"):
-                            file_path = file_path[2:]
-                        line_num = int(parts[1])
-                        content = parts[2]
-
-                    matches.append((file_path, int(line_num)))
-                except (ValueError, IndexError) as e:
-                    logger.info(f"Error parsing line '{line}': {e}")
-                    continue
-
-        except subprocess.SubprocessError as e:
-            logger.info(f"Grep command failed: {e}")
-            return []
-
+        matches = self.text_index.search(search_text, file_paths)
         logger.info(f"Returning {len(matches)} matches")
         return matches
 
@@ -0,0 +1,156 @@
+import bisect
+import logging
+import os
+import re
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Directories that are never matched by file patterns
+IGNORED_DIRS = {".git"}
+
+MAX_CACHED_PATTERNS = 1024
+
+
+def _translate_segment(segment: str) -> str:
+    """Translate one path component of a glob pattern to a regex that doesn't match across '/'."""
+    regex = ""
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        i += 1
+        if char == "*":
+            # '**' within a component is treated as '*'
+            while i < len(segment) and segment[i] == "*":
+                i += 1
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            j = i
+            if j < len(segment) and segment[j] == "!":
+                j += 1
+            if j < len(segment) and segment[j] == "]":
+                j += 1
+            j = segment.find("]", j)
+            if j == -1:
+                regex += re.escape(char)
+            else:
+                chars = segment[i:j].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                elif chars.startswith("^"):
+                    chars = "\\" + chars
+                regex += f"[{chars}]"
+                i = j + 1
+        else:
+            regex += re.escape(char)
+    return regex
+
+
+def compile_glob(pattern: str) -> re.Pattern:
+    """
+    Compile a glob pattern relative to the repository root to a regex matching relative file paths.
+    '**' as a whole path component matches zero or more directories, and a trailing '**' matches all files below.
+    """
+    parts = [part for part in pattern.split("/") if part not in ("", ".")]
+    regex = ""
+    for i, part in enumerate(parts):
+        is_last = i == len(parts) - 1
+        if part == "**":
+            regex += ".*" if is_last else "(?:[^/]+/)*"
+        else:
+            regex += _translate_segment(part)
+            if not is_last:
+                regex += "/"
+    return re.compile(regex)
+
+
+def _has_wildcards(part: str) -> bool:
+    return any(c in part for c in "*?[")
+
+
+class FileTreeIndex:
+    """
+    Sorted list of the relative paths of all files in a repository, built with one walk of the file system.
+    Glob patterns are resolved against the list and the results are memoized until the tree changes.
+    """
+
+    def __init__(self, file_paths: list[str]):
+        self._paths = sorted(file_paths)
+        self._paths_by_name: Optional[dict[str, list[str]]] = None
+        self._matches: dict[str, list[str]] = {}
+
+    @classmethod
+    def build(cls, repo_path: str) -> "FileTreeIndex":
+        file_paths = []
+        for root, dirs, files in os.walk(repo_path):
+            dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+            rel_root = os.path.relpath(root, repo_path).replace(os.sep, "/")
+            for file in files:
+                file_paths.append(file if rel_root == "." else f"{rel_root}/{file}")
+
+        logger.debug(f"Indexed {len(file_paths)} files in {repo_path}.")
+        return cls(file_paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __contains__(self, file_path: str) -> bool:
+        i = bisect.bisect_left(self._paths, file_path)
+        return i < len(self._paths) and self._paths[i] == file_path
+
+    def add(self, file_path: str):
+        if file_path in self:
+            return
+        bisect.insort(self._paths, file_path)
+        self._paths_by_name = None
+        self._matches.clear()
+
+    def remove(self, file_path: str):
+        i = bisect.bisect_left(self._paths, file_path)
+        if i < len(self._paths) and self._paths[i] == file_path:
+            del self._paths[i]
+            self._paths_by_name = None
+            self._matches.clear()
+
+    def _candidates(self, parts: list[str]) -> list[str]:
+        # Exact file names are looked up by name
+        if parts and not _has_wildcards(parts[-1]) and parts[-1] != "**":
+            if self._paths_by_name is None:
+                self._paths_by_name = {}
+                for path in self._paths:
+                    self._paths_by_name.setdefault(
+                        path.rsplit("/", 1)[-1], []
+                    ).append(path)
+            return self._paths_by_name.get(parts[-1], [])
+
+        # Leading directories without wildcards limit the search to a range of the sorted paths
+        prefix_parts = []
+        for part in parts[:-1]:
+            if _has_wildcards(part) or part == "**":
+                break
+            prefix_parts.append(part)
+
+        if prefix_parts:
+            prefix = "/".join(prefix_parts) + "/"
+            start = bisect.bisect_left(self._paths, prefix)
+            end = bisect.bisect_left(self._paths, prefix[:-1] + chr(ord("/") + 1))
+            return self._paths[start:end]
+
+        return self._paths
+
+    def match(self, pattern: str) -> list[str]:
+        matches = self._matches.get(pattern)
+        if matches is None:
+            parts = [part for part in pattern.split("/") if part not in ("", ".")]
+            regex = compile_glob(pattern)
+            matches = [
+                path for path in self._candidates(parts) if regex.fullmatch(path)
+            ]
+
+            if len(self._matches) >= MAX_CACHED_PATTERNS:
+                self._matches.clear()
+            self._matches[pattern] = matches
+
+        return list(matches)
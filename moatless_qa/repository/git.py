@@ -115,6 +115,8 @@ class GitRepository(FileRepository):
         except Exception as e:
             logger.error(f"Error checking out commit {self.current_commit}: {e}")
 
+        self.invalidate_file_tree()
+
         # TODO: Check diff and only reset changed files
 
     def clean_untracked_files(self):
@@ -235,6 +237,31 @@ class GitRepository(FileRepository):
             else:
                 return None
 
+    def rev_parse(self, rev: str) -> str:
+        """Returns the commit hash of the revision."""
+        return self._repo.rev_parse(rev).hexsha
+
+    def diff_files(
+        self, from_commit: str, to_commit: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        Returns the files changed between two commits mapped to their git status letter
+        (A, M, D, T). Renames are reported as a deleted and an added file.
+        """
+        to_commit = to_commit or self.current_commit
+        name_status = self._repo.git.diff(
+            "--name-status", "--no-renames", from_commit, to_commit
+        )
+
+        changed_files = {}
+        for line in name_status.splitlines():
+            parts = line.split("\t")
+            if len(parts) < 2:
+                continue
+            changed_files[parts[-1]] = parts[0][0]
+
+        return changed_files
+
     def model_dump(self, **kwargs) -> Dict[str, Any]:
         dump = super().model_dump(**kwargs)
         dump.update(
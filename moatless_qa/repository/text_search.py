@@ -0,0 +1,120 @@
+import logging
+import os
+from typing import Iterable, Optional
+
+from moatless_qa.utils.trigram import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+# Files with a null byte in the beginning are treated as binary and not searched, like grep does
+BINARY_CHECK_BYTES = 8192
+
+
+def _matching_lines(content: bytes, needles: list[bytes]) -> list[int]:
+    """Returns the sorted 1-based numbers of the lines containing any of the needles."""
+    positions = []
+    for needle in needles:
+        start = content.find(needle)
+        while start != -1:
+            positions.append(start)
+            # Each line is only reported once
+            line_end = content.find(b"\n", start)
+            if line_end == -1:
+                break
+            start = content.find(needle, line_end + 1)
+
+    positions.sort()
+    lines = []
+    line = 1
+    last_position = 0
+    for position in positions:
+        line += content.count(b"\n", last_position, position)
+        last_position = position
+        if not lines or lines[-1] != line:
+            lines.append(line)
+    return lines
+
+
+class ExactMatchIndex:
+    """
+    In-memory corpus of the files in a repository with a trigram index to find the files that
+    can contain a searched text. Files saved after the index was built are always searched.
+    """
+
+    def __init__(self, repo_path: str, file_paths: Iterable[str]):
+        self._repo_path = repo_path
+        self._paths = list(file_paths)
+        self._doc_id_by_path = {path: i for i, path in enumerate(self._paths)}
+        self._contents = [self._read(path) for path in self._paths]
+        self._trigram_index = TrigramIndex.build(self._contents)
+        self._indexed_count = len(self._paths)
+        self._changed: set[int] = set()
+
+        logger.debug(
+            f"Indexed {len(self._paths)} files for exact match search in {repo_path}."
+        )
+
+    def _read(self, file_path: str) -> bytes:
+        try:
+            with open(os.path.join(self._repo_path, file_path), "rb") as f:
+                content = f.read()
+        except OSError as e:
+            logger.debug(f"Could not read {file_path}: {e}")
+            return b""
+
+        if b"\0" in content[:BINARY_CHECK_BYTES]:
+            return b""
+        return content
+
+    def update(self, file_path: str):
+        """Reload a file that has been created or changed."""
+        doc_id = self._doc_id_by_path.get(file_path)
+        if doc_id is None:
+            self._doc_id_by_path[file_path] = len(self._paths)
+            self._paths.append(file_path)
+            self._contents.append(self._read(file_path))
+        else:
+            self._contents[doc_id] = self._read(file_path)
+            if doc_id < self._indexed_count:
+                self._changed.add(doc_id)
+
+    def _candidates(self, needles: list[bytes]) -> set[int]:
+        candidates = set()
+        for needle in needles:
+            doc_ids = self._trigram_index.candidates(needle)
+            if doc_ids is None:
+                return set(range(len(self._paths)))
+            candidates.update(doc_ids.tolist())
+
+        candidates.update(self._changed)
+        candidates.update(range(self._indexed_count, len(self._paths)))
+        return candidates
+
+    def search(
+        self, search_text: str, file_paths: Optional[Iterable[str]] = None
+    ) -> list[tuple[str, int]]:
+        """
+        Find the lines containing the search text, in the given files or in all files. Like grep, each
+        line of a multiline search text is searched for separately.
+        """
+        needles = [line.encode("utf-8") for line in search_text.split("\n") if line]
+        if not needles:
+            return []
+
+        candidates = self._candidates(needles)
+        if file_paths is not None:
+            candidates &= {
+                self._doc_id_by_path[path]
+                for path in file_paths
+                if path in self._doc_id_by_path
+            }
+
+        matches = []
+        for doc_id in sorted(candidates, key=lambda i: self._paths[i]):
+            for line_num in _matching_lines(self._contents[doc_id], needles):
+                matches.append((self._paths[doc_id], line_num))
+
+        logger.debug(
+            f"Searched {len(candidates)} of {len(self._paths)} files, found {len(matches)} matches."
+        )
+        return matches
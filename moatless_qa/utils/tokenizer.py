@@ -1,48 +1,178 @@
+import hashlib
+import importlib.util
+import logging
+import math
 import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
 
-_enc = None
+logger = logging.getLogger(__name__)
 
-_voyageai = None
+DEFAULT_MODEL = "gpt-3.5-turbo"
 
+# Token counts are cached by content hash as the same blocks and prompts are counted over and over
+TOKEN_CACHE_SIZE = 100_000
 
-def count_tokens(content: str, model: str = "gpt-3.5-turbo") -> int:
-    global _enc, _voyageai
+# Average number of utf-8 bytes per token for code with cl100k_base, used by estimate_tokens()
+BYTES_PER_TOKEN = 3.8
 
-    if model.startswith("voyage"):
-        if _voyageai is None:
-            voyageai_import_err = (
-                "`voyageai` package not found, please run `pip install voyageai`"
-            )
-            try:
-                import voyageai
-            except ImportError as e:
-                raise ImportError(voyageai_import_err) from e
-
-            _voyageai = voyageai.Client()
-
-        return _voyageai.count_tokens([content])
-
-    if _enc is None:
-        tiktoken_import_err = (
-            "`tiktoken` package not found, please run `pip install tiktoken`"
+# Voyage models use their own tokenizers, published on the Hugging Face hub. If a tokenizer can't be loaded,
+# e.g. when offline without a cached copy, counts are approximated with cl100k_base scaled by this ratio.
+VOYAGE_TOKENIZER_REPO = "voyageai/{model}"
+VOYAGE_TOKEN_RATIO = 1.15
+
+_encodings: dict[str, Any] = {}
+
+_voyage_tokenizers: dict[str, Any] = {}
+
+_token_counts: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def _get_voyage_tokenizer(model: str):
+    """Returns the local tokenizer for the Voyage model, or None if it isn't available."""
+    if model in _voyage_tokenizers:
+        return _voyage_tokenizers[model]
+
+    tokenizer = None
+    try:
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_pretrained(
+            VOYAGE_TOKENIZER_REPO.format(model=model)
         )
-        try:
-            import tiktoken
-        except ImportError as e:
-            raise ImportError(tiktoken_import_err) from e
-
-        # set tokenizer cache temporarily
-        should_revert = False
-        if "TIKTOKEN_CACHE_DIR" not in os.environ:
-            should_revert = True
-            os.environ["TIKTOKEN_CACHE_DIR"] = os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                "_static/tiktoken_cache",
-            )
-
-        _enc = tiktoken.encoding_for_model(model)
-
-        if should_revert:
-            del os.environ["TIKTOKEN_CACHE_DIR"]
-
-    return len(_enc.encode(content, allowed_special="all"))
+    except Exception as e:
+        logger.warning(
+            f"Could not load tokenizer for {model}, token counts will be approximated with tiktoken. Error: {e}"
+        )
+
+    # Failures are cached too so that the hub isn't requested again for every count
+    _voyage_tokenizers[model] = tokenizer
+    return tokenizer
+
+
+def _tiktoken_cache_dir() -> Optional[str]:
+    """Returns the BPE files bundled with llama_index, so that encodings can be loaded without downloading them."""
+    try:
+        spec = importlib.util.find_spec("llama_index.core")
+    except ImportError:
+        return None
+
+    if not spec or not spec.origin:
+        return None
+
+    cache_dir = os.path.join(os.path.dirname(spec.origin), "_static/tiktoken_cache")
+    if os.path.isdir(cache_dir):
+        return cache_dir
+    return None
+
+
+def _get_encoding(model: str):
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+
+    tiktoken_import_err = (
+        "`tiktoken` package not found, please run `pip install tiktoken`"
+    )
+    try:
+        import tiktoken
+    except ImportError as e:
+        raise ImportError(tiktoken_import_err) from e
+
+    # set tokenizer cache temporarily
+    should_revert = False
+    cache_dir = _tiktoken_cache_dir()
+    if "TIKTOKEN_CACHE_DIR" not in os.environ and cache_dir:
+        should_revert = True
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Models unknown to tiktoken, like local embedding models, are approximated with cl100k_base
+        encoding = tiktoken.get_encoding("cl100k_base")
+
+    if should_revert:
+        del os.environ["TIKTOKEN_CACHE_DIR"]
+
+    _encodings[model] = encoding
+    return encoding
+
+
+def _cache_key(content: str, model: str) -> tuple[str, bytes]:
+    digest = hashlib.blake2b(
+        content.encode("utf-8", errors="surrogatepass"), digest_size=16
+    ).digest()
+    return model, digest
+
+
+def _count_uncached(contents: list[str], model: str) -> list[int]:
+    if model.startswith("voyage"):
+        tokenizer = _get_voyage_tokenizer(model)
+        if tokenizer:
+            return [len(encoded.ids) for encoded in tokenizer.encode_batch(contents)]
+
+        return [
+            math.ceil(count * VOYAGE_TOKEN_RATIO)
+            for count in _count_uncached(contents, DEFAULT_MODEL)
+        ]
+
+    encoding = _get_encoding(model)
+    if len(contents) == 1:
+        return [len(encoding.encode(contents[0], allowed_special="all"))]
+
+    return [
+        len(tokens)
+        for tokens in encoding.encode_batch(contents, allowed_special="all")
+    ]
+
+
+def count_tokens(content: str, model: str = DEFAULT_MODEL) -> int:
+    return count_tokens_batch([content], model)[0]
+
+
+def count_tokens_batch(contents: list[str], model: str = DEFAULT_MODEL) -> list[int]:
+    """
+    Count tokens in several texts. Texts that haven't been counted before are encoded in one batch,
+    which tiktoken runs in parallel threads.
+    """
+    keys = [_cache_key(content, model) for content in contents]
+
+    counts: dict[tuple[str, bytes], int] = {}
+    with _token_counts_lock:
+        for key in keys:
+            count = _token_counts.get(key)
+            if count is not None:
+                _token_counts.move_to_end(key)
+                counts[key] = count
+
+    missing = {}
+    for key, content in zip(keys, contents, strict=True):
+        if key not in counts:
+            missing.setdefault(key, content)
+
+    if missing:
+        new_counts = _count_uncached(list(missing.values()), model)
+        counts.update(zip(missing.keys(), new_counts, strict=True))
+
+        with _token_counts_lock:
+            for key, count in zip(missing.keys(), new_counts, strict=True):
+                _token_counts[key] = count
+            while len(_token_counts) > TOKEN_CACHE_SIZE:
+                _token_counts.popitem(last=False)
+
+    return [counts[key] for key in keys]
+
+
+def estimate_tokens(content: str) -> int:
+    """
+    Fast approximation of the number of tokens from the utf-8 length of the content, for budget checks
+    where an exact count isn't needed.
+    """
+    if not content:
+        return 0
+    return math.ceil(
+        len(content.encode("utf-8", errors="surrogatepass")) / BYTES_PER_TOKEN
+    )
@@ -0,0 +1,120 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+
+def trigrams(data: bytes) -> np.ndarray:
+    """Returns the sorted unique byte trigrams in data, each packed into an uint32."""
+    if len(data) < 3:
+        return np.empty(0, dtype=np.uint32)
+
+    arr = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+    packed = (arr[:-2] << 16) | (arr[1:-1] << 8) | arr[2:]
+    return np.unique(packed)
+
+
+class TrigramIndex:
+    """
+    Inverted index from byte trigrams to the ids of the documents containing them, stored as
+    sorted trigram keys and CSR posting lists. Used to find candidate documents for substring searches.
+    """
+
+    def __init__(self, keys: np.ndarray, offsets: np.ndarray, doc_ids: np.ndarray):
+        self._keys = keys
+        self._offsets = offsets
+        self._doc_ids = doc_ids
+
+    @classmethod
+    def build(cls, documents: list[bytes]) -> "TrigramIndex":
+        per_doc = [trigrams(document) for document in documents]
+        if per_doc:
+            all_trigrams = np.concatenate(per_doc)
+            all_doc_ids = np.repeat(
+                np.arange(len(per_doc), dtype=np.int32),
+                [len(doc_trigrams) for doc_trigrams in per_doc],
+            )
+        else:
+            all_trigrams = np.empty(0, dtype=np.uint32)
+            all_doc_ids = np.empty(0, dtype=np.int32)
+
+        # Stable sort keeps the doc ids in each posting list sorted
+        order = np.argsort(all_trigrams, kind="stable")
+        all_trigrams = all_trigrams[order]
+        all_doc_ids = all_doc_ids[order]
+
+        keys, starts = np.unique(all_trigrams, return_index=True)
+        offsets = np.append(starts, len(all_trigrams)).astype(np.int64)
+        return cls(keys, offsets, all_doc_ids)
+
+    def update(self, keep: np.ndarray, documents: list[bytes]) -> "TrigramIndex":
+        """
+        Returns an index with only the documents where keep is set, renumbered in order, followed by the
+        new documents. Only the new documents are read, the kept posting lists are filtered as arrays.
+        """
+        new_ids = np.cumsum(keep, dtype=np.int64) - 1
+        posting_keys = np.repeat(self._keys, np.diff(self._offsets))
+        kept = keep[self._doc_ids]
+        posting_keys = posting_keys[kept]
+        posting_doc_ids = new_ids[self._doc_ids[kept]].astype(np.int32)
+
+        per_doc = [trigrams(document) for document in documents]
+        if per_doc:
+            start_id = int(keep.sum())
+            posting_keys = np.concatenate([posting_keys, *per_doc])
+            posting_doc_ids = np.concatenate(
+                [
+                    posting_doc_ids,
+                    np.repeat(
+                        np.arange(start_id, start_id + len(per_doc), dtype=np.int32),
+                        [len(doc_trigrams) for doc_trigrams in per_doc],
+                    ),
+                ]
+            )
+
+        # New documents have the highest ids, so a stable sort keeps the doc ids in each posting list sorted
+        order = np.argsort(posting_keys, kind="stable")
+        posting_keys = posting_keys[order]
+        posting_doc_ids = posting_doc_ids[order]
+
+        keys, starts = np.unique(posting_keys, return_index=True)
+        offsets = np.append(starts, len(posting_keys)).astype(np.int64)
+        return TrigramIndex(keys.astype(np.uint32), offsets, posting_doc_ids)
+
+    def postings(self, trigram: int) -> np.ndarray:
+        i = int(np.searchsorted(self._keys, trigram))
+        if i < len(self._keys) and self._keys[i] == trigram:
+            return self._doc_ids[self._offsets[i] : self._offsets[i + 1]]
+        return np.empty(0, dtype=np.int32)
+
+    def candidates(self, needle: bytes) -> Optional[np.ndarray]:
+        """
+        Returns the sorted ids of the documents that contain all trigrams of the needle. Returns None if
+        the needle is too short to be filtered on, meaning that all documents are candidates.
+        """
+        needle_trigrams = trigrams(needle)
+        if len(needle_trigrams) == 0:
+            return None
+
+        # Intersect the shortest posting lists first
+        postings = sorted(
+            (self.postings(int(trigram)) for trigram in needle_trigrams), key=len
+        )
+        result = postings[0]
+        for posting in postings[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+    def save(self, path: str):
+        np.savez(path, keys=self._keys, offsets=self._offsets, doc_ids=self._doc_ids)
+
+    @classmethod
+    def load(cls, path: str) -> "TrigramIndex":
+        with np.load(path) as data:
+            return cls(data["keys"], data["offsets"], data["doc_ids"])
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(path)
@@ -0,0 +1,106 @@
+import hashlib
+import subprocess
+
+import pytest
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+from moatless_qa.index.code_index import CodeIndex
+from moatless_qa.index.settings import IndexSettings
+from moatless_qa.repository.git import GitRepository
+
+EMBEDDING_DIMENSIONS = 32
+
+REPO_FILES = {
+    "pkg/__init__.py": "",
+    "pkg/models.py": (
+        "class User:\n"
+        "    def __init__(self, name):\n"
+        "        self.name = name\n"
+        "\n"
+        "    def greet(self):\n"
+        "        return 'hi ' + self.name\n"
+    ),
+    "pkg/service.py": (
+        "from pkg.models import User\n"
+        "\n"
+        "\n"
+        "def make_user(name):\n"
+        "    user = User(name)\n"
+        "    return user.greet()\n"
+    ),
+    "tests/test_service.py": (
+        "from pkg.service import make_user\n"
+        "\n"
+        "\n"
+        "def test_make_user():\n"
+        "    assert make_user('a')\n"
+    ),
+}
+
+
+class HashEmbedding(BaseEmbedding):
+    """Deterministic bag of words embedding, so that indexes can be built without an embedding API."""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * EMBEDDING_DIMENSIONS
+        for word in text.split():
+            digest = hashlib.md5(word.encode("utf-8")).hexdigest()
+            vector[int(digest, 16) % EMBEDDING_DIMENSIONS] += 1.0
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+def git(repo_path, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=repo_path,
+        check=True,
+        capture_output=True,
+    )
+
+
+def write_files(repo_path, files: dict[str, str]):
+    for file_path, content in files.items():
+        path = repo_path / file_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+@pytest.fixture
+def repo_path(tmp_path):
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    write_files(repo_path, REPO_FILES)
+    git(repo_path, "init", "-q")
+    git(repo_path, "add", ".")
+    git(repo_path, "commit", "-qm", "Initial commit")
+    return repo_path
+
+
+@pytest.fixture
+def repository(repo_path):
+    return GitRepository(repo_path=str(repo_path))
+
+
+@pytest.fixture
+def code_index(repository):
+    code_index = CodeIndex(
+        file_repo=repository,
+        embed_model=HashEmbedding(),
+        settings=IndexSettings(dimensions=EMBEDDING_DIMENSIONS),
+    )
+    code_index.run_ingestion()
+    return code_index
@@ -0,0 +1,238 @@
+import subprocess
+
+import pytest
+
+from moatless_qa.index import CodeIndex
+from moatless_qa.index.bm25 import BM25Index
+from moatless_qa.index.settings import IndexSettings
+from moatless_qa.repository.git import GitRepository
+from moatless_qa.schema import FileWithSpans
+from tests.conftest import EMBEDDING_DIMENSIONS, HashEmbedding, git, write_files
+
+
+def grep(repo_path, search_text: str) -> list[tuple[str, int]]:
+    result = subprocess.run(
+        ["grep", "-rnF", "--include=*.py", search_text, "."],
+        cwd=repo_path,
+        capture_output=True,
+        text=True,
+    )
+    matches = []
+    for line in result.stdout.splitlines():
+        file_path, line_number, _ = line.split(":", 2)
+        matches.append((file_path.removeprefix("./"), int(line_number)))
+    return sorted(matches)
+
+
+def hit_files(response) -> set[str]:
+    return {hit.file_path for hit in response.hits}
+
+
+def test_create_code_index(repository):
+    code_index = CodeIndex(
+        file_repo=repository,
+        embed_model=HashEmbedding(),
+        settings=IndexSettings(dimensions=EMBEDDING_DIMENSIONS),
+    )
+
+    assert code_index.semantic_search("user").hits == []
+
+
+def test_semantic_search(code_index):
+    response = code_index.semantic_search("make a user and greet")
+
+    assert hit_files(response) == {
+        "pkg/models.py",
+        "pkg/service.py",
+        "tests/test_service.py",
+    }
+
+
+def test_semantic_search_with_filters(code_index):
+    implementation = code_index.semantic_search("make user", category="implementation")
+    assert hit_files(implementation) == {"pkg/models.py", "pkg/service.py"}
+
+    tests = code_index.semantic_search("make user", category="test")
+    assert hit_files(tests) == {"tests/test_service.py"}
+
+    pattern = code_index.semantic_search("make user", file_pattern="pkg/models.py")
+    assert hit_files(pattern) == {"pkg/models.py"}
+
+
+def test_semantic_search_persisted(code_index, repository, tmp_path):
+    persist_dir = str(tmp_path / "index")
+    code_index.persist(persist_dir)
+
+    loaded = CodeIndex.from_persist_dir(
+        persist_dir, file_repo=repository, embed_model=HashEmbedding()
+    )
+
+    query = "make a user and greet"
+    assert [hit.file_path for hit in loaded.semantic_search(query).hits] == [
+        hit.file_path for hit in code_index.semantic_search(query).hits
+    ]
+    assert hit_files(loaded.semantic_search(query, category="test")) == {
+        "tests/test_service.py"
+    }
+
+
+@pytest.mark.parametrize(
+    "search_text", ["self.name", "make_user", "import", "return", "not in the repo"]
+)
+def test_find_exact_matches_like_grep(code_index, repo_path, search_text):
+    matches = code_index.find_exact_matches(search_text)
+
+    assert sorted(matches) == grep(repo_path, search_text)
+
+
+def test_find_exact_matches_in_unindexed_files(code_index, repository, repo_path):
+    write_files(
+        repo_path,
+        {
+            "README.md": "Call make_user to create a user.\n",
+            "pkg/billing.py": "from pkg.service import make_user\n",
+        },
+    )
+    repository.invalidate_file_tree()
+
+    matches = code_index.find_exact_matches("make_user")
+
+    assert matches == sorted(grep(repo_path, "make_user") + [("README.md", 1)])
+    assert ("pkg/billing.py", 1) in matches
+
+
+def test_find_related_spans(code_index):
+    related = code_index.find_related_spans(
+        [FileWithSpans(file_path="pkg/service.py", span_ids=["make_user"])]
+    )
+
+    related_spans = {file.file_path: file.span_ids for file in related}
+    assert "User" in related_spans["pkg/models.py"]
+
+
+def test_update_from_git(code_index, repository, repo_path):
+    base_commit = repository.current_commit
+
+    write_files(
+        repo_path,
+        {
+            "pkg/models.py": (
+                "class User:\n"
+                "    def __init__(self, name):\n"
+                "        self.name = name\n"
+                "\n"
+                "    def farewell(self):\n"
+                "        return 'bye ' + self.name\n"
+            ),
+            "pkg/billing.py": "def charge(user, amount):\n    return amount\n",
+        },
+    )
+    (repo_path / "pkg/service.py").unlink()
+    git(repo_path, "add", "-A")
+    git(repo_path, "commit", "-qm", "Update")
+
+    embedded_nodes, _ = code_index.update_from_git(
+        GitRepository(repo_path=str(repo_path)), base_commit
+    )
+
+    assert embedded_nodes == 2
+    assert hit_files(code_index.semantic_search("user")) == {
+        "pkg/models.py",
+        "pkg/billing.py",
+        "tests/test_service.py",
+    }
+
+    for search_text in ["farewell", "greet", "charge", "make_user"]:
+        assert sorted(code_index.find_exact_matches(search_text)) == grep(
+            repo_path, search_text
+        )
+
+    # The incrementally updated BM25 index scores the same as one built from the docstore
+    rebuilt = BM25Index.build(code_index._docstore.docs.values())
+    for query in ["user name", "bye", "charge amount"]:
+        assert code_index._bm25_index.search(query, top_k=10) == rebuilt.search(
+            query, top_k=10
+        )
+
+
+def test_update_from_git_persisted(code_index, repository, repo_path, tmp_path):
+    base_commit = repository.current_commit
+
+    write_files(
+        repo_path,
+        {
+            "pkg/models.py": (
+                "class User:\n"
+                "    def __init__(self, name):\n"
+                "        self.name = name\n"
+                "\n"
+                "    def greet(self):\n"
+                "        return 'hi there ' + self.name\n"
+            ),
+        },
+    )
+    git(repo_path, "commit", "-qam", "Update")
+
+    code_index.update_from_git(GitRepository(repo_path=str(repo_path)), base_commit)
+
+    persist_dir = str(tmp_path / "index")
+    code_index.persist(persist_dir)
+    loaded = CodeIndex.from_persist_dir(
+        persist_dir, file_repo=repository, embed_model=HashEmbedding()
+    )
+
+    # The re-embedded chunks keep their node ids, and must still be found after the old vectors are deleted
+    query = "hi there user"
+    assert [hit.file_path for hit in loaded.semantic_search(query).hits] == [
+        hit.file_path for hit in code_index.semantic_search(query).hits
+    ]
+    assert "pkg/models.py" in hit_files(loaded.semantic_search(query))
+
+    data = loaded._vector_store._data
+    for text_id in data.vector_id_to_text_id.values():
+        assert text_id in data.metadata_dict
+        assert text_id in data.text_id_to_ref_doc_id
+
+
+def test_update_from_git_not_checked_out(code_index, repository, repo_path):
+    base_commit = repository.current_commit
+
+    write_files(
+        repo_path, {"pkg/billing.py": "def charge(user, amount):\n    return amount\n"}
+    )
+    git(repo_path, "add", "-A")
+    git(repo_path, "commit", "-qm", "Update")
+    commit = GitRepository(repo_path=str(repo_path)).current_commit
+    git(repo_path, "checkout", "-q", base_commit)
+
+    with pytest.raises(ValueError):
+        code_index.update_from_git(
+            GitRepository(repo_path=str(repo_path)), base_commit, commit
+        )
+
+
+class NegatedHashEmbedding(HashEmbedding):
+    @classmethod
+    def class_name(cls) -> str:
+        return "NegatedHashEmbedding"
+
+    def _embed(self, text: str) -> list[float]:
+        return [-value for value in super()._embed(text)]
+
+
+def test_query_embedding_cache_per_model(repository, tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_DIR", str(tmp_path / "cache"))
+
+    def query_embedding(embed_model):
+        code_index = CodeIndex(
+            file_repo=repository,
+            embed_model=embed_model,
+            settings=IndexSettings(dimensions=EMBEDDING_DIMENSIONS),
+        )
+        return code_index._get_query_embeddings(["make a user"])[0]
+
+    embedding = query_embedding(HashEmbedding())
+
+    # The settings name the same model, the cached query embedding of the other model must not be used
+    negated = query_embedding(NegatedHashEmbedding())
+    assert negated == [-value for value in embedding]
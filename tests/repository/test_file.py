@@ -0,0 +1,31 @@
+import pytest
+
+from moatless_qa.repository.file import FileRepository
+
+
+@pytest.mark.parametrize(
+    "file_pattern, expected",
+    [
+        ("models.py", ["pkg/models.py"]),
+        ("pkg/service.py", ["pkg/service.py"]),
+        (
+            "*.py",
+            [
+                "pkg/__init__.py",
+                "pkg/models.py",
+                "pkg/service.py",
+                "tests/test_service.py",
+            ],
+        ),
+        ("**/test*/*.py", ["tests/test_service.py"]),
+        # Fixed up to pkg/**/*.py, globbing the pattern as given failed
+        ("pkg/**.py", ["pkg/__init__.py", "pkg/models.py", "pkg/service.py"]),
+        # Like Path.glob, patterns ending with ** only match directories
+        ("**/test*/**", []),
+        ("pkg/**", []),
+    ],
+)
+def test_matching_files(repo_path, file_pattern, expected):
+    repository = FileRepository(repo_path=str(repo_path))
+
+    assert sorted(repository.matching_files(file_pattern)) == expected
@@ -0,0 +1,82 @@
+from moatless_qa.file_context import FileContext
+from moatless_qa.repository.file import FileRepository
+
+
+def create_file_context(repo_path) -> FileContext:
+    file_context = FileContext(repo=FileRepository(repo_path=str(repo_path)))
+    file_context.add_file("pkg/models.py", add_extra=False)
+    file_context.add_file("pkg/service.py", add_extra=False)
+    return file_context
+
+
+def test_clone_shares_unchanged_files(repo_path):
+    file_context = create_file_context(repo_path)
+
+    cloned = file_context.clone()
+
+    assert cloned.files == file_context.files
+    for original_file, cloned_file in zip(file_context.files, cloned.files):
+        assert cloned_file is original_file
+
+
+def test_clone_copies_file_on_write(repo_path):
+    file_context = create_file_context(repo_path)
+    original_file = file_context.get_context_file("pkg/models.py")
+    original_prompt = file_context.create_prompt()
+
+    cloned = file_context.clone()
+    cloned_file = cloned.get_context_file("pkg/models.py")
+    cloned_file.show_all_spans = True
+    cloned_file.spans.clear()
+
+    assert cloned_file is not original_file
+    assert not original_file.show_all_spans
+    assert file_context._files["pkg/models.py"] is original_file
+    assert file_context.create_prompt() == original_prompt
+    assert "class User" in cloned.create_prompt()
+
+    # Files that weren't changed are still shared
+    assert cloned._files["pkg/service.py"] is file_context._files["pkg/service.py"]
+
+
+def test_clone_isolates_changes_in_original(repo_path):
+    file_context = create_file_context(repo_path)
+    cloned = file_context.clone()
+    cloned_prompt = cloned.create_prompt()
+
+    file_context.get_context_file("pkg/service.py").show_all_spans = True
+    file_context.add_file("tests/test_service.py", add_extra=False)
+
+    assert not cloned.get_context_file("pkg/service.py").show_all_spans
+    assert not cloned.has_file("tests/test_service.py")
+    assert cloned.create_prompt() == cloned_prompt
+
+
+def test_clone_copies_flagged_files(repo_path):
+    file_context = create_file_context(repo_path)
+    original_file = file_context.get_context_file("pkg/models.py")
+    original_file.was_viewed = True
+
+    cloned = file_context.clone()
+    cloned_file = cloned._files["pkg/models.py"]
+
+    assert cloned_file is not original_file
+    assert not cloned_file.was_viewed
+    assert original_file.was_viewed
+
+
+def test_cloned_prompt_cache_is_not_shared(repo_path):
+    file_context = create_file_context(repo_path)
+    file_context.get_context_file("pkg/models.py").show_all_spans = True
+    original_prompt = file_context.create_prompt()
+
+    cloned = file_context.clone()
+    cloned_file = cloned.get_context_file("pkg/models.py")
+    cloned_file.show_all_spans = False
+
+    assert "class User" not in cloned.create_prompt()
+    assert file_context.create_prompt() == original_prompt
+    assert (
+        cloned_file._prompt_cache
+        is not file_context.get_context_file("pkg/models.py")._prompt_cache
+    )